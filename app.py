@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, Response, request
 import threading
 import os
 import asyncio
@@ -7,6 +7,11 @@ import signal
 import sys
 from pyrogram import Client
 from config import Config
+from plugins.functions.metrics import registry
+from plugins.functions.http_client import http_client
+from plugins.functions.storage import storage
+from plugins.functions.stream_upload import close_media_sessions
+from plugins.functions.upload_farm import upload_farm
 
 app = Flask(__name__)
 
@@ -30,6 +35,11 @@ def health_check():
     """Health check endpoint for monitoring"""
     return {"status": "healthy", "bot_running": bot_running}
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Prometheus metrics of the bot"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/webhook", methods=['POST'])
 def webhook():
     """Webhook endpoint for future use"""
@@ -56,8 +66,12 @@ async def start_bot():
         logger.info("Starting Telegram bot...")
         
         # Start bot
+        http_client.start()
         await bot_instance.start()
+        await upload_farm.start()
         bot_running = True
+        # first sweep reclaims what a previous run left behind
+        storage.start_janitor()
         logger.info("Bot started successfully!")
         
         # Keep the bot running until stop_event is set
@@ -72,11 +86,14 @@ async def start_bot():
     finally:
         if bot_instance:
             try:
+                await close_media_sessions()
+                await upload_farm.stop()
                 await bot_instance.stop()
                 logger.info("Bot stopped successfully")
             except Exception as e:
                 logger.error(f"Error stopping bot: {e}")
             bot_running = False
+        await http_client.close()
 
 def run_bot_sync():
     """Run the bot synchronously in a separate thread"""
@@ -0,0 +1,85 @@
+"""
+Request setup latency of a session per download vs the shared pooled session.
+
+A local aiohttp server answers small GETs on ``localhost``; the requests
+are made first the way downloads used to, each with a new
+``ClientSession`` (DNS lookup and TCP connect every time), then through
+``http_client``, which keeps the connection alive and caches DNS.
+
+    python -m benchmarks.bench_http_session --requests 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+from plugins.functions.http_client import HttpClient
+
+
+def make_app():
+    async def handler(_request):
+        return web.Response(body=b"ok")
+
+    app = web.Application()
+    app.router.add_get("/probe", handler)
+    return app
+
+
+async def fresh_session(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            await response.read()
+
+
+async def pooled_session(client, url):
+    async with client.session.get(url) as response:
+        await response.read()
+
+
+async def measure(run, requests):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await run()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+async def main(args):
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://localhost:{port}/probe"
+
+    client = HttpClient(limit=16, limit_per_host=8, dns_ttl=300, keepalive=60)
+    client.start()
+    for name, run in (
+        ("new session", lambda: fresh_session(url)),
+        ("pooled session", lambda: pooled_session(client, url)),
+    ):
+        latencies = sorted(await measure(run, args.requests))
+        print(
+            f"{name:<15} mean {statistics.mean(latencies):6.2f} ms  "
+            f"p50 {latencies[len(latencies) // 2]:6.2f} ms  "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms"
+        )
+    stats = client.stats()
+    print(
+        f"pooled: {stats['connections_created']} connections opened, "
+        f"{stats['connections_reused']} reused, "
+        f"{stats['dns_cache_hits']} DNS cache hits"
+    )
+    await client.close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""
+CPU time per GiB of writing a direct download to disk.
+
+The network is left out: chunks of a payload in memory are written the
+way ``download_coroutine`` used to (``CHUNK_SIZE`` byte chunks), the way
+it does now (``CHUNK_SIZE`` KiB chunks, one blocking ``write`` each, on
+the event loop) and with every chunk handed to the default executor.
+CPU time counts every thread of the process; the longest stall is the
+longest time the event loop could not run anything else.
+
+    python -m benchmarks.bench_inline_writes --size 256
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from config import Config
+
+MiB = 1024 * 1024
+
+
+def chunks(payload, size):
+    for offset in range(0, len(payload), size):
+        yield payload[offset: offset + size]
+
+
+async def inline_writes(path, payload, chunk_size):
+    with open(path, "wb") as f:
+        for chunk in chunks(payload, chunk_size):
+            f.write(chunk)
+            # the download loop yields to the event loop between chunks
+            await asyncio.sleep(0)
+
+
+async def executor_writes(path, payload, chunk_size):
+    loop = asyncio.get_running_loop()
+    with open(path, "wb") as f:
+        for chunk in chunks(payload, chunk_size):
+            await loop.run_in_executor(None, f.write, chunk)
+
+
+async def longest_stall(done):
+    longest, last = 0.0, time.perf_counter()
+    while not done.is_set():
+        await asyncio.sleep(0)
+        now = time.perf_counter()
+        longest, last = max(longest, now - last), now
+    return longest
+
+
+async def main(args):
+    payload = os.urandom(args.size * MiB)
+    chunk = Config.CHUNK_SIZE * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "download")
+        for name, run in (
+            (
+                f"{Config.CHUNK_SIZE} B inline",
+                lambda: inline_writes(path, payload, Config.CHUNK_SIZE),
+            ),
+            (
+                f"{Config.CHUNK_SIZE} KiB inline",
+                lambda: inline_writes(path, payload, chunk),
+            ),
+            (
+                f"{Config.CHUNK_SIZE} KiB executor",
+                lambda: executor_writes(path, payload, chunk),
+            ),
+        ):
+            done = asyncio.Event()
+            monitor = asyncio.ensure_future(longest_stall(done))
+            cpu, wall = time.process_time(), time.perf_counter()
+            await run()
+            cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+            done.set()
+            stall = await monitor
+            assert os.path.getsize(path) == len(payload), f"{name}: short write"
+            per_gib = 1024 / args.size
+            print(
+                f"{name:<18} {cpu * per_gib:7.2f} s CPU/GiB "
+                f"{wall * per_gib:7.2f} s wall/GiB "
+                f"longest stall {stall * 1000:6.2f} ms"
+            )
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=256, help="payload size in MiB")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,92 @@
+"""
+Throughput of ``parallel_upload`` against a fake MTProto part sink.
+
+Every fake media session behaves like one MTProto connection: it handles
+one ``saveBigFilePart`` at a time, taking ``--latency`` ms of round trip
+plus the transfer of the part at ``--rate`` MiB/s. The same file is
+uploaded with one worker, what sequential uploads amount to, and with
+``--workers`` workers.
+
+    python -m benchmarks.bench_parallel_upload --size 64 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from config import Config
+from plugins.functions import stream_upload
+from plugins.functions.stream_upload import PART_SIZE, parallel_upload
+
+
+class FakePartSink:
+    """A media session storing the parts it receives."""
+
+    def __init__(self, parts, latency, rate):
+        self.parts = parts
+        self.latency = latency
+        self.rate = rate
+        self._connection = asyncio.Lock()
+
+    async def invoke(self, rpc):
+        async with self._connection:
+            await asyncio.sleep(self.latency + len(rpc.bytes) / self.rate)
+        self.parts[rpc.file_part] = rpc.bytes
+        return True
+
+
+class FakeClient:
+    def rnd_id(self):
+        return random.getrandbits(63)
+
+
+async def upload(path, workers, latency, rate):
+    client = FakeClient()
+    parts = {}
+    # parallel_upload takes its sessions from the media session pool
+    stream_upload._media_sessions[client] = [
+        FakePartSink(parts, latency, rate) for _ in range(workers)
+    ]
+    Config.UPLOAD_WORKERS = workers
+    try:
+        started = time.perf_counter()
+        input_file = await parallel_upload(client, path)
+        elapsed = time.perf_counter() - started
+    finally:
+        del stream_upload._media_sessions[client]
+    return elapsed, input_file, parts
+
+
+async def main(args):
+    payload = os.urandom(args.size * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.bin")
+        with open(path, "wb") as f:
+            f.write(payload)
+        for workers in (1, args.workers):
+            elapsed, input_file, parts = await upload(
+                path, workers, args.latency / 1000, args.rate * 1024 * 1024
+            )
+            received = b"".join(parts[index] for index in range(input_file.parts))
+            assert received == payload, f"{workers} workers: corrupt upload"
+            assert len(payload) <= input_file.parts * PART_SIZE
+            print(
+                f"{workers} worker(s) {elapsed:6.2f}s "
+                f"{args.size / elapsed:7.2f} MiB/s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=64, help="file size in MiB")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--latency", type=float, default=50, help="round trip of a part in ms"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=8, help="MiB/s of one connection"
+    )
+    asyncio.run(main(parser.parse_args()))
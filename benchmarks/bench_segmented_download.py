@@ -0,0 +1,100 @@
+"""
+Throughput of segmented vs single-stream direct downloads.
+
+A local aiohttp server serves a file and throttles every connection to
+``--rate`` MiB/s, like the per-connection limits of many file hosts; the
+same file is then fetched over one stream and with ``download_segmented``.
+
+    python -m benchmarks.bench_segmented_download --size 32 --rate 4 --segments 4
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from plugins.functions.ranged_download import download_segmented, probe_ranges
+
+CHUNK = 64 * 1024
+
+
+def make_app(payload, rate):
+    async def handler(request):
+        start, end = 0, len(payload) - 1
+        status = 200
+        if "Range" in request.headers:
+            first, last = request.headers["Range"].split("=")[1].split("-")
+            start, end = int(first), int(last or end)
+            status = 206
+        response = web.StreamResponse(status=status)
+        response.content_length = end - start + 1
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{len(payload)}"
+        response.headers["ETag"] = '"bench"'
+        await response.prepare(request)
+        for offset in range(start, end + 1, CHUNK):
+            await response.write(payload[offset: min(offset + CHUNK, end + 1)])
+            await asyncio.sleep(CHUNK / (rate * 1024 * 1024))
+        return response
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    return app
+
+
+async def single_stream(session, url, path):
+    async with session.get(url) as response:
+        with open(path, "wb") as f:
+            async for chunk in response.content.iter_any():
+                f.write(chunk)
+
+
+async def segmented(session, url, path, segments):
+    total_length, _, _, validators = await probe_ranges(session, url)
+
+    async def progress(_downloaded):
+        pass
+
+    await download_segmented(
+        session, url, path, total_length, validators, progress, segments
+    )
+
+
+async def main(args):
+    payload = os.urandom(args.size * 1024 * 1024)
+    runner = web.AppRunner(make_app(payload, args.rate))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/file"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiohttp.ClientSession() as session:
+            for name, run in (
+                ("single stream", lambda path: single_stream(session, url, path)),
+                (
+                    f"{args.segments} segments",
+                    lambda path: segmented(session, url, path, args.segments),
+                ),
+            ):
+                path = os.path.join(tmp, name.replace(" ", "_"))
+                started = time.perf_counter()
+                await run(path)
+                elapsed = time.perf_counter() - started
+                with open(path, "rb") as f:
+                    assert f.read() == payload, f"{name}: corrupt download"
+                print(f"{name:<14} {elapsed:6.2f}s {args.size / elapsed:7.2f} MiB/s")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=32, help="file size in MiB")
+    parser.add_argument("--rate", type=float, default=4, help="MiB/s per connection")
+    parser.add_argument("--segments", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
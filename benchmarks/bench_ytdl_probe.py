@@ -0,0 +1,88 @@
+"""
+Probe latency of the yt-dlp CLI subprocess vs the warm worker pool.
+
+Both probe the same direct media link served locally, so the numbers
+measure yt-dlp start-up and extractor import, not the network.
+
+    python -m benchmarks.bench_ytdl_probe --probes 10 --workers 2
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from aiohttp import web
+
+from plugins.functions.ytdl_pool import YtdlPool
+
+
+async def serve():
+    async def handler(_request):
+        return web.Response(body=b"\0" * 1024, content_type="video/mp4")
+
+    app = web.Application()
+    app.router.add_route("*", "/clip.mp4", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+async def cli_probe(url):
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "yt_dlp",
+        "--no-warnings",
+        "-j",
+        url,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    assert process.returncode == 0, stderr.decode()
+    return stdout
+
+
+def report(name, samples):
+    print(
+        f"{name:<6} mean {statistics.mean(samples) * 1000:7.1f} ms"
+        f"  median {statistics.median(samples) * 1000:7.1f} ms"
+        f"  max {max(samples) * 1000:7.1f} ms"
+    )
+
+
+async def main(args):
+    runner, port = await serve()
+    # a distinct query per probe, so nothing is cached between probes
+    urls = [f"http://127.0.0.1:{port}/clip.mp4?n={n}" for n in range(args.probes)]
+
+    samples = []
+    for url in urls:
+        started = time.perf_counter()
+        await cli_probe(url)
+        samples.append(time.perf_counter() - started)
+    report("cli", samples)
+
+    pool = YtdlPool(args.workers)
+    options = {"quiet": True, "no_warnings": True}
+    # the first calls pay for spawning the workers and importing yt-dlp
+    await asyncio.gather(*(pool.extract(urls[0], options) for _ in range(args.workers)))
+    samples = []
+    for url in urls:
+        started = time.perf_counter()
+        await pool.extract(url, options)
+        samples.append(time.perf_counter() - started)
+    report("pool", samples)
+
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--probes", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
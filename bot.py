@@ -2,10 +2,13 @@ import os
 import logging
 from pyrogram.raw.all import layer
 from pyrogram import Client, __version__
-from flask import Flask
+from flask import Flask, Response
 import threading
 
 from config import Config
+from plugins.functions.metrics import registry
+from plugins.functions.storage import storage
+from plugins.functions.upload_farm import upload_farm
 
 # Flask app
 app = Flask(__name__)
@@ -24,6 +27,10 @@ def hello_world():
 def health():
     return {"status": "ok"}
 
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
 def run_flask():
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
@@ -31,6 +38,8 @@ def run_flask():
 def main():
     if not os.path.isdir(Config.DOWNLOAD_LOCATION):
         os.makedirs(Config.DOWNLOAD_LOCATION)
+    # reclaim what a previous run left behind
+    storage.sweep()
 
     if not Config.BOT_TOKEN:
         logger.error("Please set BOT_TOKEN in config.py or as env var")
@@ -58,6 +67,7 @@ def main():
     )
 
     bot.start()
+    bot.loop.run_until_complete(upload_farm.start())
     logger.info("Bot has started.")
     logger.info("**Bot Started**\n\n**Pyrogram Version:** %s \n**Layer:** %s", __version__, layer)
     logger.info("Developed by github.com/kalanakt Sponsored by www.netronk.com")
@@ -25,12 +25,90 @@ class Config(object):
     
     # Chunk size that should be used with requests : default is 128KB
     CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 128))
+    # Bytes a download segment collects before writing them to disk
+    WRITE_BLOCK_SIZE = int(os.environ.get("WRITE_BLOCK_SIZE", 4 * 1024 * 1024))
+    # Parallel connections used for direct links that support byte ranges
+    DOWNLOAD_SEGMENTS = int(os.environ.get("DOWNLOAD_SEGMENTS", 4))
+    # Files smaller than this (in bytes) are fetched over a single connection
+    MIN_SEGMENT_SIZE = int(os.environ.get("MIN_SEGMENT_SIZE", 8 * 1024 * 1024))
+    # Attempts of a segment that broke off before the download falls back to one stream
+    SEGMENT_RETRIES = int(os.environ.get("SEGMENT_RETRIES", 5))
+    # Upload direct links as documents while they download, without storing them
+    STREAM_UPLOAD = os.environ.get("STREAM_UPLOAD", "False").lower() == "true"
+    # Number of 512 KB parts buffered between the download and the upload
+    STREAM_UPLOAD_BUFFER = int(os.environ.get("STREAM_UPLOAD_BUFFER", 16))
+    # Minimum seconds between two edits of a progress message
+    PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 5))
+    # Media connections uploading parts of big files at once (1 keeps Pyrogram's uploader)
+    UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 4))
+    # Attempts of a failed upload part before the upload is given up
+    UPLOAD_PART_RETRIES = int(os.environ.get("UPLOAD_PART_RETRIES", 5))
+    # Extra bot tokens (space separated) uploading on behalf of the main bot, and the
+    # channel they upload to, where every bot is admin; both are needed to use them
+    HELPER_BOT_TOKENS = os.environ.get("HELPER_BOT_TOKENS", "").split()
+    UPLOAD_DUMP_CHAT = int(os.environ.get("UPLOAD_DUMP_CHAT", 0))
     # Proxy for accessing youtube-dl in GeoRestricted Areas
     HTTP_PROXY = os.environ.get("HTTP_PROXY", "")
     
+    # Shared HTTP client: connections in total and per host, DNS cache and keep-alive in seconds
+    HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 100))
+    HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", 16))
+    HTTP_DNS_TTL = int(os.environ.get("HTTP_DNS_TTL", 300))
+    HTTP_KEEPALIVE = float(os.environ.get("HTTP_KEEPALIVE", 30))
+
+    # Seconds allowed to detect the size of a format missing from the yt-dlp probe
+    SIZE_PROBE_TIMEOUT = float(os.environ.get("SIZE_PROBE_TIMEOUT", 5))
+
+    # yt-dlp probe cache: entries kept in memory, lifetime in seconds, optional SQLite file
+    PROBE_CACHE_SIZE = int(os.environ.get("PROBE_CACHE_SIZE", 512))
+    PROBE_CACHE_TTL = int(os.environ.get("PROBE_CACHE_TTL", 3600))
+    PROBE_CACHE_DB = os.environ.get("PROBE_CACHE_DB", "")
+
+    # Format keyboards: sessions kept in memory, lifetime in seconds, optional SQLite file
+    FORMAT_SESSION_SIZE = int(os.environ.get("FORMAT_SESSION_SIZE", 2000))
+    FORMAT_SESSION_TTL = int(os.environ.get("FORMAT_SESSION_TTL", 6 * 3600))
+    FORMAT_SESSION_DB = os.environ.get("FORMAT_SESSION_DB", "")
+
+    # Worker processes running yt-dlp in-process, 0 keeps the yt-dlp CLI subprocesses
+    YTDL_WORKERS = int(os.environ.get("YTDL_WORKERS", 0))
+    # Threads running the YouTube audio/video downloads of youtube.py
+    YTDL_THREADS = int(os.environ.get("YTDL_THREADS", 4))
+
+    # Index of uploaded file_ids re-sent for repeated requests
+    FILE_ID_DB = os.environ.get("FILE_ID_DB", "file_ids.db")
+    FILE_ID_CACHE_SIZE = int(os.environ.get("FILE_ID_CACHE_SIZE", 10000))
+
     # Set timeout for subprocess
     PROCESS_MAX_TIMEOUT = 3700
     
+    # Job phase traces: JSON lines file (empty disables it), rotation size and
+    # backups, and the number of recent jobs summarized by /stats
+    TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+    TRACE_MAX_BYTES = int(os.environ.get("TRACE_MAX_BYTES", 10 * 1024 * 1024))
+    TRACE_BACKUPS = int(os.environ.get("TRACE_BACKUPS", 3))
+    TRACE_HISTORY = int(os.environ.get("TRACE_HISTORY", 500))
+
+    # Concurrency limits of download/upload jobs
+    MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 10))
+    MAX_JOBS_PER_USER = int(os.environ.get("MAX_JOBS_PER_USER", 2))
+    MAX_JOBS_PER_HOST = int(os.environ.get("MAX_JOBS_PER_HOST", 4))
+
+    # Queue handing jobs to worker.py processes: path of a SQLite file or a
+    # redis:// URL, empty runs jobs in the bot process. Seconds a job survives
+    # without heartbeat, seconds between two polls of an idle worker
+    JOB_QUEUE = os.environ.get("JOB_QUEUE", "")
+    JOB_LEASE = int(os.environ.get("JOB_LEASE", 120))
+    WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 2))
+
+    # Disk space admission: bytes all running jobs may reserve (0 = no quota),
+    # bytes always left free, and the reservation of downloads of unknown size
+    STORAGE_QUOTA = int(os.environ.get("STORAGE_QUOTA", 0))
+    MIN_FREE_SPACE = int(os.environ.get("MIN_FREE_SPACE", 512 * 1024 * 1024))
+    UNKNOWN_SIZE_RESERVATION = int(os.environ.get("UNKNOWN_SIZE_RESERVATION", 512 * 1024 * 1024))
+    # Janitor: seconds before an unused temp file is removed, seconds between sweeps
+    TEMP_MAX_AGE = int(os.environ.get("TEMP_MAX_AGE", 6 * 3600))
+    JANITOR_INTERVAL = int(os.environ.get("JANITOR_INTERVAL", 900))
+
     OWNER_ID = int(os.environ.get("OWNER_ID", 0))
     ADL_BOT_RQ = {}
     AUTH_USERS = list({int(x) for x in os.environ.get("AUTH_USERS", "0").split() if x.isdigit()})
@@ -1,13 +1,26 @@
 import logging
 import os
-import json
 import time
-import shutil
-import asyncio
 from datetime import datetime
 from config import Config
 from plugins.functions.display_progress import humanbytes, progress_for_pyrogram
+from plugins.functions.file_id_cache import file_id_cache, thumb_hash
+from plugins.functions.jobs import job_registry
+from plugins.functions.metrics import (
+    download_bytes,
+    download_seconds,
+    upload_bytes,
+    upload_seconds,
+)
+from plugins.functions.probe_cache import normalize_url
 from plugins.functions.ran_text import random_char
+from plugins.functions.single_flight import downloads_in_flight
+from plugins.functions.storage import StorageFull, storage
+from plugins.functions.stream_upload import parallel_upload_enabled, send_parallel_media
+from plugins.functions.tracing import record_span, span
+from plugins.functions.upload_farm import upload_farm
+from plugins.functions.ytdl_pool import ytdl_pool, YtdlError
+from plugins.functions.ytdl_progress import stream_ytdl, status_updater
 from plugins.script import Translation
 from plugins.utitles import Mdata01, Mdata02, Mdata03
 
@@ -19,29 +32,88 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 
-async def youtube_dl_call_back(_bot, update):
+def format_validator(session, tg_send_type, format_id):
+    """
+    Describe the selected format so that a changed source invalidates its file_id.
+
+    Audio jobs download ``bestaudio`` whatever the button, so they are
+    described by the largest audio-only format of the session.
+
+    Parameters:
+    - session (dict): The format session of the keyboard.
+    - tg_send_type (str): "audio", "video", "vm" or "file".
+    - format_id (str): The selected format id, or the audio quality for audio jobs.
+
+    Returns:
+    str: Size of the format when yt-dlp knows it, otherwise an empty string.
+    """
+    if tg_send_type == "audio":
+        sizes = [
+            fmt["filesize"]
+            for fmt in session["formats"].values()
+            if fmt.get("audio_only") and fmt.get("filesize")
+        ]
+        return str(max(sizes)) if sizes else ""
+    fmt = session["formats"].get(format_id) or {}
+    return str(fmt.get("filesize") or "")
+
+
+def ytdl_download_options(
+    tg_send_type, youtube_dl_format, youtube_dl_ext, url, outtmpl, username, password
+):
+    """
+    Build the ``YoutubeDL`` options equivalent to the yt-dlp command line used below.
+
+    Parameters:
+    - tg_send_type (str): "audio", "video", "vm" or "file".
+    - youtube_dl_format (str): Format id, or the audio quality for audio jobs.
+    - youtube_dl_ext (str): Extension, or the audio codec for audio jobs.
+    - url (str): URL to download.
+    - outtmpl (str): Output path.
+    - username (str): Optional site username.
+    - password (str): Optional site password.
+
+    Returns:
+    dict: Options for ``ytdl_pool.download``.
+    """
+    options = {
+        "continuedl": True,
+        "max_filesize": Config.TG_MAX_FILE_SIZE,
+        "outtmpl": outtmpl,
+        "quiet": True,
+        "no_warnings": True,
+        "proxy": Config.HTTP_PROXY or None,
+        "username": username,
+        "password": password,
+    }
+    if tg_send_type == "audio":
+        options["format"] = "bestaudio/best"
+        options["postprocessors"] = [
+            {
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": youtube_dl_ext,
+                "preferredquality": youtube_dl_format,
+            }
+        ]
+    else:
+        options["format"] = (
+            f"{youtube_dl_format}+bestaudio" if "youtu" in url else youtube_dl_format
+        )
+        options["writesubtitles"] = True
+        options["postprocessors"] = [{"key": "FFmpegEmbedSubtitle"}]
+    return options
+
+
+async def youtube_dl_call_back(_bot, update, session, choice):
     # Constants
     AD_STRING_TO_REPLACE = "please report this issue on https://github.com/kalanakt/All-Url-Uploader/issues"
 
-    cb_data = update.data
-    tg_send_type, youtube_dl_format, youtube_dl_ext, ranom = cb_data.split("|")
-    print(cb_data)
+    tg_send_type, youtube_dl_format, youtube_dl_ext = choice
     random1 = random_char(5)
-    save_ytdl_json_path = (
-        Config.DOWNLOAD_LOCATION + "/" + str(update.from_user.id) + f"{ranom}" + ".json"
-    )
-
-    try:
-        with open(save_ytdl_json_path, "r", encoding="utf8") as f:
-            response_json = json.load(f)
-    except FileNotFoundError as e:
-        await update.message.edit(f"Error: {e}")
-        await update.message.delete()
-        return False
 
     youtube_dl_url = update.message.reply_to_message.text
     custom_file_name = (
-        str(response_json.get("title")) + "_" + youtube_dl_format + "." + youtube_dl_ext
+        str(session.get("title")) + "_" + youtube_dl_format + "." + youtube_dl_ext
     )
     youtube_dl_username = None
     youtube_dl_password = None
@@ -89,191 +161,327 @@ async def youtube_dl_call_back(_bot, update):
                 youtube_dl_url = youtube_dl_url[o: o + length]
 
     await update.message.edit_caption(
-        caption=Translation.DOWNLOAD_START.format(custom_file_name)
+        caption=Translation.DOWNLOAD_START.format(custom_file_name),
+        reply_markup=job_registry.markup_for(update.message),
     )
     description = Translation.CUSTOM_CAPTION_UL_FILE
 
-    if "fulltitle" in response_json:
-        description = response_json["fulltitle"][:1021]
-
-    tmp_directory_for_each_user = (
-        Config.DOWNLOAD_LOCATION + "/" + str(update.from_user.id) + f"{random1}"
-    )
-
-    if not os.path.isdir(tmp_directory_for_each_user):
-        os.makedirs(tmp_directory_for_each_user)
+    if session.get("fulltitle"):
+        description = session["fulltitle"][:1021]
 
-    download_directory = f"{tmp_directory_for_each_user}/{custom_file_name}"
-
-    command_to_exec = []
-
-    if tg_send_type == "audio":
-        command_to_exec = [
-            "yt-dlp",
-            "-c",
-            "--max-filesize",
-            str(Config.TG_MAX_FILE_SIZE),
-            "--bidi-workaround",
-            "--extract-audio",
-            "--audio-format",
-            youtube_dl_ext,
-            "--audio-quality",
-            youtube_dl_format,
+    thumb_path = f"{Config.DOWNLOAD_LOCATION}/{update.from_user.id}.jpg"
+    with span("thumbnail"):
+        cache_key = file_id_cache.key(
             youtube_dl_url,
-            "-o",
-            download_directory,
-        ]
-    else:
-        minus_f_format = youtube_dl_format
-        if "youtu" in youtube_dl_url:
-            minus_f_format = f"{youtube_dl_format}+bestaudio"
-        command_to_exec = [
-            "yt-dlp",
-            "-c",
-            "--max-filesize",
-            str(Config.TG_MAX_FILE_SIZE),
-            "--embed-subs",
-            "-f",
-            minus_f_format,
-            "--bidi-workaround",
-            youtube_dl_url,
-            "-o",
-            download_directory,
-        ]
-
-    if Config.HTTP_PROXY != "":
-        command_to_exec.extend(["--proxy", Config.HTTP_PROXY])
-
-    if youtube_dl_username is not None:
-        command_to_exec.extend(["--username", youtube_dl_username])
-
-    if youtube_dl_password is not None:
-        command_to_exec.extend(["--password", youtube_dl_password])
-
-    command_to_exec.extend(["--no-warnings"])
-
-    logger.info(command_to_exec)
-    start = datetime.now()
-
-    process = await asyncio.create_subprocess_exec(
-        *command_to_exec,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
+            youtube_dl_format,
+            tg_send_type,
+            thumb_hash(thumb_path),
+            custom_file_name,
+        )
+    validator = format_validator(session, tg_send_type, youtube_dl_format)
+
+    if await file_id_cache.resend(
+        _bot,
+        update.message.chat.id,
+        cache_key,
+        validator,
+        caption=description,
+        reply_to_message_id=update.message.id,
+    ):
+        await update.message.edit_caption(caption=Translation.SENT_FROM_CACHE)
+        return True
+
+    flight_key = (
+        normalize_url(youtube_dl_url),
+        tg_send_type,
+        youtube_dl_format,
+        youtube_dl_ext,
+        custom_file_name,
+        youtube_dl_username,
     )
+    flight, leader = downloads_in_flight.acquire(flight_key)
+    flight.subscribe(
+        status_updater(
+            update.message, Translation.DOWNLOAD_START.format(custom_file_name)
+        )
+    )
+    start = datetime.now()
 
-    stdout, stderr = await process.communicate()
-    e_response = stderr.decode().strip()
-    t_response = stdout.decode().strip()
-
-    logger.info(e_response)
-    logger.info(t_response)
-
-    if e_response and AD_STRING_TO_REPLACE in e_response:
-        error_message = e_response.replace(AD_STRING_TO_REPLACE, "")
-        await update.message.edit_caption(text=error_message)
-        return False
-
-    if t_response:
-        logger.info(t_response)
-        try:
-            os.remove(save_ytdl_json_path)
-        except FileNotFoundError:
-            pass
-
-        end_one = datetime.now()
-        time_taken_for_download = (end_one - start).seconds
-        file_size = Config.TG_MAX_FILE_SIZE + 1
-
-        try:
-            file_size = os.stat(download_directory).st_size
-        except FileNotFoundError:
-            download_directory = os.path.splitext(download_directory)[0] + "." + "mkv"
-            file_size = os.stat(download_directory).st_size
-
-        download_location = f"{Config.DOWNLOAD_LOCATION}/{update.from_user.id}.jpg"
-        thumb = download_location if os.path.isfile(download_location) else None
+    try:
+        if leader:
+            tmp_directory_for_each_user = (
+                Config.DOWNLOAD_LOCATION + "/" + str(update.from_user.id) + f"{random1}"
+            )
 
-        if file_size > Config.TG_MAX_FILE_SIZE:
-            await update.message.edit_caption(
-                caption=Translation.RCHD_TG_API_LIMIT.format(
-                    time_taken_for_download, humanbytes(file_size)
+            try:
+                await storage.reserve(
+                    int(float(validator or 0)),
+                    tmp_directory_for_each_user,
+                    notify=lambda: update.message.edit_caption(
+                        caption=Translation.WAITING_FOR_STORAGE,
+                        reply_markup=job_registry.markup_for(update.message),
+                    ),
                 )
-            )
+            except StorageFull as e:
+                logger.info("Error %s", e)
+                await update.message.edit_caption(caption=Translation.STORAGE_FULL)
+                return False
+
+            if not os.path.isdir(tmp_directory_for_each_user):
+                os.makedirs(tmp_directory_for_each_user)
+            flight.cleanup(tmp_directory_for_each_user)
+
+            download_directory = f"{tmp_directory_for_each_user}/{custom_file_name}"
+
+            command_to_exec = []
+
+            if tg_send_type == "audio":
+                command_to_exec = [
+                    "yt-dlp",
+                    "-c",
+                    "--max-filesize",
+                    str(Config.TG_MAX_FILE_SIZE),
+                    "--bidi-workaround",
+                    "--extract-audio",
+                    "--audio-format",
+                    youtube_dl_ext,
+                    "--audio-quality",
+                    youtube_dl_format,
+                    youtube_dl_url,
+                    "-o",
+                    download_directory,
+                ]
+            else:
+                minus_f_format = youtube_dl_format
+                if "youtu" in youtube_dl_url:
+                    minus_f_format = f"{youtube_dl_format}+bestaudio"
+                command_to_exec = [
+                    "yt-dlp",
+                    "-c",
+                    "--max-filesize",
+                    str(Config.TG_MAX_FILE_SIZE),
+                    "--embed-subs",
+                    "-f",
+                    minus_f_format,
+                    "--bidi-workaround",
+                    youtube_dl_url,
+                    "-o",
+                    download_directory,
+                ]
+
+            if Config.HTTP_PROXY != "":
+                command_to_exec.extend(["--proxy", Config.HTTP_PROXY])
+
+            if youtube_dl_username is not None:
+                command_to_exec.extend(["--username", youtube_dl_username])
+
+            if youtube_dl_password is not None:
+                command_to_exec.extend(["--password", youtube_dl_password])
+
+            command_to_exec.extend(["--no-warnings"])
+
+            logger.info(command_to_exec)
+
+            download_started = time.monotonic()
+            if ytdl_pool.enabled:
+                e_response, t_response = "", ""
+                try:
+                    await ytdl_pool.download(
+                        youtube_dl_url,
+                        ytdl_download_options(
+                            tg_send_type,
+                            youtube_dl_format,
+                            youtube_dl_ext,
+                            youtube_dl_url,
+                            download_directory,
+                            youtube_dl_username,
+                            youtube_dl_password,
+                        ),
+                        progress=flight.publish,
+                    )
+                    t_response = download_directory
+                except YtdlError as e:
+                    e_response = str(e)
+            else:
+                e_response, t_response, process = await stream_ytdl(
+                    command_to_exec, on_event=flight.publish
+                )
+                # with the progress template stdout is rarely empty, even
+                # when yt-dlp failed
+                if process.returncode == 0:
+                    t_response = download_directory
+                else:
+                    t_response = ""
+                    e_response = (
+                        e_response or f"yt-dlp exited with {process.returncode}"
+                    )
+            download_seconds.observe(time.monotonic() - download_started, path="ytdl")
+            record_span("download", download_started)
+            flight.resolve((e_response, t_response, download_directory))
         else:
             await update.message.edit_caption(
-                caption=Translation.UPLOAD_START.format(custom_file_name)
+                caption=Translation.JOINED_DOWNLOAD,
+                reply_markup=job_registry.markup_for(update.message),
             )
-
-            start_time = time.time()
-
-            if tg_send_type == "video":
-                width, height, duration = await Mdata01(download_directory)
-                await update.message.reply_video(
-                    video=download_directory,
-                    caption=description,
-                    duration=duration,
-                    width=width,
-                    height=height,
-                    supports_streaming=True,
-                    thumb=thumb,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
+            download_started = time.monotonic()
+            try:
+                e_response, t_response, download_directory = await flight.wait()
+            except RuntimeError as e:
+                # the leader failed or was cancelled before the file was ready
+                logger.info("Error %s", e)
+                await update.message.edit_caption(
+                    caption=Translation.SHARED_DOWNLOAD_FAILED
                 )
-            elif tg_send_type == "audio":
-                duration = await Mdata03(download_directory)
-                await update.message.reply_audio(
-                    audio=download_directory,
-                    caption=description,
-                    duration=duration,
-                    thumb=thumb,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
-                )
-            elif tg_send_type == "vm":
-                width, duration = await Mdata02(download_directory)
-                await update.message.reply_video_note(
-                    video_note=download_directory,
-                    duration=duration,
-                    length=width,
-                    thumb=thumb,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
+                return False
+            record_span("download", download_started)
+
+        logger.info(e_response)
+        logger.info(t_response)
+
+        # t_response is only set when the download succeeded
+        if not t_response or AD_STRING_TO_REPLACE in e_response:
+            error_message = e_response.replace(AD_STRING_TO_REPLACE, "")
+            await update.message.edit_caption(caption=error_message)
+            return False
+
+        if t_response:
+            logger.info(t_response)
+
+            end_one = datetime.now()
+            time_taken_for_download = (end_one - start).seconds
+            file_size = Config.TG_MAX_FILE_SIZE + 1
+
+            try:
+                file_size = os.stat(download_directory).st_size
+            except FileNotFoundError:
+                download_directory = os.path.splitext(download_directory)[0] + "." + "mkv"
+                file_size = os.stat(download_directory).st_size
+
+            thumb = thumb_path if os.path.isfile(thumb_path) else None
+            if leader:
+                download_bytes.inc(file_size, path="ytdl")
+
+            if file_size > Config.TG_MAX_FILE_SIZE:
+                await update.message.edit_caption(
+                    caption=Translation.RCHD_TG_API_LIMIT.format(
+                        time_taken_for_download, humanbytes(file_size)
+                    )
                 )
             else:
-                await update.message.reply_document(
-                    document=download_directory,
-                    caption=description,
-                    thumb=thumb,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
+                await update.message.edit_caption(
+                    caption=Translation.UPLOAD_START.format(custom_file_name),
+                    reply_markup=job_registry.markup_for(update.message),
                 )
 
-            end_two = datetime.now()
-            time_taken_for_upload = (end_two - end_one).seconds
-
-            shutil.rmtree(tmp_directory_for_each_user)
+                start_time = time.time()
+                upload_started = time.monotonic()
+
+                async with upload_farm.uploader(
+                    _bot, update.message.chat.id
+                ) as (uploader, chat_id, _):
+                    if parallel_upload_enabled(file_size):
+                        sent_message = await send_parallel_media(
+                            uploader,
+                            chat_id,
+                            download_directory,
+                            tg_send_type,
+                            caption=description,
+                            thumb=thumb,
+                            progress=progress_for_pyrogram,
+                            progress_args=(
+                                Translation.UPLOAD_START,
+                                update.message,
+                                start_time,
+                            ),
+                        )
+                    elif tg_send_type == "video":
+                        with span("metadata"):
+                            width, height, duration = await Mdata01(download_directory)
+                        upload_started = time.monotonic()
+                        sent_message = await uploader.send_video(
+                            chat_id=chat_id,
+                            video=download_directory,
+                            caption=description,
+                            duration=duration,
+                            width=width,
+                            height=height,
+                            supports_streaming=True,
+                            thumb=thumb,
+                            progress=progress_for_pyrogram,
+                            progress_args=(
+                                Translation.UPLOAD_START,
+                                update.message,
+                                start_time,
+                            ),
+                        )
+                    elif tg_send_type == "audio":
+                        with span("metadata"):
+                            duration = await Mdata03(download_directory)
+                        upload_started = time.monotonic()
+                        sent_message = await uploader.send_audio(
+                            chat_id=chat_id,
+                            audio=download_directory,
+                            caption=description,
+                            duration=duration,
+                            thumb=thumb,
+                            progress=progress_for_pyrogram,
+                            progress_args=(
+                                Translation.UPLOAD_START,
+                                update.message,
+                                start_time,
+                            ),
+                        )
+                    elif tg_send_type == "vm":
+                        with span("metadata"):
+                            width, duration = await Mdata02(download_directory)
+                        upload_started = time.monotonic()
+                        sent_message = await uploader.send_video_note(
+                            chat_id=chat_id,
+                            video_note=download_directory,
+                            duration=duration,
+                            length=width,
+                            thumb=thumb,
+                            progress=progress_for_pyrogram,
+                            progress_args=(
+                                Translation.UPLOAD_START,
+                                update.message,
+                                start_time,
+                            ),
+                        )
+                    else:
+                        sent_message = await uploader.send_document(
+                            chat_id=chat_id,
+                            document=download_directory,
+                            caption=description,
+                            thumb=thumb,
+                            progress=progress_for_pyrogram,
+                            progress_args=(
+                                Translation.UPLOAD_START,
+                                update.message,
+                                start_time,
+                            ),
+                        )
+
+                sent_message = await upload_farm.deliver(
+                    _bot, sent_message, update.message.chat.id
+                )
 
-            await update.message.edit_caption(
-                caption=Translation.AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS.format(
-                    time_taken_for_download, time_taken_for_upload
+                file_id_cache.store(cache_key, validator, sent_message)
+                upload_seconds.observe(time.monotonic() - upload_started, path="ytdl")
+                record_span("upload", upload_started)
+                upload_bytes.inc(file_size, path="ytdl")
+                end_two = datetime.now()
+                time_taken_for_upload = (end_two - end_one).seconds
+
+                await update.message.edit_caption(
+                    caption=Translation.AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS.format(
+                        time_taken_for_download, time_taken_for_upload
+                    )
                 )
-            )
 
-            logger.info("Downloaded in: %s", str(time_taken_for_download))
-            logger.info("Uploaded in: %s", str(time_taken_for_upload))
+                logger.info("Downloaded in: %s", str(time_taken_for_download))
+                logger.info("Uploaded in: %s", str(time_taken_for_upload))
+    finally:
+        with span("cleanup"):
+            downloads_in_flight.release(flight, leader)
+
@@ -2,8 +2,21 @@
 
 import logging
 from pyrogram import Client
+from config import Config
 from plugins.dl_button import ddl_call_back
 from plugins.button import youtube_dl_call_back
+from plugins.functions.callback_codec import (
+    FIELD_COUNTS,
+    OP_CANCEL,
+    OP_DIRECT,
+    OP_FORMAT,
+    CallbackDataError,
+    decode,
+)
+from plugins.functions.format_sessions import format_sessions
+from plugins.functions.job_queue import QUEUED, RUNNING, job_queue
+from plugins.functions.jobs import cancel_markup, job_registry
+from plugins.functions.scheduler import scheduler, job_host, callback_notifier
 from plugins.script import Translation
 
 # Set up logging configuration
@@ -13,31 +26,176 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-@Client.on_callback_query()
-async def button(bot, update):
-    if update.data == "home":
-        await update.message.edit(
-            text=Translation.START_TEXT.format(update.from_user.mention),
-            reply_markup=Translation.START_BUTTONS,
-            # disable_web_page_preview=True
-        )
-    elif update.data == "help":
-        await update.message.edit(
-            text=Translation.HELP_TEXT,
-            reply_markup=Translation.HELP_BUTTONS,
-            # disable_web_page_preview=True
-        )
-    elif update.data == "about":
-        await update.message.edit(
-            text=Translation.ABOUT_TEXT,
-            reply_markup=Translation.ABOUT_BUTTONS,
-            # disable_web_page_preview=True
-        )
-    elif "close" in update.data:
-        await update.message.delete(True)
-    elif "|" in update.data:
-        await youtube_dl_call_back(bot, update)
-    elif "=" in update.data:
-        await ddl_call_back(bot, update)
+async def cancel_job(_bot, update, job_id):
+    """
+    Cancel the job behind a cancel button, if it belongs to the user.
+
+    Parameters:
+    - update (pyrogram.types.CallbackQuery): The cancel button query.
+    - job_id (str): Id of the job to cancel.
+
+    Returns:
+    None
+    """
+    job = job_registry.get(job_id)
+    owner = job.user_id if job is not None else None
+    if job is None and job_queue is not None:
+        # a job handed to the worker processes
+        queued = await job_queue.get(job_id)
+        if queued is not None and queued["state"] in (QUEUED, RUNNING):
+            owner = queued["user_id"]
+    if owner is None:
+        await update.answer(Translation.JOB_NOT_FOUND, show_alert=True)
+        return
+    if owner != update.from_user.id and update.from_user.id not in Config.AUTH_USERS:
+        await update.answer(Translation.JOB_NOT_YOURS, show_alert=True)
+        return
+    if job is not None:
+        job.cancel()
     else:
+        await job_queue.cancel(job_id)
+    await update.answer(Translation.JOB_CANCELLED)
+    try:
+        await update.message.edit(text=Translation.JOB_CANCELLED)
+    except Exception as e:
+        logger.info("Error %s", e)
+
+
+async def session_choice(update, token, index):
+    """
+    Look up the keyboard choice of a format button.
+
+    Parameters:
+    - update (pyrogram.types.CallbackQuery): The button query.
+    - token (str): Token of the format session.
+    - index (str): Index of the choice in the session.
+
+    Returns:
+    Tuple[dict, List[str]]: The session and the (send type, format id,
+    extension) choice, or (None, None) when the session expired.
+    """
+    session = format_sessions.get(token)
+    try:
+        return session, session["choices"][int(index)]
+    except (TypeError, IndexError, ValueError):
+        await update.answer(Translation.FORMAT_SESSION_EXPIRED, show_alert=True)
         await update.message.delete()
+        return None, None
+
+
+async def enqueue_job(update, kind, payload):
+    """
+    Hand a job to the worker processes instead of running it here.
+
+    Parameters:
+    - update (pyrogram.types.CallbackQuery): The format button query.
+    - kind (str): "ytdl" or "ddl".
+    - payload (dict): Arguments of the job, see worker.py.
+
+    Returns:
+    None
+    """
+    job_id = await job_queue.put(
+        kind, update.from_user.id, update.message.chat.id, update.message.id, payload
+    )
+    logger.info("Job %s of %s handed to the workers", job_id, update.from_user.id)
+    await update.answer(Translation.JOB_ENQUEUED)
+    try:
+        await update.message.edit_reply_markup(cancel_markup(job_id))
+    except Exception as e:
+        logger.info("Error %s", e)
+
+
+async def run_format(bot, update, token, index):
+    session, choice = await session_choice(update, token, index)
+    if choice is None:
+        return
+    if job_queue is not None:
+        return await enqueue_job(update, "ytdl", {"session": session, "choice": choice})
+    async with job_registry.track(update.from_user.id, update.message, "ytdl"):
+        async with scheduler.slot(
+            update.from_user.id,
+            job_host(update.message.reply_to_message.text),
+            "ytdl",
+            notify=callback_notifier(update),
+        ):
+            await youtube_dl_call_back(bot, update, session, choice)
+
+
+async def run_direct(bot, update, token, index):
+    _, choice = await session_choice(update, token, index)
+    if choice is None:
+        return
+    if job_queue is not None:
+        return await enqueue_job(update, "ddl", {"choice": choice})
+    async with job_registry.track(update.from_user.id, update.message, "ddl"):
+        async with scheduler.slot(
+            update.from_user.id,
+            job_host(update.message.reply_to_message.text),
+            "ddl",
+            notify=callback_notifier(update),
+        ):
+            await ddl_call_back(bot, update, choice)
+
+
+async def show_home(_bot, update):
+    await update.message.edit(
+        text=Translation.START_TEXT.format(update.from_user.mention),
+        reply_markup=Translation.START_BUTTONS,
+        # disable_web_page_preview=True
+    )
+
+
+async def show_help(_bot, update):
+    await update.message.edit(
+        text=Translation.HELP_TEXT,
+        reply_markup=Translation.HELP_BUTTONS,
+        # disable_web_page_preview=True
+    )
+
+
+async def show_about(_bot, update):
+    await update.message.edit(
+        text=Translation.ABOUT_TEXT,
+        reply_markup=Translation.ABOUT_BUTTONS,
+        # disable_web_page_preview=True
+    )
+
+
+async def close_message(_bot, update):
+    await update.message.delete(True)
+
+
+# Fixed buttons of the menus, matched on their whole callback data
+MENU_ROUTES = {
+    "home": show_home,
+    "help": show_help,
+    "about": show_about,
+    "close": close_message,
+}
+
+# Packed buttons, dispatched on their opcode
+OPCODE_ROUTES = {
+    OP_FORMAT: run_format,
+    OP_DIRECT: run_direct,
+    OP_CANCEL: cancel_job,
+}
+
+
+@Client.on_callback_query()
+async def button(bot, update):
+    route = MENU_ROUTES.get(update.data)
+    if route is not None:
+        return await route(bot, update)
+    try:
+        opcode, fields = decode(update.data)
+    except CallbackDataError:
+        opcode, fields = None, []
+    route = OPCODE_ROUTES.get(opcode)
+    if route is None:
+        # a keyboard of an older version, or a foreign button
+        return await update.message.delete()
+    if len(fields) != FIELD_COUNTS[opcode]:
+        logger.info("Callback data %r has %s fields", update.data, len(fields))
+        return await update.answer(Translation.INVALID_BUTTON, show_alert=True)
+    await route(bot, update, *fields)
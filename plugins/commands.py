@@ -1,5 +1,11 @@
+import time
 from pyrogram import Client, filters
 from pyrogram.types import Message
+from config import Config
+from plugins.functions.job_queue import CANCELLING, QUEUED, RUNNING, job_queue
+from plugins.functions.jobs import job_registry
+from plugins.functions.scheduler import scheduler
+from plugins.functions.tracing import tracer
 from plugins.script import Translation
 
 
@@ -35,3 +41,71 @@ async def aboutme(_bot, m: Message):
         reply_markup=Translation.ABOUT_BUTTONS,
         disable_web_page_preview=True,
     )
+
+
+@Client.on_message(
+    filters.command("queue") & filters.private & filters.user(Config.AUTH_USERS),
+)
+async def queue_status(_bot, m: Message):
+    now = time.time()
+    running, waiting = scheduler.snapshot()
+    running_lines = [
+        f"#{job.id} {job.kind} <code>{job.user_id}</code> {job.host} · {round(now - job.started)}s"
+        for job in running
+    ]
+    waiting_lines = [
+        f"{position}. #{job.id} {job.kind} <code>{job.user_id}</code> {job.host} · {round(now - job.enqueued)}s"
+        for position, job in enumerate(waiting, 1)
+    ]
+    text = Translation.QUEUE_STATUS.format(
+        len(running),
+        scheduler.global_limit,
+        "\n".join(running_lines) or "-",
+        len(waiting),
+        "\n".join(waiting_lines) or "-",
+    )
+    if job_queue is not None:
+        counts = await job_queue.counts()
+        text += Translation.WORKER_QUEUE_STATUS.format(
+            counts.get(QUEUED, 0), counts.get(RUNNING, 0) + counts.get(CANCELLING, 0)
+        )
+    return await m.reply_text(text, disable_web_page_preview=True)
+
+
+@Client.on_message(
+    filters.command("stats") & filters.private & filters.user(Config.AUTH_USERS),
+)
+async def trace_stats(_bot, m: Message):
+    summary = tracer.summary()
+    if not summary:
+        return await m.reply_text(Translation.NO_TRACES, quote=True)
+    lines = [f"{'phase':<9}{'n':>5}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    lines += [
+        f"{phase:<9}{count:>5}{p50:>8.2f}s{p95:>8.2f}s{p99:>8.2f}s"
+        for phase, (count, p50, p95, p99) in summary.items()
+    ]
+    return await m.reply_text(
+        Translation.TRACE_STATS.format(summary["total"][0], "\n".join(lines)),
+        quote=True,
+    )
+
+
+@Client.on_message(
+    filters.command("cancel") & filters.private,
+)
+async def cancel_jobs(_bot, m: Message):
+    jobs = job_registry.for_user(m.from_user.id)
+    # jobs handed to the worker processes
+    queued = await job_queue.active(m.from_user.id) if job_queue is not None else []
+    if len(m.command) > 1:
+        jobs = [job for job in jobs if job.id == m.command[1]]
+        queued = [job_id for job_id in queued if job_id == m.command[1]]
+    if not (jobs or queued):
+        return await m.reply_text(Translation.NO_RUNNING_JOBS, quote=True)
+    for job in jobs:
+        job.cancel()
+    for job_id in queued:
+        await job_queue.cancel(job_id)
+    return await m.reply_text(
+        f"{Translation.JOB_CANCELLED} ({len(jobs) + len(queued)})", quote=True
+    )
@@ -5,12 +5,36 @@ from datetime import datetime
 import logging
 import os
 import time
-import aiohttp
 from plugins.functions.display_progress import (
+    ProgressReporter,
     progress_for_pyrogram,
     humanbytes,
     TimeFormatter,
 )
+from plugins.functions.download_journal import DownloadJournal, JOURNAL_SUFFIX
+from plugins.functions.file_id_cache import file_id_cache, thumb_hash
+from plugins.functions.http_client import http_client
+from plugins.functions.jobs import current_job, job_registry
+from plugins.functions.metrics import (
+    download_bytes,
+    download_seconds,
+    upload_bytes,
+    upload_seconds,
+)
+from plugins.functions.ranged_download import (
+    RangeNotHonoured,
+    download_segmented,
+    probe_ranges,
+)
+from plugins.functions.storage import StorageFull, storage
+from plugins.functions.stream_upload import (
+    parallel_upload_enabled,
+    send_parallel_media,
+    send_streamed_document,
+    stream_upload,
+)
+from plugins.functions.tracing import record_span, span
+from plugins.functions.upload_farm import upload_farm
 from plugins.script import Translation
 from plugins.utitles import Mdata01, Mdata02, Mdata03
 from config import Config
@@ -22,9 +46,8 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 
-async def ddl_call_back(bot, update):
-    cb_data = update.data
-    tg_send_type, youtube_dl_format, youtube_dl_ext = cb_data.split("=")
+async def ddl_call_back(bot, update, choice):
+    tg_send_type, youtube_dl_format, youtube_dl_ext = choice
     youtube_dl_url = update.message.reply_to_message.text
     custom_file_name = os.path.basename(youtube_dl_url)
 
@@ -68,47 +91,118 @@ async def ddl_call_back(bot, update):
         text=Translation.DOWNLOAD_START.format(custom_file_name),
         chat_id=update.message.chat.id,
         message_id=update.message.id,
+        reply_markup=job_registry.markup_for(update.message),
     )
 
     tmp_directory_for_each_user = (
         f"{Config.DOWNLOAD_LOCATION}/{str(update.from_user.id)}"
     )
 
-    if not os.path.isdir(tmp_directory_for_each_user):
-        os.makedirs(tmp_directory_for_each_user)
-
     download_directory = f"{tmp_directory_for_each_user}/{custom_file_name}"
 
-    async with aiohttp.ClientSession() as session:
-        c_time = time.time()
-        try:
-            await download_coroutine(
-                bot,
-                session,
-                youtube_dl_url,
-                download_directory,
-                update.message.chat.id,
-                update.message.id,
-                c_time,
+    job = current_job()
+    if job is not None:
+        # a cancelled download is not worth resuming
+        job.add_path(download_directory)
+        job.add_path(download_directory + JOURNAL_SUFFIX)
+
+    thumb_path = f"{Config.DOWNLOAD_LOCATION}/{update.from_user.id}.jpg"
+    with span("thumbnail"):
+        cache_key = file_id_cache.key(
+            youtube_dl_url,
+            youtube_dl_format,
+            tg_send_type,
+            thumb_hash(thumb_path),
+            custom_file_name,
+        )
+
+    session = http_client.session
+    c_time = time.time()
+    try:
+        probe = await probe_ranges(session, youtube_dl_url)
+        total_length, _, _, validators = probe
+        validator = (
+            validators["etag"] or validators["last_modified"] or str(total_length)
+        )
+        if await file_id_cache.resend(
+            bot,
+            update.message.chat.id,
+            cache_key,
+            validator,
+            caption=description,
+            reply_to_message_id=update.message.reply_to_message.id,
+        ):
+            await bot.edit_message_text(
+                text=Translation.SENT_FROM_CACHE,
+                chat_id=update.message.chat.id,
+                message_id=update.message.id,
             )
+            return True
 
-        except asyncio.TimeoutError:
+        async def notify_waiting():
             await bot.edit_message_text(
-                text=Translation.SLOW_URL_DECED,
+                text=Translation.WAITING_FOR_STORAGE,
                 chat_id=update.message.chat.id,
                 message_id=update.message.id,
+                reply_markup=job_registry.markup_for(update.message),
             )
-            return False
 
-    if os.path.exists(download_directory):
-        save_ytdl_json_path = (
-            f"{Config.DOWNLOAD_LOCATION}/{str(update.message.chat.id)}.json"
+        # reserved before any transfer starts: a link that cannot be streamed
+        # falls back to a download to disk, and no response is held open
+        # while the job waits for space
+        await storage.reserve(total_length, download_directory, notify=notify_waiting)
+
+        if (
+            Config.STREAM_UPLOAD
+            and tg_send_type == "file"
+            and await stream_document(
+                bot,
+                update,
+                session,
+                youtube_dl_url,
+                custom_file_name,
+                description,
+                (cache_key, validator),
+            )
+        ):
+            return True
+
+        os.makedirs(tmp_directory_for_each_user, exist_ok=True)
+        download_started = time.monotonic()
+        await download_coroutine(
+            bot,
+            session,
+            youtube_dl_url,
+            download_directory,
+            update.message.chat.id,
+            update.message.id,
+            c_time,
+            probe,
         )
-        download_location = f"{Config.DOWNLOAD_LOCATION}/{update.from_user.id}.jpg"
-        thumb = download_location if os.path.isfile(download_location) else None
+        download_seconds.observe(time.monotonic() - download_started, path="ddl")
+        record_span("download", download_started)
 
-        if os.path.exists(save_ytdl_json_path):
-            os.remove(save_ytdl_json_path)
+    except asyncio.TimeoutError:
+        await bot.edit_message_text(
+            text=Translation.SLOW_URL_DECED,
+            chat_id=update.message.chat.id,
+            message_id=update.message.id,
+        )
+        return False
+    except StorageFull as e:
+        logger.info("Error %s", e)
+        await bot.edit_message_text(
+            text=Translation.STORAGE_FULL,
+            chat_id=update.message.chat.id,
+            message_id=update.message.id,
+        )
+        return False
+
+    if os.path.exists(download_directory):
+        thumb = thumb_path if os.path.isfile(thumb_path) else None
+
+        if os.path.isfile(download_directory):
+            download_bytes.inc(os.path.getsize(download_directory), path="ddl")
 
         end_one = datetime.now()
 
@@ -116,6 +210,7 @@ async def ddl_call_back(bot, update):
             text=Translation.UPLOAD_START,
             chat_id=update.message.chat.id,
             message_id=update.message.id,
+            reply_markup=job_registry.markup_for(update.message),
         )
 
         file_size = Config.TG_MAX_FILE_SIZE + 1
@@ -135,82 +230,123 @@ async def ddl_call_back(bot, update):
 
         else:
             start_time = time.time()
+            upload_started = time.monotonic()
+
+            async with upload_farm.uploader(
+                bot, update.message.chat.id, update.message.reply_to_message.id
+            ) as (uploader, chat_id, reply_to):
+                if parallel_upload_enabled(file_size):
+                    sent_message = await send_parallel_media(
+                        uploader,
+                        chat_id,
+                        download_directory,
+                        tg_send_type,
+                        caption=description,
+                        thumb=thumb,
+                        reply_to_message_id=reply_to,
+                        progress=progress_for_pyrogram,
+                        progress_args=(
+                            Translation.UPLOAD_START,
+                            update.message,
+                            start_time,
+                        ),
+                    )
 
-            if tg_send_type == "video":
-                width, height, duration = await Mdata01(download_directory)
-                await bot.send_video(
-                    chat_id=update.message.chat.id,
-                    video=download_directory,
-                    thumb=thumb,
-                    caption=description,
-                    duration=duration,
-                    width=width,
-                    height=height,
-                    supports_streaming=True,
-                    reply_to_message_id=update.message.reply_to_message.id,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
-                )
-
-            elif tg_send_type == "audio":
-                duration = await Mdata03(download_directory)
-                await bot.send_audio(
-                    chat_id=update.message.chat.id,
-                    audio=download_directory,
-                    thumb=thumb,
-                    caption=description,
-                    duration=duration,
-                    reply_to_message_id=update.message.reply_to_message.id,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
-                )
-
-            elif tg_send_type == "vm":
-                width, duration = await Mdata02(download_directory)
-                await bot.send_video_note(
-                    chat_id=update.message.chat.id,
-                    video_note=download_directory,
-                    thumb=thumb,
-                    duration=duration,
-                    length=width,
-                    reply_to_message_id=update.message.reply_to_message.id,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
-                )
-
-            else:
-                await bot.send_document(
-                    chat_id=update.message.chat.id,
-                    document=download_directory,
-                    thumb=thumb,
-                    caption=description,
-                    reply_to_message_id=update.message.reply_to_message.id,
-                    progress=progress_for_pyrogram,
-                    progress_args=(
-                        Translation.UPLOAD_START,
-                        update.message,
-                        start_time,
-                    ),
-                )
+                elif tg_send_type == "video":
+                    with span("metadata"):
+                        width, height, duration = await Mdata01(download_directory)
+                    upload_started = time.monotonic()
+                    sent_message = await uploader.send_video(
+                        chat_id=chat_id,
+                        video=download_directory,
+                        thumb=thumb,
+                        caption=description,
+                        duration=duration,
+                        width=width,
+                        height=height,
+                        supports_streaming=True,
+                        reply_to_message_id=reply_to,
+                        progress=progress_for_pyrogram,
+                        progress_args=(
+                            Translation.UPLOAD_START,
+                            update.message,
+                            start_time,
+                        ),
+                    )
 
+                elif tg_send_type == "audio":
+                    with span("metadata"):
+                        duration = await Mdata03(download_directory)
+                    upload_started = time.monotonic()
+                    sent_message = await uploader.send_audio(
+                        chat_id=chat_id,
+                        audio=download_directory,
+                        thumb=thumb,
+                        caption=description,
+                        duration=duration,
+                        reply_to_message_id=reply_to,
+                        progress=progress_for_pyrogram,
+                        progress_args=(
+                            Translation.UPLOAD_START,
+                            update.message,
+                            start_time,
+                        ),
+                    )
+
+                elif tg_send_type == "vm":
+                    with span("metadata"):
+                        width, duration = await Mdata02(download_directory)
+                    upload_started = time.monotonic()
+                    sent_message = await uploader.send_video_note(
+                        chat_id=chat_id,
+                        video_note=download_directory,
+                        thumb=thumb,
+                        duration=duration,
+                        length=width,
+                        reply_to_message_id=reply_to,
+                        progress=progress_for_pyrogram,
+                        progress_args=(
+                            Translation.UPLOAD_START,
+                            update.message,
+                            start_time,
+                        ),
+                    )
+
+                else:
+                    sent_message = await uploader.send_document(
+                        chat_id=chat_id,
+                        document=download_directory,
+                        thumb=thumb,
+                        caption=description,
+                        reply_to_message_id=reply_to,
+                        progress=progress_for_pyrogram,
+                        progress_args=(
+                            Translation.UPLOAD_START,
+                            update.message,
+                            start_time,
+                        ),
+                    )
+
+            sent_message = await upload_farm.deliver(
+                bot,
+                sent_message,
+                update.message.chat.id,
+                update.message.reply_to_message.id,
+            )
+
+            file_id_cache.store(cache_key, validator, sent_message)
+            upload_seconds.observe(time.monotonic() - upload_started, path="ddl")
+            record_span("upload", upload_started)
+            upload_bytes.inc(file_size, path="ddl")
             end_two = datetime.now()
 
-            try:
-                os.remove(download_directory)
-            except Exception:
-                pass
+            with span("cleanup"):
+                try:
+                    os.remove(download_directory)
+                    os.rmdir(tmp_directory_for_each_user)
+                except OSError:
+                    # other downloads of the user are still running
+                    pass
 
             time_taken_for_download = (end_one - start).seconds
             time_taken_for_upload = (end_two - end_one).seconds
@@ -235,60 +371,184 @@ async def ddl_call_back(bot, update):
         )
 
 
-async def download_coroutine(bot, session, url, file_name, chat_id, message_id, start):
-    downloaded = 0
-    display_message = ""
+async def stream_document(bot, update, session, url, file_name, description, cache_entry):
+    """
+    Upload a direct link as a document while it is still downloading.
+
+    Parameters:
+    - bot (pyrogram.Client): Client used to upload.
+    - update (pyrogram.types.CallbackQuery): Callback that started the job.
+    - session (aiohttp.ClientSession): Session used for the download.
+    - url (str): The direct link.
+    - file_name (str): Name of the document in Telegram.
+    - description (str): Caption of the document.
+    - cache_entry (Tuple[str, str]): file_id cache key and validator of the link.
+
+    Returns:
+    bool: False when the link cannot be streamed and must be downloaded first.
+    """
+    start = datetime.now()
+    started = time.monotonic()
 
     async with session.get(url, timeout=Config.PROCESS_MAX_TIMEOUT) as response:
-        total_length = int(response.headers["Content-Length"])
-        content_type = response.headers["Content-Type"]
+        total_length = int(response.headers.get("Content-Length", 0))
+        content_type = response.headers.get("Content-Type", "")
+
+        if (
+            not total_length
+            or total_length > Config.TG_MAX_FILE_SIZE
+            or ("text" in content_type and total_length < 500)
+        ):
+            return False
 
-        if "text" in content_type and total_length < 500:
-            return await response.release()
+        await bot.edit_message_text(
+            text=Translation.UPLOAD_START,
+            chat_id=update.message.chat.id,
+            message_id=update.message.id,
+            reply_markup=job_registry.markup_for(update.message),
+        )
 
-        with open(file_name, "wb") as f_handle:
-            while True:
-                chunk = await response.content.read(Config.CHUNK_SIZE)
+        thumb = f"{Config.DOWNLOAD_LOCATION}/{update.from_user.id}.jpg"
+        async with upload_farm.uploader(
+            bot, update.message.chat.id, update.message.reply_to_message.id
+        ) as (uploader, chat_id, reply_to):
+            input_file = await stream_upload(
+                uploader,
+                response,
+                file_name,
+                total_length,
+                progress=progress_for_pyrogram,
+                progress_args=(
+                    Translation.UPLOAD_START,
+                    update.message,
+                    time.time(),
+                ),
+            )
+            sent_message = await send_streamed_document(
+                uploader,
+                chat_id,
+                input_file,
+                file_name,
+                caption=description,
+                thumb=thumb,
+                reply_to_message_id=reply_to,
+            )
 
-                if not chunk:
-                    break
+    sent_message = await upload_farm.deliver(
+        bot, sent_message, update.message.chat.id, update.message.reply_to_message.id
+    )
 
-                f_handle.write(chunk)
-                downloaded += Config.CHUNK_SIZE
-                now = time.time()
-                diff = now - start
-
-                if round(diff % 5.0) == 0 or downloaded == total_length:
-                    percentage = downloaded * 100 / total_length
-                    speed = downloaded / diff
-                    elapsed_time = round(diff) * 1000
-                    time_to_completion = (
-                        round((total_length - downloaded) / speed) * 1000
-                    )
-                    estimated_total_time = elapsed_time + time_to_completion
+    file_id_cache.store(*cache_entry, sent_message)
+    # download and upload overlap: both are counted for the whole pipeline
+    elapsed = time.monotonic() - started
+    time_taken = (datetime.now() - start).seconds
+    download_bytes.inc(total_length, path="stream")
+    download_seconds.observe(elapsed, path="stream")
+    upload_bytes.inc(total_length, path="stream")
+    upload_seconds.observe(elapsed, path="stream")
+    record_span("upload", started)
+
+    await bot.edit_message_text(
+        text=Translation.AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS.format(
+            time_taken, time_taken
+        ),
+        chat_id=update.message.chat.id,
+        message_id=update.message.id,
+        disable_web_page_preview=True,
+    )
+
+    logger.info("Streamed in: %s", str(time_taken))
+    return True
+
+
+async def download_coroutine(
+    bot, session, url, file_name, chat_id, message_id, start, probe=None
+):
+    """
+    Download a direct link, over several connections when the server allows it.
 
-                    try:
-                        current_message = """**Download Status**
+    A segmented download that fails falls back to a single stream.
+
+    Parameters:
+    - probe (Tuple[int, str, bool, dict]): Result of ``probe_ranges`` for
+      ``url`` when the caller already has it, probed again otherwise.
+    """
+    downloaded = 0
+    job = job_registry.for_message(chat_id, message_id)
+    reporter = ProgressReporter(
+        lambda text: bot.edit_message_text(
+            chat_id,
+            message_id,
+            text=text,
+            reply_markup=job.markup if job else None,
+        )
+    )
+
+    async def report(downloaded, total_length):
+        finished = downloaded >= total_length
+        if not (finished or reporter.due()):
+            return
+
+        diff = max(time.time() - start, 0.001)
+        percentage = downloaded * 100 / total_length
+        speed = downloaded / diff
+        elapsed_time = round(diff) * 1000
+        time_to_completion = (
+            round((total_length - downloaded) / speed) * 1000 if speed else 0
+        )
+        estimated_total_time = elapsed_time + time_to_completion
+
+        current_message = """**Download Status**
 Percentage : {}
 URL: {}
 File Size: {}
 Downloaded: {}
 ETA: {}""".format(
-                            percentage,
-                            url,
-                            humanbytes(total_length),
-                            humanbytes(downloaded),
-                            TimeFormatter(estimated_total_time),
-                        )
-
-                        if current_message != display_message:
-                            await bot.edit_message_text(
-                                chat_id, message_id, text=current_message
-                            )
-
-                            display_message = current_message
-
-                    except Exception as e:
-                        logger.info(str(e))
+            percentage,
+            url,
+            humanbytes(total_length),
+            humanbytes(downloaded),
+            TimeFormatter(estimated_total_time),
+        )
+
+        if finished:
+            await reporter.finish(current_message)
+        else:
+            await reporter.update(current_message)
+
+    if probe is None:
+        probe = await probe_ranges(session, url)
+    total_length, content_type, accepts_ranges, validators = probe
+
+    if "text" in content_type and total_length < 500:
+        return None
+
+    if accepts_ranges and total_length > 0:
+
+        async def segment_progress(downloaded):
+            await report(downloaded, total_length)
+
+        try:
+            return await download_segmented(
+                session, url, file_name, total_length, validators, segment_progress
+            )
+        except RangeNotHonoured as e:
+            # the resource changed or stopped honouring ranges: what was
+            # journaled is useless, start over on one connection. Segments
+            # that broke off were already retried, and their journal is kept
+            # for the next attempt
+            logger.info("Segmented download failed, using one stream: %s", e)
+            DownloadJournal(file_name, url, total_length, validators).discard()
+
+    async with session.get(url, timeout=Config.PROCESS_MAX_TIMEOUT) as response:
+        total_length = int(response.headers["Content-Length"])
+
+        # a write of one chunk to the page cache costs less than handing it
+        # to a thread, see benchmarks/bench_inline_writes.py
+        with open(file_name, "wb") as f_handle:
+            async for chunk in response.content.iter_chunked(Config.CHUNK_SIZE * 1024):
+                f_handle.write(chunk)
+                downloaded += len(chunk)
+                await report(downloaded, total_length)
 
         return await response.release()
@@ -9,8 +9,16 @@ from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from config import Config
 from plugins.script import Translation
-from plugins.functions.ran_text import random_char
+from plugins.functions.callback_codec import OP_DIRECT, OP_FORMAT, encode
 from plugins.functions.display_progress import humanbytes
+from plugins.functions.format_sessions import format_sessions
+from plugins.functions.help_uploadbot import DetectFormatSizes
+from plugins.functions.jobs import job_registry
+from plugins.functions.metrics import probe_seconds
+from plugins.functions.probe_cache import probe_cache
+from plugins.functions.timers import timers
+from plugins.functions.tracing import record_span
+from plugins.functions.ytdl_pool import ytdl_pool, YtdlError
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -19,6 +27,38 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 
+def session_keyboard(user_id, url, response_json, rows):
+    """
+    Open a format session for a keyboard and build its buttons.
+
+    The callback data of a button only holds the session token and the
+    index of its choice, so it stays short whatever the format ids are.
+
+    Parameters:
+    - user_id (int): User the keyboard is sent to.
+    - url (str): The probed URL.
+    - response_json (dict): The yt-dlp info dict, empty when the probe failed.
+    - rows (List[List[Tuple[str, int, Tuple[str, str, str]]]]): Label, opcode
+      and (send type, format id, extension) of each button.
+
+    Returns:
+    List[List[InlineKeyboardButton]]: The keyboard rows.
+    """
+    choices = [choice for row in rows for _, _, choice in row]
+    token = format_sessions.create(user_id, url, response_json, choices)
+    keyboard = []
+    index = 0
+    for row in rows:
+        buttons = []
+        for label, opcode, _ in row:
+            buttons.append(
+                InlineKeyboardButton(label, callback_data=encode(opcode, token, index))
+            )
+            index += 1
+        keyboard.append(buttons)
+    return keyboard
+
+
 @Client.on_message(filters.private & filters.regex(pattern=".*http.*"))
 async def echo(bot, update):
     logger.info(update.from_user)
@@ -104,6 +144,14 @@ async def echo(bot, update):
         reply_to_message_id=update.id,
     )
     if update.from_user.id not in Config.AUTH_USERS:
+        # forget the cooldown once it expired so ADL_BOT_RQ stays bounded
+        timers.schedule(
+            Config.PROCESS_MAX_TIMEOUT,
+            Config.ADL_BOT_RQ.pop,
+            str(update.from_user.id),
+            None,
+            key=("cooldown", update.from_user.id),
+        )
 
         if str(update.from_user.id) in Config.ADL_BOT_RQ:
             current_time = time.time()
@@ -126,62 +174,96 @@ async def echo(bot, update):
         else:
             Config.ADL_BOT_RQ[str(update.from_user.id)] = time.time()
 
-    process = await asyncio.create_subprocess_exec(
-        *command_to_exec,
-        # stdout must a pipe to be accessible as process.stdout
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
+    cache_key = probe_cache.key(
+        url, youtube_dl_username, youtube_dl_password, Config.HTTP_PROXY
     )
-    # Wait for the subprocess to finish
-    stdout, stderr = await process.communicate()
-    e_response = stderr.decode().strip()
-    logger.info(e_response)
-    t_response = stdout.decode().strip()
-    # logger.info(t_response)
-    # https://github.com/rg3/youtube-dl/issues/2630#issuecomment-38635239
-    if e_response and "nonnumeric port" not in e_response:
-        # logger.warn("Status : FAIL", exc.returncode, exc.output)
-        error_message = e_response.replace(
-            """
+    probe_started = time.monotonic()
+    response_json = probe_cache.get(cache_key)
+    probe_source = "cache" if response_json is not None else "cli"
+    logger.info("Probe cache: %s", probe_cache.stats())
+
+    async with job_registry.track(update.from_user.id, chk, "probe") as job:
+        if response_json is None:
+            await chk.edit_reply_markup(job.markup)
+        if response_json is None and ytdl_pool.enabled:
+            probe_source = "pool"
+            probe_options = {
+                "quiet": True,
+                "no_warnings": True,
+                "allow_dynamic_mpd": True,
+                "proxy": Config.HTTP_PROXY or None,
+                "username": youtube_dl_username,
+                "password": youtube_dl_password,
+            }
+            e_response, t_response = "", ""
+            try:
+                response_json = await ytdl_pool.extract(url, probe_options)
+                probe_cache.set(cache_key, response_json)
+            except YtdlError as e:
+                e_response = str(e)
+        elif response_json is None:
+            process = await asyncio.create_subprocess_exec(
+                *command_to_exec,
+                # stdout must a pipe to be accessible as process.stdout
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            job.add_process(process)
+            # Wait for the subprocess to finish
+            stdout, stderr = await process.communicate()
+            e_response = stderr.decode().strip()
+            logger.info(e_response)
+            t_response = stdout.decode().strip()
+        record_span("probe", probe_started)
+
+    if job.cancelled:
+        return False
+    probe_seconds.observe(time.monotonic() - probe_started, source=probe_source)
+
+    if response_json is None:
+        # logger.info(t_response)
+        # https://github.com/rg3/youtube-dl/issues/2630#issuecomment-38635239
+        if e_response and "nonnumeric port" not in e_response:
+            # logger.warn("Status : FAIL", exc.returncode, exc.output)
+            error_message = e_response.replace(
+                """
             please report this issue on https://yt-dl.org/bug . Make sure you are using the latest version;
             see  https://yt-dl.org/update  on how to update. Be sure to call youtube-dl with the --verbose flag and include its complete output.
             """,
-            "",
-        )
-        if "This video is only available for registered users." in error_message:
-            error_message += Translation.SET_CUSTOM_USERNAME_PASSWORD
-        await chk.delete()
+                "",
+            )
+            if "This video is only available for registered users." in error_message:
+                error_message += Translation.SET_CUSTOM_USERNAME_PASSWORD
+            await chk.delete()
 
-        time.sleep(40.5)
-        await bot.send_message(
-            chat_id=update.chat.id,
-            text=Translation.NO_VOID_FORMAT_FOUND.format(str(error_message)),
-            reply_to_message_id=update.id,
-            disable_web_page_preview=True,
-        )
-        return False
-    if t_response:
-        # logger.info(t_response)
-        x_reponse = t_response
-        if "\n" in x_reponse:
-            x_reponse, _ = x_reponse.split("\n")
-        response_json = json.loads(x_reponse)
-        randem = random_char(5)
-        save_ytdl_json_path = (
-            Config.DOWNLOAD_LOCATION
-            + "/"
-            + str(update.from_user.id)
-            + f"{randem}"
-            + ".json"
-        )
-        with open(save_ytdl_json_path, "w", encoding="utf8") as outfile:
-            json.dump(response_json, outfile, ensure_ascii=False)
+            # deferred without holding up the event loop or this handler
+            timers.schedule(
+                40.5,
+                bot.send_message,
+                key=("probe_error", update.chat.id, update.id),
+                chat_id=update.chat.id,
+                text=Translation.NO_VOID_FORMAT_FOUND.format(str(error_message)),
+                reply_to_message_id=update.id,
+                disable_web_page_preview=True,
+            )
+            return False
+        if t_response:
+            # logger.info(t_response)
+            x_reponse = t_response
+            if "\n" in x_reponse:
+                x_reponse, _ = x_reponse.split("\n")
+            response_json = json.loads(x_reponse)
+            probe_cache.set(cache_key, response_json)
+
+    if response_json is not None:
         # logger.info(response_json)
-        inline_keyboard = []
+        rows = []
         duration = None
         if "duration" in response_json:
             duration = response_json["duration"]
         if "formats" in response_json:
+            # sizes yt-dlp does not know are probed all at once
+            await DetectFormatSizes(response_json["formats"])
             for formats in response_json["formats"]:
                 format_id = formats.get("format_id")
                 format_string = formats.get("format_note")
@@ -199,80 +281,41 @@ async def echo(bot, update):
                 else:
                     size = 0
 
-                cb_string_video = f"video |{format_id}|{format_ext}|{randem}"
-                cb_string_file = f"fille |{format_id}|{format_ext}|{randem}"
-
                 if format_string is not None and not ("audio only" in format_string):
-                    ikeyboard = [
-                        InlineKeyboardButton(
-                            "🎬 "
-                            + format_string
-                            + " "
-                            + format_ext
-                            + " "
-                            + humanbytes(size)
-                            + " ",
-                            callback_data=(cb_string_video).encode("UTF-8"),
-                        )
-                    ]
+                    label = (
+                        "🎬 "
+                        + format_string
+                        + " "
+                        + format_ext
+                        + " "
+                        + humanbytes(size)
+                        + " "
+                    )
                 else:
                     # special weird case :\
-                    ikeyboard = [
-                        InlineKeyboardButton(
-                            "🎬 [" + "] ( " + humanbytes(size) + " )",
-                            callback_data=(cb_string_video).encode("UTF-8"),
-                        )
-                    ]
-                inline_keyboard.append(ikeyboard)
+                    label = "🎬 [" + "] ( " + humanbytes(size) + " )"
+                rows.append([(label, OP_FORMAT, ("video", format_id, format_ext))])
             if duration is not None:
-                cb_string_64 = "{}|{}|{}|{}".format("audio", "64k", "mp3", randem)
-                cb_string_128 = "{}|{}|{}|{}".format("audio", "128k", "mp3", randem)
-                cb_string = "{}|{}|{}|{}".format("audio", "320k", "mp3", randem)
-                inline_keyboard.append(
+                rows.append(
                     [
-                        InlineKeyboardButton(
-                            "🎼 ᴍᴘ𝟹 " + "(" + "64 ᴋʙᴘs" + ")",
-                            callback_data=cb_string_64.encode("UTF-8"),
-                        ),
-                        InlineKeyboardButton(
-                            "🎼 ᴍᴘ𝟹 " + "(" + "128 ᴋʙᴘs" + ")",
-                            callback_data=cb_string_128.encode("UTF-8"),
-                        ),
+                        ("🎼 ᴍᴘ𝟹 " + "(" + "64 ᴋʙᴘs" + ")", OP_FORMAT, ("audio", "64k", "mp3")),
+                        ("🎼 ᴍᴘ𝟹 " + "(" + "128 ᴋʙᴘs" + ")", OP_FORMAT, ("audio", "128k", "mp3")),
                     ]
                 )
-                inline_keyboard.append(
-                    [
-                        InlineKeyboardButton(
-                            "🎼 ᴍᴘ𝟹 " + "(" + "320 ᴋʙᴘs" + ")",
-                            callback_data=cb_string.encode("UTF-8"),
-                        )
-                    ]
-                )
-                inline_keyboard.append(
-                    [InlineKeyboardButton("⛔ ᴄʟᴏsᴇ", callback_data="close")]
+                rows.append(
+                    [("🎼 ᴍᴘ𝟹 " + "(" + "320 ᴋʙᴘs" + ")", OP_FORMAT, ("audio", "320k", "mp3"))]
                 )
         else:
             format_id = response_json["format_id"]
             format_ext = response_json["ext"]
-            cb_string_file = "{}|{}|{}|{}".format("file", format_id, format_ext, randem)
-            cb_string_video = "{}|{}|{}|{}".format(
-                "video", format_id, format_ext, randem
-            )
+            rows.append([("🎬 Video", OP_FORMAT, ("video", format_id, format_ext))])
+            rows.append([("📁 Document", OP_DIRECT, ("file", format_id, format_ext))])
+        inline_keyboard = session_keyboard(
+            update.from_user.id, url, response_json, rows
+        )
+        if "formats" in response_json and duration is not None:
             inline_keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        "🎬 Video", callback_data=(cb_string_video).encode("UTF-8")
-                    )
-                ]
-            )
-            cb_string_file = "{}={}={}".format("file", format_id, format_ext)
-            cb_string_video = "{}={}={}".format("video", format_id, format_ext)
-            inline_keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        "📁 Document", callback_data=(cb_string_file).encode("UTF-8")
-                    )
-                ]
+                [InlineKeyboardButton("⛔ ᴄʟᴏsᴇ", callback_data="close")]
             )
         reply_markup = InlineKeyboardMarkup(inline_keyboard)
         await chk.delete()
@@ -287,15 +330,11 @@ async def echo(bot, update):
         )
     else:
         # fallback for nonnumeric port a.k.a seedbox.io
-        inline_keyboard = []
-        cb_string_file = "{}={}={}".format("file", "LFO", "NONE")
-        cb_string_video = "{}={}={}".format("video", "OFL", "ENON")
-        inline_keyboard.append(
-            [
-                InlineKeyboardButton(
-                    "🎬 ᴍᴇᴅɪᴀ", callback_data=(cb_string_video).encode("UTF-8")
-                )
-            ]
+        inline_keyboard = session_keyboard(
+            update.from_user.id,
+            url,
+            {},
+            [[("🎬 ᴍᴇᴅɪᴀ", OP_DIRECT, ("video", "OFL", "ENON"))]],
         )
         reply_markup = InlineKeyboardMarkup(inline_keyboard)
         await chk.delete(True)
@@ -0,0 +1,87 @@
+"""Packed callback_data: a version byte, a one-byte opcode and length-prefixed fields"""
+
+import base64
+
+VERSION = 1
+# Telegram rejects callback_data longer than this many bytes
+MAX_LENGTH = 64
+
+# yt-dlp download of a format keyboard choice: session token, choice index
+OP_FORMAT = 1
+# Direct download of a format keyboard choice: session token, choice index
+OP_DIRECT = 2
+# Cancel a running job: job id
+OP_CANCEL = 3
+
+# Number of fields each opcode is encoded with
+FIELD_COUNTS = {OP_FORMAT: 2, OP_DIRECT: 2, OP_CANCEL: 1}
+
+
+class CallbackDataError(ValueError):
+    """The callback data was not produced by ``encode``."""
+
+
+def encode(opcode, *fields):
+    """
+    Pack an opcode and its fields into callback data.
+
+    Parameters:
+    - opcode (int): One of the ``OP_*`` constants.
+    - fields (str): Arguments of the opcode, 255 bytes at most each.
+
+    Returns:
+    str: Unpadded url-safe base64 of the packed bytes.
+
+    Raises:
+    CallbackDataError: Unknown opcode, or the packed data does not fit in
+    ``MAX_LENGTH``.
+    """
+    if opcode not in FIELD_COUNTS:
+        raise CallbackDataError(f"Unknown opcode {opcode}")
+    packed = bytearray([VERSION, opcode])
+    for field in fields:
+        raw = str(field).encode("utf8")
+        if len(raw) > 255:
+            raise CallbackDataError(f"Field too long: {field!r}")
+        packed.append(len(raw))
+        packed.extend(raw)
+    data = base64.urlsafe_b64encode(bytes(packed)).rstrip(b"=").decode("ascii")
+    if len(data) > MAX_LENGTH:
+        raise CallbackDataError(f"Callback data too long for opcode {opcode}")
+    return data
+
+
+def decode(data):
+    """
+    Unpack callback data produced by ``encode``.
+
+    Parameters:
+    - data (str): The callback data of a query.
+
+    Returns:
+    Tuple[int, List[str]]: The opcode and its fields.
+
+    Raises:
+    CallbackDataError: The data is not packed data of this version, or its
+    opcode is unknown.
+    """
+    try:
+        packed = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except ValueError as e:
+        raise CallbackDataError(str(e)) from e
+    if len(packed) < 2 or packed[0] != VERSION:
+        raise CallbackDataError("Unknown callback data version")
+    if packed[1] not in FIELD_COUNTS:
+        raise CallbackDataError(f"Unknown opcode {packed[1]}")
+    fields = []
+    position = 2
+    while position < len(packed):
+        end = position + 1 + packed[position]
+        if end > len(packed):
+            raise CallbackDataError("Truncated callback data")
+        try:
+            fields.append(packed[position + 1:end].decode("utf8"))
+        except UnicodeDecodeError as e:
+            raise CallbackDataError(str(e)) from e
+        position = end
+    return packed[1], fields
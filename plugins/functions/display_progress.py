@@ -2,6 +2,12 @@ import math
 import time
 import logging
 
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from config import Config
+from plugins.functions.jobs import current_job, job_registry
+from plugins.functions.metrics import flood_wait_seconds, flood_waits
+
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
@@ -9,6 +15,95 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 
+class ProgressReporter:
+    """
+    Rate-limited editor of a single progress message.
+
+    Updates arriving faster than ``min_interval`` seconds, or while an edit
+    is still in flight, are coalesced into the latest text; identical texts
+    are never re-sent and a FloodWait pushes the next edit back by the
+    requested delay. ``finish`` delivers the last text unless that edit
+    would have to wait: a transfer never waits for its progress message,
+    which the caller replaces right after anyway.
+    """
+
+    def __init__(self, edit, min_interval=None):
+        self.edit = edit
+        self.min_interval = (
+            Config.PROGRESS_INTERVAL if min_interval is None else min_interval
+        )
+        self._last_text = None
+        self._pending = None
+        self._next_edit = 0.0
+        self._busy = False
+
+    def due(self):
+        """Return whether an ``update`` now would reach Telegram."""
+        return not self._busy and time.monotonic() >= self._next_edit
+
+    async def update(self, text):
+        self._pending = text
+        if self.due():
+            await self._flush()
+
+    async def finish(self, text=None):
+        if text is not None:
+            self._pending = text
+        if self._next_edit > time.monotonic():
+            # rate limited, possibly for minutes after a FloodWait
+            return
+        await self._flush()
+
+    async def _flush(self):
+        text = self._pending
+        if text is None or text == self._last_text:
+            return
+        self._busy = True
+        try:
+            await self.edit(text)
+            self._last_text = text
+            self._next_edit = time.monotonic() + self.min_interval
+        except FloodWait as e:
+            logger.info("FloodWait on progress edit, backing off %ss", e.value)
+            flood_waits.inc(method="edit_message")
+            flood_wait_seconds.inc(e.value, method="edit_message")
+            self._next_edit = time.monotonic() + e.value
+        except MessageNotModified:
+            self._last_text = text
+        except Exception as e:
+            logger.info("Error %s", e)
+        finally:
+            self._busy = False
+
+
+_reporters = {}
+
+
+def reporter_for(message):
+    """
+    Return the shared ``ProgressReporter`` of a Pyrogram message.
+
+    Parameters:
+    - message: The Pyrogram message showing the progress.
+
+    Returns:
+    ProgressReporter: Reporter editing ``message``.
+    """
+    key = (message.chat.id, message.id)
+    if key not in _reporters:
+        # re-send the cancel button, an edit without reply_markup removes it
+        _reporters[key] = ProgressReporter(
+            lambda text: message.edit(
+                text=text, reply_markup=job_registry.markup_for(message)
+            )
+        )
+        job = current_job()
+        if job is not None:
+            # failed and cancelled transfers never report their last chunk
+            job.add_finalizer(lambda: _reporters.pop(key, None))
+    return _reporters[key]
+
+
 async def progress_for_pyrogram(current, total, ud_type, message, start):
     """
     Display progress for a Pyrogram file upload or download.
@@ -23,35 +118,39 @@ async def progress_for_pyrogram(current, total, ud_type, message, start):
     Returns:
     None
     """
+    reporter = reporter_for(message)
+    finished = current == total
+    if not (finished or reporter.due()):
+        return
+
     now = time.time()
-    diff = now - start
-    if round(diff % 10.00) == 0 or current == total:
-        percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff) * 1000
-        time_to_completion = round((total - current) / speed) * 1000
-        estimated_total_time = elapsed_time + time_to_completion
-
-        elapsed_time = TimeFormatter(milliseconds=elapsed_time)
-        estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
-
-        progress = "[{0}{1}] \nP: {2}%\n".format(
-            "".join(["◾" for _ in range(math.floor(percentage / 5))]),
-            "".join(["◽" for _ in range(20 - math.floor(percentage / 5))]),
-            round(percentage, 2),
-        )
+    diff = max(now - start, 0.001)
+    percentage = current * 100 / total
+    speed = current / diff
+    elapsed_time = round(diff) * 1000
+    time_to_completion = round((total - current) / speed) * 1000 if speed else 0
+    estimated_total_time = elapsed_time + time_to_completion
+
+    elapsed_time = TimeFormatter(milliseconds=elapsed_time)
+    estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
+
+    progress = "[{0}{1}] \nP: {2}%\n".format(
+        "".join(["◾" for _ in range(math.floor(percentage / 5))]),
+        "".join(["◽" for _ in range(20 - math.floor(percentage / 5))]),
+        round(percentage, 2),
+    )
 
-        tmp = progress + "{0} of {1}\n\nSpeed: {2}/s\n\nETA: {3}\n\n".format(
-            humanbytes(current),
-            humanbytes(total),
-            humanbytes(speed),
-            estimated_total_time if estimated_total_time != "" else "0 s",
-        )
-        try:
-            await message.edit(text=f"{ud_type}\n {tmp}")
-        except Exception as e:
-            logger.info("Error %s", e)
-            return
+    tmp = progress + "{0} of {1}\n\nSpeed: {2}/s\n\nETA: {3}\n\n".format(
+        humanbytes(current),
+        humanbytes(total),
+        humanbytes(speed),
+        estimated_total_time if estimated_total_time != "" else "0 s",
+    )
+    if finished:
+        _reporters.pop((message.chat.id, message.id), None)
+        await reporter.finish(f"{ud_type}\n {tmp}")
+    else:
+        await reporter.update(f"{ud_type}\n {tmp}")
 
 
 SIZE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
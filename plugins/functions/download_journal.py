@@ -0,0 +1,142 @@
+"""On-disk journal of completed byte ranges for resumable direct downloads"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".journal.json"
+
+
+def merge_ranges(ranges):
+    """
+    Merge overlapping or touching inclusive byte ranges.
+
+    Parameters:
+    - ranges (List[Tuple[int, int]]): Unordered (start, end) ranges.
+
+    Returns:
+    List[Tuple[int, int]]: Sorted, non-overlapping ranges.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class DownloadJournal:
+    """
+    Sidecar file recording which parts of a download are already on disk.
+
+    The journal stores the URL, the validators (ETag / Last-Modified) and
+    the total size seen when the download started, so a resumed download
+    can detect that the remote resource changed and start over.
+    """
+
+    def __init__(self, file_name, url, total_length, validators):
+        self.path = file_name + JOURNAL_SUFFIX
+        self.file_name = file_name
+        self.url = url
+        self.total_length = total_length
+        self.validators = validators
+        self.done = []
+        self._save_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, file_name, url, total_length, validators):
+        """
+        Load the journal for ``file_name`` or start a new one.
+
+        An existing journal is only reused when it describes the same URL,
+        size and validators and the partial file is still present.
+
+        Parameters:
+        - file_name (str): Path of the file being downloaded.
+        - url (str): URL of the remote file.
+        - total_length (int): Size of the remote file in bytes.
+        - validators (dict): ``etag`` and ``last_modified`` of the remote file.
+
+        Returns:
+        DownloadJournal: The loaded or freshly created journal.
+        """
+        journal = cls(file_name, url, total_length, validators)
+        try:
+            with open(journal.path, "r", encoding="utf8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return journal
+
+        if (
+            saved.get("url") == url
+            and saved.get("total_length") == total_length
+            and saved.get("validators") == validators
+            and any(validators.values())
+            and os.path.exists(file_name)
+        ):
+            journal.done = merge_ranges(tuple(r) for r in saved.get("done", []))
+            logger.info("Resuming %s, %s bytes already on disk", file_name, journal.completed())
+        else:
+            logger.info("Discarding stale journal for %s", file_name)
+            journal.discard()
+        return journal
+
+    def completed(self):
+        """Return the number of bytes recorded as downloaded."""
+        return sum(end - start + 1 for start, end in self.done)
+
+    def missing(self):
+        """
+        Return the byte ranges that still have to be fetched.
+
+        Returns:
+        List[Tuple[int, int]]: Inclusive (start, end) ranges.
+        """
+        gaps = []
+        position = 0
+        for start, end in self.done:
+            if start > position:
+                gaps.append((position, start - 1))
+            position = end + 1
+        if position < self.total_length:
+            gaps.append((position, self.total_length - 1))
+        return gaps
+
+    async def mark(self, start, end):
+        """Record ``start``-``end`` (inclusive) as written and persist the journal on the executor."""
+        self.done = merge_ranges(self.done + [(start, end)])
+        await asyncio.get_running_loop().run_in_executor(None, self.save)
+
+    def save(self):
+        # segments save concurrently: one writer at a time, and since the
+        # ranges are read under the lock the last save is the most complete
+        with self._save_lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump(
+                    {
+                        "url": self.url,
+                        "total_length": self.total_length,
+                        "validators": self.validators,
+                        "done": list(self.done),
+                    },
+                    f,
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def discard(self):
+        self.done = []
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,214 @@
+"""Persistent index of already uploaded media, re-sent by Telegram file_id"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from pyrogram.errors import BadRequest
+
+from config import Config
+from plugins.functions.metrics import collect, collect_total
+from plugins.functions.probe_cache import normalize_url
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = ("video", "audio", "video_note", "document")
+
+
+def thumb_hash(path):
+    """
+    Hash a custom thumbnail so that changing it invalidates cached uploads.
+
+    Parameters:
+    - path (str): Path of the user's thumbnail, may not exist.
+
+    Returns:
+    str: Hex digest, or an empty string without thumbnail.
+    """
+    if not path or not os.path.isfile(path):
+        return ""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def media_file_id(message):
+    """
+    Return the file_id of the media carried by a sent message.
+
+    Parameters:
+    - message (pyrogram.types.Message): Message returned by a send method.
+
+    Returns:
+    str: The file_id, or None when the message carries no media.
+    """
+    for media_type in MEDIA_TYPES:
+        media = getattr(message, media_type, None) if message else None
+        if media is not None:
+            return media.file_id
+    return None
+
+
+class FileIdCache:
+    """
+    SQLite index mapping a request to the Telegram file_id of its upload.
+
+    A request is identified by the normalized URL, the format id, the send
+    type, the hash of the user's thumbnail and the file name. Each entry also stores a
+    validator of the source (ETag, Last-Modified or size); a lookup with a
+    different validator drops the entry. At most ``max_entries`` rows are
+    kept, the least recently used ones are evicted first. The connection is
+    shared with the metrics scrape thread and only used under a lock.
+    """
+
+    def __init__(self, db_path, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            "key TEXT PRIMARY KEY, file_id TEXT, validator TEXT, last_used REAL, uses INTEGER)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(url, format_id, send_type, thumb="", file_name=""):
+        material = "\0".join(
+            [
+                normalize_url(url),
+                format_id or "",
+                send_type or "",
+                thumb or "",
+                file_name or "",
+            ]
+        )
+        return hashlib.sha256(material.encode("utf8")).hexdigest()
+
+    def get(self, key, validator):
+        """
+        Look up the file_id stored for ``key``.
+
+        Parameters:
+        - key (str): Key built with ``FileIdCache.key``.
+        - validator (str): Current validator of the source.
+
+        Returns:
+        str: The cached file_id, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id, validator FROM file_ids WHERE key = ?", (key,)
+            ).fetchone()
+        if row is not None and row[1] != (validator or ""):
+            self.invalidate(key)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._lock:
+            self._db.execute(
+                "UPDATE file_ids SET last_used = ?, uses = uses + 1 WHERE key = ?",
+                (time.time(), key),
+            )
+            self._db.commit()
+        return row[0]
+
+    def store(self, key, validator, message):
+        """Remember the media of the sent ``message`` under ``key``."""
+        file_id = media_file_id(message)
+        if file_id is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_ids (key, file_id, validator, last_used, uses) "
+                "VALUES (?, ?, ?, ?, 0)",
+                (key, file_id, validator or "", time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM file_ids WHERE key NOT IN "
+                "(SELECT key FROM file_ids ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def invalidate(self, key):
+        self.invalidations += 1
+        with self._lock:
+            self._db.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+            self._db.commit()
+
+    def stats(self):
+        """
+        Return the counters of the cache.
+
+        Returns:
+        dict: ``hits``, ``misses``, ``invalidations``, ``hit_rate`` and ``entries``.
+        """
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+    async def resend(self, client, chat_id, key, validator, caption="", reply_to_message_id=None):
+        """
+        Send the cached upload of ``key`` again, without any transfer.
+
+        Parameters:
+        - client (pyrogram.Client): Client sending the media.
+        - chat_id (int): Target chat.
+        - key (str): Key built with ``FileIdCache.key``.
+        - validator (str): Current validator of the source.
+        - caption (str): Caption of the message.
+        - reply_to_message_id (int): Message to reply to.
+
+        Returns:
+        pyrogram.types.Message: The sent message, or None on a cache miss.
+        """
+        file_id = self.get(key, validator)
+        if file_id is None:
+            return None
+        try:
+            return await client.send_cached_media(
+                chat_id=chat_id,
+                file_id=file_id,
+                caption=caption,
+                reply_to_message_id=reply_to_message_id,
+            )
+        except BadRequest as e:
+            logger.info("Cached file_id rejected, uploading again: %s", e)
+            self.invalidate(key)
+            return None
+
+
+file_id_cache = FileIdCache(Config.FILE_ID_DB, Config.FILE_ID_CACHE_SIZE)
+
+collect_total(
+    "aup_file_id_cache_hits_total",
+    "Hits of the file_id cache.",
+    lambda: file_id_cache.stats()["hits"],
+)
+collect_total(
+    "aup_file_id_cache_misses_total",
+    "Misses of the file_id cache.",
+    lambda: file_id_cache.stats()["misses"],
+)
+collect(
+    "aup_file_id_cache_entries",
+    "Entries of the file_id cache.",
+    lambda: file_id_cache.stats()["entries"],
+)
@@ -0,0 +1,153 @@
+"""Short-lived sessions holding what the format keyboard needs, keyed by a callback token"""
+
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+from config import Config
+from plugins.functions.ran_text import random_char
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+TOKEN_LENGTH = 8
+
+
+def compact_session(user_id, url, response_json, choices=()):
+    """
+    Keep only the fields of a yt-dlp probe used once a format is chosen.
+
+    Parameters:
+    - user_id (int): User the keyboard was sent to.
+    - url (str): The probed URL.
+    - response_json (dict): The yt-dlp info dict.
+    - choices (List[Tuple[str, str, str]]): Send type, format id and extension
+      of each button, referenced by index from the callback data.
+
+    Returns:
+    dict: ``user_id``, ``url``, ``title``, ``fulltitle``, ``choices`` and
+    ``formats`` mapping each format id to its ``ext``, ``filesize`` and
+    whether it is ``audio_only``.
+    """
+    formats = {}
+    for fmt in response_json.get("formats") or [response_json]:
+        if fmt.get("format_id") is None:
+            continue
+        formats[fmt["format_id"]] = {
+            "ext": fmt.get("ext"),
+            "filesize": fmt.get("filesize") or fmt.get("filesize_approx"),
+            "audio_only": fmt.get("vcodec") == "none",
+        }
+    return {
+        "user_id": user_id,
+        "url": url,
+        "title": response_json.get("title"),
+        "fulltitle": response_json.get("fulltitle"),
+        "choices": [list(choice) for choice in choices],
+        "formats": formats,
+    }
+
+
+class FormatSessionStore:
+    """
+    TTL store of format sessions.
+
+    At most ``max_entries`` sessions are kept in memory, the least recently
+    used ones are evicted first; when ``db_path`` is set sessions are also
+    written to SQLite so keyboards keep working across restarts.
+    """
+
+    def __init__(self, max_entries, ttl, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS format_sessions "
+                "(token TEXT PRIMARY KEY, created REAL, value TEXT)"
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def create(self, user_id, url, response_json, choices=()):
+        """
+        Open a session for the keyboard built from ``response_json``.
+
+        Parameters:
+        - user_id (int): User the keyboard is sent to.
+        - url (str): The probed URL.
+        - response_json (dict): The yt-dlp info dict.
+        - choices (List[Tuple[str, str, str]]): The buttons of the keyboard.
+
+        Returns:
+        str: The token to put in the callback data.
+        """
+        token = random_char(TOKEN_LENGTH)
+        while self.get(token) is not None:
+            token = random_char(TOKEN_LENGTH)
+        entry = (time.time(), compact_session(user_id, url, response_json, choices))
+        self._remember(token, entry)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO format_sessions (token, created, value) "
+                "VALUES (?, ?, ?)",
+                (token, entry[0], json.dumps(entry[1], ensure_ascii=False)),
+            )
+            self._db.execute(
+                "DELETE FROM format_sessions WHERE created < ?",
+                (entry[0] - self.ttl,),
+            )
+            self._db.commit()
+        return token
+
+    def get(self, token):
+        """
+        Return the session of ``token``, or None when unknown or expired.
+
+        Parameters:
+        - token (str): Token returned by ``create``.
+
+        Returns:
+        dict: The session built by ``compact_session``.
+        """
+        entry = self._memory.get(token)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT created, value FROM format_sessions WHERE token = ?", (token,)
+            ).fetchone()
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+                self._remember(token, entry)
+
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            self.discard(token)
+            return None
+        self._memory.move_to_end(token)
+        return entry[1]
+
+    def discard(self, token):
+        self._memory.pop(token, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM format_sessions WHERE token = ?", (token,))
+            self._db.commit()
+
+    def _remember(self, token, entry):
+        self._memory[token] = entry
+        self._memory.move_to_end(token)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+format_sessions = FormatSessionStore(
+    Config.FORMAT_SESSION_SIZE, Config.FORMAT_SESSION_TTL, Config.FORMAT_SESSION_DB
+)
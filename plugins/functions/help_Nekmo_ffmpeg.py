@@ -1,9 +1,8 @@
 import os
 import asyncio
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
 import time
 import logging
+from plugins.functions.media_info import probe_media
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -24,8 +23,7 @@ async def place_water_mark(input_file, output_file, water_mark_file):
     str: Path to the watermarked output file.
     """
     watermarked_file = f"{output_file}.watermark.png"
-    metadata = extractMetadata(createParser(input_file))
-    width = metadata.get("width")
+    width = (await probe_media(input_file))["width"]
     # Command to shrink the watermark file
     shrink_watermark_file_genertor_command = [
         "ffmpeg",
@@ -158,10 +156,7 @@ async def generate_screen_shots(
     Returns:
     List[str]: List of paths to the generated screen shots.
     """
-    metadata = extractMetadata(createParser(video_file))
-    duration = 0
-    if metadata is not None and metadata.has("duration"):
-        duration = metadata.get("duration").seconds
+    duration = (await probe_media(video_file))["duration"]
     if duration > min_duration:
         images = []
         ttl_step = duration // no_of_photos
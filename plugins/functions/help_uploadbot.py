@@ -1,31 +1,122 @@
+import asyncio
 import logging
 import os
-import time
-import requests
 
-from plugins.functions.display_progress import humanbytes
+import aiohttp
+
+from config import Config
+from plugins.functions.display_progress import ProgressReporter, humanbytes
+from plugins.functions.http_client import http_client
+from plugins.functions.ranged_download import probe_ranges
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# Size probes of one format keyboard running at the same time
+SIZE_PROBE_CONCURRENCY = 8
+
 
-def DetectFileSize(url):
+async def DetectFileSize(url, timeout=60):
     """
-    Detect the file size of a remote file by sending a HEAD request.
+    Detect the file size of a remote file.
+
+    A HEAD request is tried first; servers that reject it or omit the
+    length are asked again with a one-byte range GET. Both requests share
+    one deadline.
 
     Parameters:
     - url (str): URL of the remote file.
+    - timeout (float): Seconds allowed for the whole probe.
 
     Returns:
-    int: Size of the file in bytes.
+    int: Size of the file in bytes, 0 when unknown.
     """
-    r = requests.head(url, allow_redirects=True, timeout=60)
-    return int(r.headers.get("content-length", 0))
+    session = http_client.session
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        async with session.head(
+            url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            size = int(response.headers.get("Content-Length", 0))
+            if response.status < 400 and size:
+                return size
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return 0
+        size, _, _, _ = await asyncio.wait_for(probe_ranges(session, url), remaining)
+        return size
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.info("Error %s", e)
+        return 0
 
 
-def DownLoadFile(url, file_name, chunk_size, client, ud_type, message_id, chat_id):
+async def DetectFileSizes(urls, timeout=None):
+    """
+    Detect the sizes of many remote files concurrently.
+
+    Parameters:
+    - urls (List[str]): URLs of the remote files.
+    - timeout (float): Seconds allowed for each probe.
+
+    Returns:
+    List[int]: Sizes in the order of ``urls``, 0 when unknown.
+    """
+    timeout = timeout or Config.SIZE_PROBE_TIMEOUT
+    semaphore = asyncio.Semaphore(SIZE_PROBE_CONCURRENCY)
+
+    async def detect(url):
+        async with semaphore:
+            return await DetectFileSize(url, timeout)
+
+    return await asyncio.gather(*(detect(url) for url in urls))
+
+
+def needs_size_probe(fmt):
+    """
+    Tell whether the size of a yt-dlp format is worth probing.
+
+    Formats yt-dlp already sized are skipped, and so are DASH and other
+    fragmented formats: their URL is a manifest or a single fragment,
+    whose length says nothing about the size of the media.
+
+    Parameters:
+    - fmt (dict): A format of a yt-dlp info dict.
+
+    Returns:
+    bool: Whether ``DetectFormatSizes`` should probe the format.
+    """
+    if fmt.get("filesize") or fmt.get("filesize_approx"):
+        return False
+    if fmt.get("fragments") or fmt.get("fragment_base_url"):
+        return False
+    note = fmt.get("format_note") or fmt.get("format") or ""
+    if "DASH" in note.upper():
+        return False
+    return bool(fmt.get("url")) and fmt.get("protocol") in ("http", "https")
+
+
+async def DetectFormatSizes(formats, timeout=None):
+    """
+    Fill in the ``filesize`` of the formats yt-dlp did not size.
+
+    Parameters:
+    - formats (List[dict]): Formats of a yt-dlp info dict, updated in place.
+    - timeout (float): Seconds allowed for each probe.
+
+    Returns:
+    None
+    """
+    unsized = [fmt for fmt in formats if needs_size_probe(fmt)]
+    sizes = await DetectFileSizes([fmt["url"] for fmt in unsized], timeout)
+    for fmt, size in zip(unsized, sizes):
+        if size:
+            fmt["filesize"] = size
+
+
+async def DownLoadFile(url, file_name, chunk_size, client, ud_type, message_id, chat_id):
     """
     Download a file from a given URL and display the download progress.
 
@@ -46,26 +137,30 @@ def DownLoadFile(url, file_name, chunk_size, client, ud_type, message_id, chat_i
     if not url:
         return file_name
 
-    r = requests.get(url, allow_redirects=True, stream=True)
-    total_size = int(r.headers.get("content-length", 0))
-    downloaded_size = 0
-
-    with open(file_name, "wb") as fd:
-        for chunk in r.iter_content(chunk_size=chunk_size):
-            if chunk:
-                fd.write(chunk)
-                downloaded_size += chunk_size
-
-            if client is not None and ((total_size // downloaded_size) % 5) == 0:
-                time.sleep(0.3)
-                try:
-                    client.edit_message_text(
-                        chat_id,
-                        message_id,
-                        text=f"{ud_type}: {humanbytes(downloaded_size)} of {humanbytes(total_size)}",
+    reporter = None
+    if client is not None:
+        reporter = ProgressReporter(
+            lambda text: client.edit_message_text(chat_id, message_id, text=text)
+        )
+
+    async with http_client.session.get(
+        url, allow_redirects=True, timeout=Config.PROCESS_MAX_TIMEOUT
+    ) as response:
+        total_size = int(response.headers.get("Content-Length", 0))
+        downloaded_size = 0
+
+        with open(file_name, "wb") as f_handle:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                f_handle.write(chunk)
+                downloaded_size += len(chunk)
+
+                if reporter is not None and reporter.due():
+                    await reporter.update(
+                        f"{ud_type}: {humanbytes(downloaded_size)} of {humanbytes(total_size)}"
                     )
-                except Exception as e:
-                    logger.info(f"Error: {e}")
-                    return
 
+    if reporter is not None:
+        await reporter.finish(
+            f"{ud_type}: {humanbytes(downloaded_size)} of {humanbytes(total_size)}"
+        )
     return file_name
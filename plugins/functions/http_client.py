@@ -0,0 +1,119 @@
+"""Application-wide pooled aiohttp session"""
+
+import logging
+
+import aiohttp
+
+from config import Config
+from plugins.functions.metrics import collect_total
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    One long-lived ``aiohttp.ClientSession`` shared by every download.
+
+    Connections are kept alive for ``keepalive`` seconds and reused across
+    jobs, at most ``limit`` in total and ``limit_per_host`` per host, and
+    DNS answers are cached for ``dns_ttl`` seconds. The session is created
+    on first use in the running loop, or by ``start``. When ``proxy`` is
+    set every request goes through it (session-level proxies need
+    aiohttp 3.10 or newer).
+    """
+
+    def __init__(self, limit, limit_per_host, dns_ttl, keepalive, proxy=""):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.proxy = proxy
+        self.counters = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+        self._session = None
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        def count(name):
+            async def hook(_session, _context, _params):
+                self.counters[name] += 1
+
+            return hook
+
+        trace.on_request_start.append(count("requests"))
+        trace.on_connection_create_end.append(count("connections_created"))
+        trace.on_connection_reuseconn.append(count("connections_reused"))
+        trace.on_dns_cache_hit.append(count("dns_cache_hits"))
+        trace.on_dns_cache_miss.append(count("dns_cache_misses"))
+        return trace
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self.start()
+        return self._session
+
+    def start(self):
+        """Create the session; must be called from the event loop."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive,
+        )
+        options = {"proxy": self.proxy} if self.proxy else {}
+        self._session = aiohttp.ClientSession(
+            connector=connector, trace_configs=[self._trace_config()], **options
+        )
+        logger.info("HTTP session started")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP session closed: %s", self.stats())
+        self._session = None
+
+    def stats(self):
+        """
+        Return the connection counters of the session.
+
+        Returns:
+        dict: The raw counters and ``reuse_rate``, the share of requests
+        served over an already open connection.
+        """
+        opened = self.counters["connections_created"] + self.counters["connections_reused"]
+        return {
+            **self.counters,
+            "reuse_rate": self.counters["connections_reused"] / opened if opened else 0.0,
+        }
+
+
+http_client = HttpClient(
+    Config.HTTP_POOL_SIZE,
+    Config.HTTP_POOL_PER_HOST,
+    Config.HTTP_DNS_TTL,
+    Config.HTTP_KEEPALIVE,
+    Config.HTTP_PROXY,
+)
+
+collect_total(
+    "aup_http_connections_created_total",
+    "Connections opened by the HTTP client.",
+    lambda: http_client.counters["connections_created"],
+)
+collect_total(
+    "aup_http_connections_reused_total",
+    "Requests served over a kept-alive connection.",
+    lambda: http_client.counters["connections_reused"],
+)
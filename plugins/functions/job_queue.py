@@ -0,0 +1,504 @@
+"""Queue handing download/upload jobs from the front-end bot to worker processes"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from plugins.functions.metrics import collect
+from plugins.functions.ran_text import random_char
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+JOB_ID_LENGTH = 8
+# Seconds finished jobs stay queryable before they are purged
+FINISHED_TTL = 24 * 3600
+
+# queued -> running -> done / error / cancelled; a cancel request moves a
+# queued job to cancelled and a running one to cancelling. When a lease
+# expires a running job is queued again and a cancelling one is cancelled
+QUEUED, RUNNING, CANCELLING = "queued", "running", "cancelling"
+DONE, ERROR, CANCELLED = "done", "error", "cancelled"
+FINISHED = (DONE, ERROR, CANCELLED)
+
+COLUMNS = (
+    "id", "kind", "user_id", "chat_id", "message_id", "payload", "state", "worker"
+)
+SELECT_JOB = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+
+
+class SqliteJobQueue:
+    """
+    Job queue in a SQLite file, shared by the processes of one host.
+
+    Jobs are claimed in submission order inside an immediate transaction,
+    so two workers never get the same job. A worker proves it is alive
+    with ``heartbeat``; a running job not heartbeaten for ``lease`` seconds
+    is queued again for another worker, a cancelling one is cancelled.
+    Only the worker holding a job can heartbeat or finish it. The
+    connection is shared with the metrics scrape thread and only used under
+    a lock.
+    """
+
+    def __init__(self, path, lease):
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, "
+            "user_id INTEGER, chat_id INTEGER, message_id INTEGER, payload TEXT, "
+            "state TEXT, worker TEXT, created REAL, updated REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)"
+        )
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        job = dict(zip(COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def put(self, kind, user_id, chat_id, message_id, payload):
+        """
+        Queue a job.
+
+        Parameters:
+        - kind (str): "ytdl" or "ddl".
+        - user_id (int): Owner of the job.
+        - chat_id (int): Chat of the status message.
+        - message_id (int): The status message, edited by the worker.
+        - payload (dict): JSON arguments of the job.
+
+        Returns:
+        str: Id of the job, also used by its cancel button.
+        """
+        now = time.time()
+        while True:
+            job_id = random_char(JOB_ID_LENGTH)
+            try:
+                with self._lock:
+                    self._db.execute(
+                        "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+                        (
+                            job_id,
+                            kind,
+                            user_id,
+                            chat_id,
+                            message_id,
+                            json.dumps(payload),
+                            QUEUED,
+                            now,
+                            now,
+                        ),
+                    )
+                return job_id
+            except sqlite3.IntegrityError:
+                continue
+
+    def claim(self, worker):
+        """
+        Take the oldest queued job.
+
+        Parameters:
+        - worker (str): Name of the claiming worker.
+
+        Returns:
+        dict: The job, or None when the queue is empty.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # the worker of an expired lease is gone: another one takes over
+                # its job, unless the user cancelled it meanwhile
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, updated = ? WHERE state = ? AND updated < ?",
+                    (CANCELLED, now, CANCELLING, now - self.lease),
+                )
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, worker = NULL WHERE state = ? AND updated < ?",
+                    (QUEUED, RUNNING, now - self.lease),
+                )
+                self._db.execute(
+                    "DELETE FROM jobs WHERE state IN (?, ?, ?) AND updated < ?",
+                    FINISHED + (now - FINISHED_TTL,),
+                )
+                row = self._db.execute(
+                    f"{SELECT_JOB} WHERE state = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, worker = ?, updated = ? WHERE id = ?",
+                        (RUNNING, worker, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        job = self._row(row)
+        if job is not None:
+            job.update(state=RUNNING, worker=worker)
+        return job
+
+    def heartbeat(self, job_id, worker):
+        """
+        Extend the lease of a running job.
+
+        Parameters:
+        - job_id (str): The job.
+        - worker (str): Name of the worker running it.
+
+        Returns:
+        str: State of the job, ``CANCELLING`` when the user cancelled it, or
+        None when ``worker`` lost the job: its lease expired and the job was
+        queued again or cancelled.
+        """
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE jobs SET updated = ? WHERE id = ? AND worker = ? AND state IN (?, ?)",
+                (time.time(), job_id, worker, RUNNING, CANCELLING),
+            ).rowcount
+        if not updated:
+            return None
+        job = self.get(job_id)
+        return job["state"] if job else None
+
+    def finish(self, job_id, worker, state):
+        """
+        Record the final state of a job.
+
+        Returns:
+        bool: Whether ``worker`` still held the job; a job it lost is left alone.
+        """
+        with self._lock:
+            return bool(
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, updated = ? WHERE id = ? AND worker = ? "
+                    "AND state IN (?, ?)",
+                    (state, time.time(), job_id, worker, RUNNING, CANCELLING),
+                ).rowcount
+            )
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask the worker of a running one to stop it."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, updated = ? WHERE id = ? AND state = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            )
+            # a job claimed in between is caught here; updated is its lease
+            self._db.execute(
+                "UPDATE jobs SET state = ? WHERE id = ? AND state = ?",
+                (CANCELLING, job_id, RUNNING),
+            )
+
+    def active(self, user_id):
+        """Return the ids of the queued and running jobs of ``user_id``."""
+        with self._lock:
+            return [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT id FROM jobs WHERE user_id = ? AND state IN (?, ?) ORDER BY created",
+                    (user_id, QUEUED, RUNNING),
+                )
+            ]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(f"{SELECT_JOB} WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def counts(self):
+        """
+        Count the jobs by state.
+
+        Returns:
+        Dict[str, int]: Number of jobs of each state present in the queue.
+        """
+        with self._lock:
+            return dict(
+                self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            )
+
+
+# Lua scripts of RedisJobQueue: each step of a job reads and changes its
+# state atomically, a cancel can never be overwritten by a claim or a requeue
+
+# KEYS: running, queued; ARGV: expiry cutoff, job key prefix, finished TTL
+REQUEUE_EXPIRED = f"""
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], 0, ARGV[1])) do
+    redis.call('ZREM', KEYS[1], id)
+    local key = ARGV[2] .. id
+    local state = redis.call('HGET', key, 'state')
+    if state == '{RUNNING}' then
+        redis.call('HSET', key, 'state', '{QUEUED}')
+        redis.call('HDEL', key, 'worker')
+        redis.call('LPUSH', KEYS[2], id)
+    elseif state == '{CANCELLING}' then
+        redis.call('HSET', key, 'state', '{CANCELLED}')
+        redis.call('EXPIRE', key, ARGV[3])
+    end
+end
+"""
+
+# KEYS: queued, running; ARGV: job key prefix, worker, now
+CLAIM = f"""
+while true do
+    local id = redis.call('RPOP', KEYS[1])
+    if not id then
+        return false
+    end
+    local key = ARGV[1] .. id
+    if redis.call('HGET', key, 'state') == '{QUEUED}' then
+        redis.call('HSET', key, 'state', '{RUNNING}', 'worker', ARGV[2])
+        redis.call('ZADD', KEYS[2], ARGV[3], id)
+        return id
+    end
+end
+"""
+
+# KEYS: job, running; ARGV: job id, worker, now
+HEARTBEAT = f"""
+local state = redis.call('HGET', KEYS[1], 'state')
+if redis.call('HGET', KEYS[1], 'worker') ~= ARGV[2]
+        or (state ~= '{RUNNING}' and state ~= '{CANCELLING}') then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+return state
+"""
+
+# KEYS: job, running; ARGV: job id, worker, final state, finished TTL
+FINISH = f"""
+local state = redis.call('HGET', KEYS[1], 'state')
+if redis.call('HGET', KEYS[1], 'worker') ~= ARGV[2]
+        or (state ~= '{RUNNING}' and state ~= '{CANCELLING}') then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'state', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# KEYS: job, queued; ARGV: job id, finished TTL
+CANCEL = f"""
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == '{QUEUED}' then
+    redis.call('LREM', KEYS[2], 0, ARGV[1])
+    redis.call('HSET', KEYS[1], 'state', '{CANCELLED}')
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+elseif state == '{RUNNING}' then
+    redis.call('HSET', KEYS[1], 'state', '{CANCELLING}')
+end
+"""
+
+
+class RedisJobQueue:
+    """
+    Job queue in Redis, shared by workers on several hosts.
+
+    Jobs are hashes under ``<prefix>:job:<id>``; queued ids wait in the
+    ``<prefix>:queued`` list and claimed ones are scored by their last
+    heartbeat in ``<prefix>:running``, from where expired leases are queued
+    again, or cancelled when the user asked for it. State changes run as
+    Lua scripts. Needs the ``redis`` package.
+    """
+
+    def __init__(self, url, lease, prefix="aup"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "JOB_QUEUE is a Redis URL but the redis package is not installed"
+            ) from e
+        self.lease = lease
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._requeue_expired = self._redis.register_script(REQUEUE_EXPIRED)
+        self._claim = self._redis.register_script(CLAIM)
+        self._heartbeat = self._redis.register_script(HEARTBEAT)
+        self._finish = self._redis.register_script(FINISH)
+        self._cancel = self._redis.register_script(CANCEL)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def _decode(self, job_id, fields):
+        if not fields:
+            return None
+        return {
+            "id": job_id,
+            "kind": fields["kind"],
+            "user_id": int(fields["user_id"]),
+            "chat_id": int(fields["chat_id"]),
+            "message_id": int(fields["message_id"]),
+            "payload": json.loads(fields["payload"]),
+            "state": fields["state"],
+            "worker": fields.get("worker") or None,
+        }
+
+    def put(self, kind, user_id, chat_id, message_id, payload):
+        job_id = random_char(JOB_ID_LENGTH)
+        while not self._redis.hsetnx(self._key("job", job_id), "state", QUEUED):
+            job_id = random_char(JOB_ID_LENGTH)
+        self._redis.hset(
+            self._key("job", job_id),
+            mapping={
+                "kind": kind,
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "payload": json.dumps(payload),
+            },
+        )
+        self._redis.lpush(self._key("queued"), job_id)
+        return job_id
+
+    def claim(self, worker):
+        now = time.time()
+        self._requeue_expired(
+            keys=[self._key("running"), self._key("queued")],
+            args=[now - self.lease, self._key("job", ""), FINISHED_TTL],
+        )
+        job_id = self._claim(
+            keys=[self._key("queued"), self._key("running")],
+            args=[self._key("job", ""), worker, now],
+        )
+        return self.get(job_id) if job_id else None
+
+    def heartbeat(self, job_id, worker):
+        return self._heartbeat(
+            keys=[self._key("job", job_id), self._key("running")],
+            args=[job_id, worker, time.time()],
+        )
+
+    def finish(self, job_id, worker, state):
+        return bool(
+            self._finish(
+                keys=[self._key("job", job_id), self._key("running")],
+                args=[job_id, worker, state, FINISHED_TTL],
+            )
+        )
+
+    def cancel(self, job_id):
+        self._cancel(
+            keys=[self._key("job", job_id), self._key("queued")],
+            args=[job_id, FINISHED_TTL],
+        )
+
+    def get(self, job_id):
+        return self._decode(job_id, self._redis.hgetall(self._key("job", job_id)))
+
+    def active(self, user_id):
+        job_ids = self._redis.lrange(self._key("queued"), 0, -1)[::-1]
+        job_ids += self._redis.zrange(self._key("running"), 0, -1)
+        pipeline = self._redis.pipeline()
+        for job_id in job_ids:
+            pipeline.hmget(self._key("job", job_id), "user_id", "state")
+        return [
+            job_id
+            for job_id, (owner, state) in zip(job_ids, pipeline.execute())
+            if owner == str(user_id) and state in (QUEUED, RUNNING)
+        ]
+
+    def counts(self):
+        return {
+            QUEUED: self._redis.llen(self._key("queued")),
+            RUNNING: self._redis.zcard(self._key("running")),
+        }
+
+
+class AsyncJobQueue:
+    """
+    Awaitable front of a job queue.
+
+    SQLite calls may wait up to 30 seconds on the lock of another process
+    and Redis calls on the network, so every call runs on a thread of its
+    own instead of the event loop. The single thread also keeps the calls
+    of a process in order and off each other's transactions.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lease = backend.lease
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="job-queue"
+        )
+
+    async def _call(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, method, *args
+        )
+
+    async def put(self, kind, user_id, chat_id, message_id, payload):
+        return await self._call(
+            self.backend.put, kind, user_id, chat_id, message_id, payload
+        )
+
+    async def claim(self, worker):
+        return await self._call(self.backend.claim, worker)
+
+    async def heartbeat(self, job_id, worker):
+        return await self._call(self.backend.heartbeat, job_id, worker)
+
+    async def finish(self, job_id, worker, state):
+        return await self._call(self.backend.finish, job_id, worker, state)
+
+    async def cancel(self, job_id):
+        return await self._call(self.backend.cancel, job_id)
+
+    async def get(self, job_id):
+        return await self._call(self.backend.get, job_id)
+
+    async def active(self, user_id):
+        return await self._call(self.backend.active, user_id)
+
+    async def counts(self):
+        return await self._call(self.backend.counts)
+
+
+def open_job_queue(url, lease):
+    """
+    Open the queue described by ``url``.
+
+    Parameters:
+    - url (str): ``redis://`` or ``rediss://`` URL, otherwise the path of a
+      SQLite file (an optional ``sqlite:///`` prefix is accepted). Empty
+      when jobs run inside the bot process.
+    - lease (int): Seconds a running job survives without heartbeat.
+
+    Returns:
+    AsyncJobQueue: The queue, or None when ``url`` is empty.
+    """
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return AsyncJobQueue(RedisJobQueue(url, lease))
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return AsyncJobQueue(SqliteJobQueue(url, lease))
+
+
+job_queue = open_job_queue(Config.JOB_QUEUE, Config.JOB_LEASE)
+
+if job_queue is not None:
+    collect(
+        "aup_worker_queue_jobs",
+        "Jobs waiting for a worker process.",
+        # scrapes run on the web server thread, off the event loop
+        lambda: job_queue.backend.counts().get(QUEUED, 0),
+    )
@@ -0,0 +1,182 @@
+"""Registry of running jobs so that users can cancel them"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from plugins.functions.callback_codec import OP_CANCEL, encode
+from plugins.functions.metrics import collect, job_seconds, jobs_finished
+from plugins.functions.ran_text import random_char
+from plugins.functions.tracing import span, tracer
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+_current_job = ContextVar("current_job", default=None)
+
+
+def current_job():
+    """Return the job the running coroutine belongs to, if any."""
+    return _current_job.get()
+
+
+def cancel_markup(job_id):
+    """Return the keyboard with the cancel button of ``job_id``."""
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⛔ Cancel", callback_data=encode(OP_CANCEL, job_id))]]
+    )
+
+
+class ActiveJob:
+    """
+    A running job: its task, child processes and temp paths.
+
+    ``cancel`` cancels the task, kills every registered process right
+    away and makes ``JobRegistry.track`` delete the registered paths.
+    """
+
+    def __init__(self, job_id, user_id, message, label):
+        self.id = job_id
+        self.user_id = user_id
+        self.message = message
+        self.label = label
+        self.task = asyncio.current_task()
+        self.processes = []
+        self.paths = []
+        self.finalizers = []
+        self.cancelled = False
+        self.markup = cancel_markup(job_id)
+
+    def add_process(self, process):
+        self.processes.append(process)
+
+    def add_path(self, path):
+        self.paths.append(path)
+
+    def add_finalizer(self, callback):
+        """Run ``callback()`` when the job ends, however it ends."""
+        self.finalizers.append(callback)
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        for process in self.processes:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+        if self.task is not None:
+            self.task.cancel()
+
+    def remove_paths(self):
+        for path in self.paths:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.info("Error %s", e)
+
+
+class JobRegistry:
+    def __init__(self):
+        self._jobs = {}
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def for_user(self, user_id):
+        return [job for job in self._jobs.values() if job.user_id == user_id]
+
+    def for_message(self, chat_id, message_id):
+        for job in self._jobs.values():
+            if job.message is not None and (job.message.chat.id, job.message.id) == (
+                chat_id,
+                message_id,
+            ):
+                return job
+        return None
+
+    def markup_for(self, message):
+        """
+        Return the cancel keyboard of the job shown in ``message``.
+
+        Parameters:
+        - message (pyrogram.types.Message): A status message.
+
+        Returns:
+        InlineKeyboardMarkup: The cancel keyboard, or None when no job uses the message.
+        """
+        job = self.for_message(message.chat.id, message.id)
+        return job.markup if job else None
+
+    @asynccontextmanager
+    async def track(self, user_id, message=None, label="job", job_id=None):
+        """
+        Register the body as a cancellable job.
+
+        A cancellation requested through ``ActiveJob.cancel`` is absorbed
+        here, after the registered temp paths were deleted, so the handler
+        simply returns.
+
+        Parameters:
+        - user_id (int): Owner of the job.
+        - message (pyrogram.types.Message): Status message showing the cancel button.
+        - label (str): Short description of the job.
+        - job_id (str): Id given by the job queue, a new one by default.
+
+        Yields:
+        ActiveJob: The registered job.
+        """
+        job_id = job_id or random_char(8)
+        while job_id in self._jobs:
+            job_id = random_char(8)
+        job = ActiveJob(job_id, user_id, message, label)
+        self._jobs[job_id] = job
+        token = _current_job.set(job)
+        trace_token = tracer.begin(job_id, label, user_id)
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield job
+            outcome = "done"
+        except asyncio.CancelledError:
+            if not job.cancelled:
+                raise
+            outcome = "cancelled"
+            logger.info("Job %s of %s cancelled", job_id, user_id)
+            if hasattr(job.task, "uncancel"):
+                job.task.uncancel()
+        finally:
+            _current_job.reset(token)
+            self._jobs.pop(job_id, None)
+            if job.cancelled:
+                with span("cleanup"):
+                    job.remove_paths()
+            for callback in job.finalizers:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.info("Error %s", e)
+            jobs_finished.inc(kind=label, outcome=outcome)
+            job_seconds.observe(time.monotonic() - started, kind=label)
+            tracer.end(trace_token, outcome)
+
+
+job_registry = JobRegistry()
+
+collect("aup_active_jobs", "Jobs running or queued.", lambda: len(job_registry.jobs()))
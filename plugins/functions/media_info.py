@@ -0,0 +1,108 @@
+"""Off-loop media metadata probing with a per-file cache"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+from collections import OrderedDict
+
+from hachoir.metadata import extractMetadata
+from hachoir.parser import createParser
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Number of probed files remembered
+MAX_ENTRIES = 256
+
+FFPROBE = shutil.which("ffprobe")
+
+# In memory only, unlike the file_id and probe caches: the probed files are
+# temporary downloads the janitor deletes, so an entry is worthless once its
+# job is over and would never be hit after a restart
+_cache = OrderedDict()
+
+
+async def _ffprobe(path):
+    # stream headers and the container duration only, no frame is decoded
+    process = await asyncio.create_subprocess_exec(
+        FFPROBE,
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration:stream=codec_type,width,height,duration",
+        "-of",
+        "json",
+        path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        logger.info("ffprobe failed on %s: %s", path, stderr.decode().strip())
+        return None
+
+    data = json.loads(stdout.decode() or "{}")
+    info = {"width": 0, "height": 0, "duration": 0}
+    duration = data.get("format", {}).get("duration")
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and not info["width"]:
+            info["width"] = int(stream.get("width") or 0)
+            info["height"] = int(stream.get("height") or 0)
+        duration = duration or stream.get("duration")
+    try:
+        info["duration"] = int(float(duration or 0))
+    except ValueError:
+        pass
+    return info
+
+
+def _hachoir_probe(path):
+    info = {"width": 0, "height": 0, "duration": 0}
+    parser = createParser(path)
+    if parser is None:
+        return info
+    with parser:
+        metadata = extractMetadata(parser)
+    if metadata is not None:
+        if metadata.has("duration"):
+            info["duration"] = metadata.get("duration").seconds
+        if metadata.has("width"):
+            info["width"] = metadata.get("width")
+        if metadata.has("height"):
+            info["height"] = metadata.get("height")
+    return info
+
+
+async def probe_media(path):
+    """
+    Return width, height and duration of a media file without blocking the loop.
+
+    ffprobe is used when available, hachoir runs on an executor thread
+    otherwise. Results are cached in memory by (path, size, mtime), so the
+    same file is only parsed once however many times a job asks for it.
+
+    Parameters:
+    - path (str): The path to the media file.
+
+    Returns:
+    dict: ``width``, ``height`` and ``duration`` (seconds), 0 when unknown.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return dict(_cache[key])
+
+    info = await _ffprobe(path) if FFPROBE else None
+    if info is None:
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(None, _hachoir_probe, path)
+
+    _cache[key] = info
+    while len(_cache) > MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return dict(info)
@@ -0,0 +1,194 @@
+"""In-process metrics exported in the Prometheus text format"""
+
+import logging
+import math
+import threading
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Seconds, from a quick probe to a long upload
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric; its value may be computed at scrape time by ``function``."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                logger.info("Error %s", e)
+                return
+            yield self.name, "", value
+            return
+        for key, value in list(self._values.items()):
+            yield self.name, _label_text(self.labelnames, key), value
+
+
+class Counter(Metric):
+    """Monotonic count, e.g. bytes transferred."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value going up and down, e.g. entries of a cache."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Distribution of observations, e.g. durations, in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += 1
+        state[2] += value
+
+    def samples(self):
+        for key, (counts, count, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, list(counts)):
+                cumulative += bucket_count
+                yield (
+                    self.name + "_bucket",
+                    _label_text(self.labelnames + ("le",), key + (_number(bound),)),
+                    cumulative,
+                )
+            labels = _label_text(self.labelnames, key)
+            yield self.name + "_count", labels, count
+            yield self.name + "_sum", labels, total
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process.
+
+    Updating a metric is a dict operation on the event loop; rendering may
+    run in the web server thread and only reads snapshots of the values.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self._register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Render every metric.
+
+        Returns:
+        str: The Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+probe_seconds = registry.histogram(
+    "aup_probe_seconds", "Time to get the formats of a link.", ["source"]
+)
+download_bytes = registry.counter(
+    "aup_download_bytes_total", "Bytes downloaded.", ["path"]
+)
+download_seconds = registry.histogram(
+    "aup_download_seconds", "Duration of downloads.", ["path"]
+)
+upload_bytes = registry.counter("aup_upload_bytes_total", "Bytes uploaded.", ["path"])
+upload_seconds = registry.histogram(
+    "aup_upload_seconds", "Duration of uploads.", ["path"]
+)
+jobs_finished = registry.counter(
+    "aup_jobs_total", "Finished jobs by kind and outcome.", ["kind", "outcome"]
+)
+job_seconds = registry.histogram(
+    "aup_job_seconds", "Duration of jobs, queue wait included.", ["kind"]
+)
+flood_waits = registry.counter(
+    "aup_flood_waits_total", "FloodWait errors returned by Telegram.", ["method"]
+)
+flood_wait_seconds = registry.counter(
+    "aup_flood_wait_seconds_total", "Seconds Telegram asked to wait.", ["method"]
+)
+
+
+def collect(name, documentation, function):
+    """Export ``function()`` as a gauge computed at scrape time."""
+    return registry.gauge(name, documentation, function=function)
+
+
+def collect_total(name, documentation, function):
+    """Export ``function()``, a count that only grows, as a counter computed at scrape time."""
+    return registry.counter(name, documentation, function=function)
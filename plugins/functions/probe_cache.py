@@ -0,0 +1,179 @@
+"""Cache of yt-dlp metadata probes keyed by normalized URL"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import Config
+from plugins.functions.metrics import collect, collect_total
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def normalize_url(url):
+    """
+    Normalize a URL so that trivially different links share a cache entry.
+
+    The scheme and host are lower-cased, the fragment and ``utm_*``
+    tracking parameters are dropped and the query is sorted.
+
+    Parameters:
+    - url (str): URL sent by the user.
+
+    Returns:
+    str: Normalized URL.
+    """
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_")
+    )
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), "")
+    )
+
+
+class ProbeCache:
+    """
+    Two-tier TTL cache of probe results.
+
+    Entries live in an in-memory LRU of ``max_entries`` items; when
+    ``db_path`` is set they are also written to SQLite so they survive
+    restarts and evictions.
+    """
+
+    def __init__(self, max_entries, ttl, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS probe (key TEXT PRIMARY KEY, created REAL, value TEXT)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(url, username=None, password=None, proxy=""):
+        """
+        Build the cache key of a probe.
+
+        Credentials and proxy are part of the key because they change what
+        yt-dlp is able to see; the password is only ever stored hashed.
+
+        Parameters:
+        - url (str): URL sent by the user.
+        - username (str): Optional site username.
+        - password (str): Optional site password.
+        - proxy (str): Proxy used for the probe.
+
+        Returns:
+        str: Hex digest identifying the probe.
+        """
+        material = "\0".join(
+            [normalize_url(url), username or "", password or "", proxy or ""]
+        )
+        return hashlib.sha256(material.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached probe for ``key``, or None when missing or expired.
+
+        Parameters:
+        - key (str): Key built with ``ProbeCache.key``.
+
+        Returns:
+        dict: The yt-dlp info dict.
+        """
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT created, value FROM probe WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+                self._remember(key, entry)
+
+        if entry is None or now - entry[0] > self.ttl:
+            if entry is not None:
+                self.invalidate(key)
+            self.misses += 1
+            return None
+
+        self._memory.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        """Store the probe result ``value`` under ``key``."""
+        entry = (time.time(), value)
+        self._remember(key, entry)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO probe (key, created, value) VALUES (?, ?, ?)",
+                (key, entry[0], json.dumps(value, ensure_ascii=False)),
+            )
+            self._db.execute(
+                "DELETE FROM probe WHERE created < ?", (entry[0] - self.ttl,)
+            )
+            self._db.commit()
+
+    def invalidate(self, key):
+        self._memory.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM probe WHERE key = ?", (key,))
+            self._db.commit()
+
+    def stats(self):
+        """
+        Return the hit/miss counters of the cache.
+
+        Returns:
+        dict: ``hits``, ``misses``, ``hit_rate`` and ``entries``.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._memory),
+        }
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+probe_cache = ProbeCache(
+    Config.PROBE_CACHE_SIZE, Config.PROBE_CACHE_TTL, Config.PROBE_CACHE_DB
+)
+
+collect_total(
+    "aup_probe_cache_hits_total",
+    "Hits of the probe cache.",
+    lambda: probe_cache.stats()["hits"],
+)
+collect_total(
+    "aup_probe_cache_misses_total",
+    "Misses of the probe cache.",
+    lambda: probe_cache.stats()["misses"],
+)
+collect(
+    "aup_probe_cache_entries",
+    "Entries of the probe cache.",
+    lambda: probe_cache.stats()["entries"],
+)
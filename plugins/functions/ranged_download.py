@@ -0,0 +1,229 @@
+"""Segmented (multi-connection) downloader for direct links"""
+
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+from config import Config
+from plugins.functions.download_journal import DownloadJournal
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Bytes a segment writes between two journal checkpoints
+JOURNAL_INTERVAL = 8 * 1024 * 1024
+# Longest pause between two attempts of a failed segment
+MAX_RETRY_DELAY = 30
+
+# Flushes written data to disk before a range is journaled as done
+_sync_data = getattr(os, "fdatasync", os.fsync)
+
+
+class RangeNotHonoured(ValueError):
+    """Raised when the server answers a range request with the full resource."""
+
+
+async def probe_ranges(session, url):
+    """
+    Probe a remote file for its size, content type and byte range support.
+
+    A single ``Range: bytes=0-0`` request is used so that servers which
+    ignore HEAD still answer correctly.
+
+    Parameters:
+    - session (aiohttp.ClientSession): Session used for the request.
+    - url (str): URL of the remote file.
+
+    Returns:
+    Tuple[int, str, bool, dict]: Total length, content type, whether ranges are
+    supported and the ``etag`` / ``last_modified`` validators.
+    """
+    headers = {"Range": "bytes=0-0"}
+    async with session.get(url, headers=headers, timeout=Config.PROCESS_MAX_TIMEOUT) as response:
+        content_type = response.headers.get("Content-Type", "")
+        content_range = response.headers.get("Content-Range", "")
+        validators = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+        }
+        if response.status == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[-1]
+            if total.isdigit():
+                return int(total), content_type, True, validators
+        total_length = int(response.headers.get("Content-Length", 0))
+        return total_length, content_type, False, validators
+
+
+def split_ranges(gaps, segments):
+    """
+    Split the byte ranges still to be fetched into at most ``segments`` pieces.
+
+    The largest range is halved repeatedly while it stays above twice
+    ``Config.MIN_SEGMENT_SIZE``.
+
+    Parameters:
+    - gaps (List[Tuple[int, int]]): Inclusive (start, end) ranges to fetch.
+    - segments (int): Maximum number of ranges to produce.
+
+    Returns:
+    List[Tuple[int, int]]: List of (start, end) byte offsets.
+    """
+    ranges = list(gaps)
+    while ranges and len(ranges) < segments:
+        start, end = max(ranges, key=lambda r: r[1] - r[0])
+        if end - start + 1 < 2 * Config.MIN_SEGMENT_SIZE:
+            break
+        middle = start + (end - start + 1) // 2
+        ranges.remove((start, end))
+        ranges += [(start, middle - 1), (middle, end)]
+    return sorted(ranges)
+
+
+async def _in_thread(function, *args):
+    """
+    Run ``function`` on the executor.
+
+    A cancelled caller still waits for the thread, which may be using the
+    file descriptor the caller is about to close.
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, function, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait({future})
+        raise
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+async def _fetch_range(session, url, fd, start, end, journal, counter, progress):
+    headers = {"Range": f"bytes={start}-{end}"}
+    if_range = journal.validators["etag"] or journal.validators["last_modified"]
+    if if_range:
+        headers["If-Range"] = if_range
+    async with session.get(url, headers=headers, timeout=Config.PROCESS_MAX_TIMEOUT) as response:
+        if response.status != 206:
+            raise RangeNotHonoured(f"Server ignored range request ({response.status})")
+        # offset is where the next block goes, checkpoint the end of the
+        # part already synced and journaled
+        offset = checkpoint = start
+        block = bytearray()
+        try:
+            async for chunk in response.content.iter_chunked(Config.CHUNK_SIZE * 1024):
+                block += chunk
+                counter[0] += len(chunk)
+                if len(block) >= Config.WRITE_BLOCK_SIZE:
+                    await _in_thread(_pwrite_all, fd, block, offset)
+                    offset += len(block)
+                    block = bytearray()
+                    if offset - checkpoint >= JOURNAL_INTERVAL:
+                        # only ranges already on disk may be skipped on resume
+                        await _in_thread(_sync_data, fd)
+                        await journal.mark(checkpoint, offset - 1)
+                        checkpoint = offset
+                await progress(counter[0])
+        finally:
+            # keep what was received for the retry or the resume
+            if block:
+                await _in_thread(_pwrite_all, fd, block, offset)
+                offset += len(block)
+            if offset > checkpoint:
+                await _in_thread(_sync_data, fd)
+                await journal.mark(checkpoint, offset - 1)
+        if offset != end + 1:
+            raise ConnectionError(f"Segment {start}-{end} ended early at {offset}")
+
+
+async def _fetch_segment(session, url, fd, start, end, journal, counter, progress):
+    """
+    Fetch ``start``-``end``, retrying what is missing after a transient error.
+
+    A dropped connection or a timeout only refetches the part of the segment
+    the journal does not have yet, up to ``Config.SEGMENT_RETRIES`` times
+    with exponential backoff. ``RangeNotHonoured`` is not retried.
+    """
+    attempt = 0
+    while True:
+        missing = [
+            (max(first, start), min(last, end))
+            for first, last in journal.missing()
+            if first <= end and last >= start
+        ]
+        try:
+            for first, last in missing:
+                await _fetch_range(
+                    session, url, fd, first, last, journal, counter, progress
+                )
+            return
+        except (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            attempt += 1
+            if attempt > Config.SEGMENT_RETRIES:
+                raise
+            logger.info("Retrying segment %s-%s: %s", start, end, e)
+            await asyncio.sleep(min(2**attempt, MAX_RETRY_DELAY))
+
+
+async def download_segmented(
+    session, url, file_name, total_length, validators, progress, segments=None
+):
+    """
+    Download a file over several parallel range requests into a preallocated file.
+
+    Completed ranges are journaled next to the file: a segment that breaks
+    off is retried from where it stopped, and a download interrupted by a
+    restart only refetches the missing ranges, provided the remote resource
+    still has the same validators. Disk writes, syncs and journal saves run
+    on the executor.
+
+    Parameters:
+    - session (aiohttp.ClientSession): Session used for the requests.
+    - url (str): URL of the remote file.
+    - file_name (str): Path to save the downloaded file.
+    - total_length (int): Size of the remote file in bytes.
+    - validators (dict): ``etag`` and ``last_modified`` as returned by ``probe_ranges``.
+    - progress (Callable[[int], Awaitable]): Called with the merged byte count of all segments.
+    - segments (int): Number of connections, defaults to ``Config.DOWNLOAD_SEGMENTS``.
+
+    Returns:
+    int: Number of bytes on disk.
+    """
+    journal = await asyncio.get_running_loop().run_in_executor(
+        None, DownloadJournal.open, file_name, url, total_length, validators
+    )
+    ranges = split_ranges(journal.missing(), segments or Config.DOWNLOAD_SEGMENTS)
+    logger.info("Downloading %s in %s segments", url, len(ranges))
+    counter = [journal.completed()]
+
+    fd = os.open(file_name, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, total_length)
+        tasks = [
+            asyncio.ensure_future(
+                _fetch_segment(
+                    session, url, fd, start, end, journal, counter, progress
+                )
+            )
+            for start, end in ranges
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        os.close(fd)
+
+    await asyncio.get_running_loop().run_in_executor(None, journal.discard)
+    return counter[0]
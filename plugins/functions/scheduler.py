@@ -0,0 +1,191 @@
+"""Global job scheduler with per-user fairness and concurrency caps"""
+
+import asyncio
+import itertools
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+from config import Config
+from plugins.functions.metrics import collect
+from plugins.functions.tracing import span
+from plugins.script import Translation
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+URL_REGEX = re.compile(r"https?://\S+")
+
+
+def job_host(text):
+    """
+    Return the host of the first URL in ``text``, used for per-host limits.
+
+    Parameters:
+    - text (str): Message text containing the link.
+
+    Returns:
+    str: Lower-cased host name, or an empty string.
+    """
+    match = URL_REGEX.search(text or "")
+    return (urlparse(match.group(0)).hostname or "") if match else ""
+
+
+def callback_notifier(callback_query):
+    """
+    Build a ``notify`` callback telling the user where their job is queued.
+
+    Parameters:
+    - callback_query (pyrogram.types.CallbackQuery): Query that started the job.
+
+    Returns:
+    Callable[[int], Awaitable]: Notifier for ``JobScheduler.slot``.
+    """
+
+    async def notify(position):
+        try:
+            await callback_query.answer(
+                Translation.QUEUE_POSITION.format(position), show_alert=True
+            )
+        except Exception as e:
+            logger.info("Error %s", e)
+
+    return notify
+
+
+class Job:
+    def __init__(self, job_id, user_id, host, kind):
+        self.id = job_id
+        self.user_id = user_id
+        self.host = host
+        self.kind = kind
+        self.priority = user_id in Config.AUTH_USERS
+        self.enqueued = time.time()
+        self.started = None
+        self.admitted = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """
+    Admission queue for heavy download/upload jobs.
+
+    At most ``global_limit`` jobs run at once, with at most ``per_user``
+    per user and ``per_host`` per remote host. Waiting jobs are admitted
+    in weighted-fair order: every user has a virtual clock that advances
+    by one each time one of their jobs starts, so a user with ten queued
+    jobs cannot starve a user with one. ``AUTH_USERS`` are always served
+    before everyone else.
+    """
+
+    def __init__(self, global_limit, per_user, per_host):
+        self.global_limit = global_limit
+        self.per_user = per_user
+        self.per_host = per_host
+        self._ids = itertools.count(1)
+        self._waiting = []
+        self._running = {}
+        self._virtual_time = {}
+        self._clock = 0
+
+    def _count(self, attribute, value):
+        return sum(1 for job in self._running.values() if getattr(job, attribute) == value)
+
+    def _eligible(self, job):
+        return (
+            self._count("user_id", job.user_id) < self.per_user
+            and (not job.host or self._count("host", job.host) < self.per_host)
+        )
+
+    def _order(self, job):
+        return (
+            not job.priority,
+            max(self._virtual_time.get(job.user_id, 0), self._clock),
+            job.enqueued,
+        )
+
+    def _dispatch(self):
+        while len(self._running) < self.global_limit:
+            candidates = [job for job in self._waiting if self._eligible(job)]
+            if not candidates:
+                return
+            job = min(candidates, key=self._order)
+            self._waiting.remove(job)
+            start = max(self._virtual_time.get(job.user_id, 0), self._clock)
+            self._clock = start
+            self._virtual_time[job.user_id] = start + 1
+            job.started = time.time()
+            self._running[job.id] = job
+            job.admitted.set_result(True)
+
+    def position(self, job):
+        """Return the 1-based position of a waiting job in dispatch order."""
+        ordered = sorted(self._waiting, key=self._order)
+        return ordered.index(job) + 1 if job in ordered else 0
+
+    @asynccontextmanager
+    async def slot(self, user_id, host="", kind="job", notify=None):
+        """
+        Wait for a free slot, run the body, then release it.
+
+        Parameters:
+        - user_id (int): Telegram id of the requesting user.
+        - host (str): Host of the link, see ``job_host``.
+        - kind (str): Short label shown in /queue.
+        - notify (Callable[[int], Awaitable]): Called with the queue position when the job has to wait.
+
+        Yields:
+        Job: The admitted job.
+        """
+        job = Job(next(self._ids), user_id, host, kind)
+        self._waiting.append(job)
+        self._dispatch()
+        try:
+            if not job.admitted.done():
+                logger.info("Job %s of %s queued at %s", job.id, user_id, self.position(job))
+                with span("queue"):
+                    if notify is not None:
+                        await notify(self.position(job))
+                    await job.admitted
+        except BaseException:
+            if job in self._waiting:
+                self._waiting.remove(job)
+            self._release(job)
+            raise
+
+        try:
+            yield job
+        finally:
+            self._release(job)
+
+    def _release(self, job):
+        if self._running.pop(job.id, None) is not None:
+            self._dispatch()
+
+    def snapshot(self):
+        """
+        Describe the running and waiting jobs.
+
+        Returns:
+        Tuple[List[Job], List[Job]]: Running jobs and waiting jobs in dispatch order.
+        """
+        return list(self._running.values()), sorted(self._waiting, key=self._order)
+
+
+scheduler = JobScheduler(
+    Config.MAX_CONCURRENT_JOBS, Config.MAX_JOBS_PER_USER, Config.MAX_JOBS_PER_HOST
+)
+
+collect(
+    "aup_running_jobs",
+    "Jobs holding a scheduler slot.",
+    lambda: len(scheduler.snapshot()[0]),
+)
+collect(
+    "aup_queued_jobs",
+    "Jobs waiting for a scheduler slot.",
+    lambda: len(scheduler.snapshot()[1]),
+)
@@ -0,0 +1,101 @@
+"""Single-flight coalescing of identical concurrent downloads"""
+
+import asyncio
+import logging
+import os
+import shutil
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    One download shared by every job that asked for the same thing.
+
+    The leader resolves the flight with its result; subscribers wait for
+    it and may follow the leader's progress events in the meantime. Temp
+    paths registered with ``cleanup`` are removed when the last participant
+    releases the flight.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.refs = 0
+        self.result = asyncio.get_running_loop().create_future()
+        self.subscribers = []
+        self.paths = []
+
+    def cleanup(self, path):
+        self.paths.append(path)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    async def publish(self, event):
+        """Forward a progress event of the leader to every subscriber."""
+        for callback in list(self.subscribers):
+            try:
+                await callback(event)
+            except Exception as e:
+                logger.info("Error %s", e)
+
+    def resolve(self, result):
+        if not self.result.done():
+            self.result.set_result(result)
+
+    def fail(self, error):
+        if not self.result.done():
+            self.result.set_exception(error)
+            # followers may all be gone; do not warn about an unread exception
+            self.result.exception()
+
+    async def wait(self):
+        return await asyncio.shield(self.result)
+
+
+class SingleFlight:
+    """Registry of the flights in progress, keyed by request."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def acquire(self, key):
+        """
+        Join the flight for ``key``, creating it when there is none.
+
+        Parameters:
+        - key (Hashable): Identity of the download.
+
+        Returns:
+        Tuple[Flight, bool]: The flight and whether the caller is its leader.
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = Flight(key)
+        flight.refs += 1
+        if not leader:
+            logger.info("Coalesced into running download %s", key)
+        return flight, leader
+
+    def release(self, flight, leader=False):
+        """Leave ``flight``; the last participant removes its temp paths."""
+        flight.refs -= 1
+        if leader and not flight.result.done():
+            # the leader left without a result, wake up the followers
+            flight.fail(RuntimeError("The shared download was aborted"))
+        if flight.refs > 0:
+            return
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        for path in flight.paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+
+downloads_in_flight = SingleFlight()
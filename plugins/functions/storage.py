@@ -0,0 +1,272 @@
+"""Disk space reservations and cleanup of the download directory"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+from config import Config
+from plugins.functions.jobs import current_job, job_registry
+from plugins.functions.metrics import collect
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of the free disk space while a job waits
+RECHECK_INTERVAL = 30
+
+
+class StorageFull(Exception):
+    """The download can never fit in the configured storage."""
+
+
+def _disk_usage(path):
+    """
+    Bytes ``path`` occupies on disk.
+
+    Segmented downloads ``ftruncate`` their file to the final size up front,
+    so the apparent size says nothing about how much was written; the
+    allocated blocks do. Platforms without ``st_blocks`` fall back to the
+    apparent size.
+    """
+    st = os.stat(path)
+    blocks = getattr(st, "st_blocks", None)
+    if blocks is None:
+        return st.st_size
+    return blocks * 512
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return _disk_usage(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += _disk_usage(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def _tree_mtime(path):
+    newest = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+                except OSError:
+                    pass
+    return newest
+
+
+def _is_thumbnail(name):
+    # custom thumbnails are saved as DOWNLOADS/<user id>.jpg and kept forever
+    stem, ext = os.path.splitext(name)
+    return ext == ".jpg" and stem.isdigit()
+
+
+class Reservation:
+    """Bytes set aside for one job and the temp paths it writes them to."""
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.paths = []
+
+    def track(self, path):
+        self.paths.append(os.path.abspath(path))
+
+    def pending(self):
+        """Reserved bytes not written to disk yet."""
+        used = sum(_tree_size(path) for path in self.paths if os.path.exists(path))
+        return max(self.nbytes - used, 0)
+
+
+class StorageManager:
+    """
+    Admission control on the disk space of ``Config.DOWNLOAD_LOCATION``.
+
+    A job reserves the size it expects to download before it starts. The
+    reservation is granted while the reserved total stays within ``quota``
+    (0 means no quota) and the bytes not written yet still fit on the disk
+    above ``min_free``; otherwise the job waits until another one releases
+    its reservation. Reservations made inside a job are released when the
+    job ends.
+
+    Measuring what the running jobs wrote walks their temp paths, so it
+    runs on the executor; reservations are granted one at a time so two
+    jobs never count the same free space.
+
+    A janitor removes what jobs left behind: every entry of the download
+    directory untouched for ``max_age`` seconds that no running job uses,
+    except the custom thumbnails.
+    """
+
+    def __init__(self, root, quota, min_free, max_age, interval):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        self.max_age = max_age
+        self.interval = interval
+        self._reservations = set()
+        self._waiters = []
+        self._janitor = None
+        # created on first use: before Python 3.10 a lock binds the loop current at creation
+        self._admission = None
+
+    def reserved(self):
+        return sum(reservation.nbytes for reservation in self._reservations)
+
+    def _unreserved_space(self, reservations):
+        free = shutil.disk_usage(self.root).free - self.min_free
+        return free - sum(reservation.pending() for reservation in reservations)
+
+    async def _fits(self, nbytes):
+        if self.quota and self.reserved() + nbytes > self.quota:
+            return False
+        space = await asyncio.get_running_loop().run_in_executor(
+            None, self._unreserved_space, list(self._reservations)
+        )
+        return nbytes <= space
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def reserve(self, nbytes, path=None, notify=None):
+        """
+        Wait until ``nbytes`` can be stored, then reserve them.
+
+        Parameters:
+        - nbytes (int): Expected size, 0 when unknown.
+        - path (str): Temp path the job writes to.
+        - notify (Callable[[], Awaitable]): Called once if the job has to wait.
+
+        Returns:
+        Reservation: The granted reservation.
+        """
+        self.start_janitor()
+        nbytes = nbytes or Config.UNKNOWN_SIZE_RESERVATION
+        if self.quota and nbytes > self.quota:
+            raise StorageFull(f"{nbytes} bytes exceed the storage quota")
+        os.makedirs(self.root, exist_ok=True)
+
+        if self._admission is None:
+            self._admission = asyncio.Lock()
+        notified = False
+        waiter = None
+        try:
+            while True:
+                # registered before the check, so a release while the disk
+                # is measured still wakes this job up
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                async with self._admission:
+                    if await self._fits(nbytes):
+                        reservation = Reservation(nbytes)
+                        self._reservations.add(reservation)
+                        break
+                    if not self._reservations:
+                        raise StorageFull(f"Not enough disk space for {nbytes} bytes")
+                if notify is not None and not notified:
+                    notified = True
+                    try:
+                        await notify()
+                    except Exception as e:
+                        logger.info("Error %s", e)
+                try:
+                    await asyncio.wait_for(waiter, RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        if path is not None:
+            reservation.track(path)
+        job = current_job()
+        if job is not None:
+            job.add_finalizer(lambda: self.release(reservation))
+        return reservation
+
+    def release(self, reservation):
+        if reservation in self._reservations:
+            self._reservations.discard(reservation)
+            self._wake()
+
+    def _active_paths(self):
+        paths = [path for r in self._reservations for path in r.paths]
+        for job in job_registry.jobs():
+            paths.extend(os.path.abspath(path) for path in job.paths)
+        return paths
+
+    def sweep(self, active=()):
+        """
+        Remove stale entries of the download directory.
+
+        Parameters:
+        - active (Iterable[str]): Absolute paths of running jobs, kept.
+
+        Returns:
+        int: Number of bytes reclaimed.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        deadline = time.time() - self.max_age
+        reclaimed = 0
+        for entry in os.scandir(self.root):
+            path = os.path.abspath(entry.path)
+            if _is_thumbnail(entry.name) or any(
+                p == path or p.startswith(path + os.sep) for p in active
+            ):
+                continue
+            try:
+                if _tree_mtime(path) > deadline:
+                    continue
+                size = _tree_size(path)
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logger.info("Error %s", e)
+                continue
+            reclaimed += size
+            logger.info("Janitor removed %s", path)
+        return reclaimed
+
+    async def _run_janitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.sweep, self._active_paths())
+            except Exception as e:
+                logger.info("Error %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start_janitor(self):
+        """Start the periodic janitor, the first sweep runs right away."""
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.ensure_future(self._run_janitor())
+
+
+storage = StorageManager(
+    Config.DOWNLOAD_LOCATION,
+    Config.STORAGE_QUOTA,
+    Config.MIN_FREE_SPACE,
+    Config.TEMP_MAX_AGE,
+    Config.JANITOR_INTERVAL,
+)
+
+collect(
+    "aup_disk_free_bytes",
+    "Free space of the download directory.",
+    lambda: shutil.disk_usage(storage.root).free,
+)
+collect("aup_disk_reserved_bytes", "Bytes reserved by running jobs.", storage.reserved)
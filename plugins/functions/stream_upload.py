@@ -0,0 +1,418 @@
+"""Part-level Telegram uploads: stream-through pipeline and parallel uploader"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import mimetypes
+import os
+
+from pyrogram import raw, types
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+from config import Config
+from plugins.functions.media_info import probe_media
+from plugins.functions.metrics import flood_wait_seconds, flood_waits
+from plugins.functions.tracing import span
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Telegram upload part size, every part except the last must be exactly this long
+PART_SIZE = 512 * 1024
+# Files above this size must be uploaded with saveBigFilePart
+BIG_FILE_SIZE = 10 * 1024 * 1024
+# Longest pause between two attempts of a failed part
+MAX_RETRY_DELAY = 30
+
+# Media sessions opened for parallel uploads, per client
+_media_sessions = {}
+# Created on first use: before Python 3.10 a lock binds the loop current at creation
+_media_sessions_lock = None
+
+
+async def _produce_parts(response, queue, file_name):
+    """
+    Cut the response body into parts for ``_consume_parts``.
+
+    ``None`` is queued after the last part. A producer that fails or is
+    cancelled queues nothing more: the consumer may be gone and the queue
+    full, and ``_next_part`` reports the failure instead.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = bytearray()
+    index = 0
+    f_handle = None
+    if file_name:
+        f_handle = await loop.run_in_executor(None, open, file_name, "wb")
+    try:
+        async for chunk in response.content.iter_chunked(PART_SIZE):
+            if f_handle:
+                await loop.run_in_executor(None, f_handle.write, chunk)
+            buffer += chunk
+            while len(buffer) >= PART_SIZE:
+                await queue.put((index, bytes(buffer[:PART_SIZE])))
+                del buffer[:PART_SIZE]
+                index += 1
+        if buffer:
+            await queue.put((index, bytes(buffer)))
+        await queue.put(None)
+    finally:
+        if f_handle:
+            await asyncio.shield(loop.run_in_executor(None, f_handle.close))
+
+
+async def _next_part(queue, producer):
+    """Return the next queued part, or raise the error that stopped ``producer``."""
+    if not queue.empty():
+        return queue.get_nowait()
+    getter = asyncio.ensure_future(queue.get())
+    try:
+        await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not getter.done():
+            getter.cancel()
+    if getter.done() and not getter.cancelled():
+        return getter.result()
+    # the producer ended without queueing the end of the body
+    return producer.result()
+
+
+async def _save_part(invoke, rpc, index, total_parts):
+    """
+    Send one part, waiting out FloodWaits and retrying other failures.
+
+    A part failing more than ``Config.UPLOAD_PART_RETRIES`` times raises
+    ``ConnectionError``.
+    """
+    attempt = 0
+    while True:
+        try:
+            if await invoke(rpc):
+                return
+            error = ConnectionError(f"Telegram refused part {index} of {total_parts}")
+        except FloodWait as e:
+            method = (
+                "save_big_file_part"
+                if isinstance(rpc, raw.functions.upload.SaveBigFilePart)
+                else "save_file_part"
+            )
+            flood_waits.inc(method=method)
+            flood_wait_seconds.inc(e.value, method=method)
+            await asyncio.sleep(e.value)
+            continue
+        except Exception as e:
+            error = e
+        attempt += 1
+        if attempt > Config.UPLOAD_PART_RETRIES:
+            raise ConnectionError(
+                f"Part {index} of {total_parts} failed {attempt} times"
+            ) from error
+        logger.info("Retrying part %s of %s: %s", index, total_parts, error)
+        await asyncio.sleep(min(2**attempt, MAX_RETRY_DELAY))
+
+
+async def _consume_parts(
+    client, queue, producer, file_id, total_length, progress, progress_args
+):
+    is_big = total_length > BIG_FILE_SIZE
+    total_parts = math.ceil(total_length / PART_SIZE)
+    md5_sum = None if is_big else hashlib.md5()
+    uploaded = 0
+
+    while True:
+        item = await _next_part(queue, producer)
+        if item is None:
+            break
+        index, chunk = item
+        if is_big:
+            rpc = raw.functions.upload.SaveBigFilePart(
+                file_id=file_id,
+                file_part=index,
+                file_total_parts=total_parts,
+                bytes=chunk,
+            )
+        else:
+            rpc = raw.functions.upload.SaveFilePart(
+                file_id=file_id, file_part=index, bytes=chunk
+            )
+            md5_sum.update(chunk)
+        await _save_part(client.invoke, rpc, index, total_parts)
+        uploaded += len(chunk)
+        if progress:
+            await progress(uploaded, total_length, *progress_args)
+
+    if uploaded != total_length:
+        raise ConnectionError(f"Stream ended after {uploaded} of {total_length} bytes")
+    return total_parts, md5_sum.hexdigest() if md5_sum else None
+
+
+async def stream_upload(
+    client, response, name, total_length, file_name=None, progress=None, progress_args=()
+):
+    """
+    Upload an HTTP response body to Telegram part by part while it downloads.
+
+    A bounded queue of ``Config.STREAM_UPLOAD_BUFFER`` parts sits between the
+    HTTP reader and the uploader, so memory use stays constant and a slow
+    uplink throttles the download instead of buffering the whole file.
+
+    Parameters:
+    - client (pyrogram.Client): Client used to upload the parts.
+    - response (aiohttp.ClientResponse): Response of the direct link.
+    - name (str): File name shown in Telegram.
+    - total_length (int): Size of the body in bytes (Content-Length).
+    - file_name (str): Optional path to also write the body to; nothing is stored when omitted.
+    - progress (Callable): Optional ``progress_for_pyrogram`` style callback.
+    - progress_args (tuple): Extra arguments passed to ``progress``.
+
+    Returns:
+    raw.base.InputFile: Uploaded file, ready to be attached to a message.
+    """
+    file_id = client.rnd_id()
+    queue = asyncio.Queue(maxsize=Config.STREAM_UPLOAD_BUFFER)
+    producer = asyncio.ensure_future(_produce_parts(response, queue, file_name))
+    try:
+        total_parts, md5_sum = await _consume_parts(
+            client, queue, producer, file_id, total_length, progress, progress_args
+        )
+    finally:
+        # a producer blocked on the full queue is cancelled there
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    if total_length > BIG_FILE_SIZE:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=name)
+    return raw.types.InputFile(
+        id=file_id, parts=total_parts, name=name, md5_checksum=md5_sum
+    )
+
+
+async def send_streamed_document(
+    client, chat_id, input_file, name, caption="", thumb=None, reply_to_message_id=None
+):
+    """
+    Send a document uploaded with ``stream_upload``.
+
+    Parameters:
+    - client (pyrogram.Client): Client used to send the message.
+    - chat_id (int): Target chat.
+    - input_file (raw.base.InputFile): File returned by ``stream_upload``.
+    - name (str): File name of the document.
+    - caption (str): Caption of the message.
+    - thumb (str): Optional path of a thumbnail.
+    - reply_to_message_id (int): Message to reply to.
+
+    Returns:
+    pyrogram.types.Message: The sent message.
+    """
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        file=input_file,
+        thumb=await client.save_file(thumb) if thumb and os.path.isfile(thumb) else None,
+        attributes=[raw.types.DocumentAttributeFilename(file_name=name)],
+    )
+    return await _send_media(client, chat_id, media, caption, reply_to_message_id)
+
+
+async def _send_media(client, chat_id, media, caption, reply_to_message_id):
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=media,
+            message=caption or "",
+            random_id=client.rnd_id(),
+            reply_to_msg_id=reply_to_message_id,
+        )
+    )
+    for update in r.updates:
+        if isinstance(
+            update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)
+        ):
+            return await types.Message._parse(
+                client,
+                update.message,
+                {u.id: u for u in r.users},
+                {c.id: c for c in r.chats},
+            )
+    return None
+
+
+def parallel_upload_enabled(file_size):
+    """Return whether a file of ``file_size`` bytes goes through ``parallel_upload``."""
+    return Config.UPLOAD_WORKERS > 1 and file_size > BIG_FILE_SIZE
+
+
+async def media_sessions(client, count):
+    """
+    Return ``count`` started media sessions of ``client``, opening missing ones.
+
+    Sessions stay open and are reused by the next uploads of the client.
+    """
+    global _media_sessions_lock
+    if _media_sessions_lock is None:
+        _media_sessions_lock = asyncio.Lock()
+    async with _media_sessions_lock:
+        sessions = _media_sessions.setdefault(client, [])
+        while len(sessions) < count:
+            session = Session(
+                client,
+                await client.storage.dc_id(),
+                await client.storage.auth_key(),
+                await client.storage.test_mode(),
+                is_media=True,
+            )
+            await session.start()
+            sessions.append(session)
+        return sessions[:count]
+
+
+async def close_media_sessions():
+    """Stop the media sessions opened by ``media_sessions``."""
+    for sessions in _media_sessions.values():
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception as e:
+                logger.info("Error %s", e)
+    _media_sessions.clear()
+
+
+def _read_part(path, index):
+    with open(path, "rb") as f_handle:
+        return os.pread(f_handle.fileno(), PART_SIZE, index * PART_SIZE)
+
+
+async def _upload_part(session, path, file_id, index, total_parts):
+    chunk = await asyncio.get_running_loop().run_in_executor(
+        None, _read_part, path, index
+    )
+    rpc = raw.functions.upload.SaveBigFilePart(
+        file_id=file_id, file_part=index, file_total_parts=total_parts, bytes=chunk
+    )
+    await _save_part(session.invoke, rpc, index, total_parts)
+    return len(chunk)
+
+
+async def parallel_upload(client, path, name=None, progress=None, progress_args=()):
+    """
+    Upload a big local file with several parts in flight at once.
+
+    ``Config.UPLOAD_WORKERS`` workers each own a media session, so parts
+    travel over separate connections; a failed part is retried on its own
+    up to ``Config.UPLOAD_PART_RETRIES`` times with exponential backoff.
+
+    Parameters:
+    - client (pyrogram.Client): Client the file is uploaded for.
+    - path (str): Path of a file larger than ``BIG_FILE_SIZE``.
+    - name (str): File name shown in Telegram, the base name of ``path`` by default.
+    - progress (Callable): Optional ``progress_for_pyrogram`` style callback.
+    - progress_args (tuple): Extra arguments passed to ``progress``.
+
+    Returns:
+    raw.types.InputFileBig: Uploaded file, ready to be attached to a message.
+    """
+    size = os.path.getsize(path)
+    total_parts = math.ceil(size / PART_SIZE)
+    file_id = client.rnd_id()
+    parts = asyncio.Queue()
+    for index in range(total_parts):
+        parts.put_nowait(index)
+    uploaded = 0
+
+    async def worker(session):
+        nonlocal uploaded
+        while not parts.empty():
+            index = parts.get_nowait()
+            uploaded += await _upload_part(session, path, file_id, index, total_parts)
+            if progress:
+                await progress(uploaded, size, *progress_args)
+
+    sessions = await media_sessions(client, Config.UPLOAD_WORKERS)
+    workers = [asyncio.ensure_future(worker(session)) for session in sessions]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+    return raw.types.InputFileBig(
+        id=file_id, parts=total_parts, name=name or os.path.basename(path)
+    )
+
+
+async def send_parallel_media(
+    client,
+    chat_id,
+    path,
+    send_type,
+    caption="",
+    thumb=None,
+    reply_to_message_id=None,
+    progress=None,
+    progress_args=(),
+):
+    """
+    Upload ``path`` with ``parallel_upload`` and send it like the send_* methods would.
+
+    Parameters:
+    - client (pyrogram.Client): Client sending the media.
+    - chat_id (int): Target chat.
+    - path (str): The local file.
+    - send_type (str): "video", "audio", "vm" (video note) or anything else for a document.
+    - caption (str): Caption of the message, ignored for video notes.
+    - thumb (str): Optional path of a thumbnail.
+    - reply_to_message_id (int): Message to reply to.
+    - progress (Callable): Optional ``progress_for_pyrogram`` style callback.
+    - progress_args (tuple): Extra arguments passed to ``progress``.
+
+    Returns:
+    pyrogram.types.Message: The sent message.
+    """
+    name = os.path.basename(path)
+    attributes = [raw.types.DocumentAttributeFilename(file_name=name)]
+    mime_type = mimetypes.guess_type(name)[0]
+    if send_type in ("video", "audio", "vm"):
+        with span("metadata"):
+            info = await probe_media(path)
+    if send_type == "video":
+        mime_type = mime_type or "video/mp4"
+        attributes.append(
+            raw.types.DocumentAttributeVideo(
+                duration=info["duration"],
+                w=info["width"],
+                h=info["height"],
+                supports_streaming=True,
+            )
+        )
+    elif send_type == "audio":
+        mime_type = mime_type or "audio/mpeg"
+        attributes.append(raw.types.DocumentAttributeAudio(duration=info["duration"]))
+    elif send_type == "vm":
+        mime_type = mime_type or "video/mp4"
+        caption = ""
+        attributes = [
+            raw.types.DocumentAttributeVideo(
+                duration=info["duration"],
+                w=info["width"],
+                h=info["width"],
+                round_message=True,
+            )
+        ]
+
+    input_file = await parallel_upload(
+        client, path, name, progress=progress, progress_args=progress_args
+    )
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mime_type or "application/octet-stream",
+        file=input_file,
+        thumb=await client.save_file(thumb) if thumb and os.path.isfile(thumb) else None,
+        attributes=attributes,
+        force_file=send_type not in ("video", "audio", "vm") or None,
+    )
+    return await _send_media(client, chat_id, media, caption, reply_to_message_id)
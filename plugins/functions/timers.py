@@ -0,0 +1,107 @@
+"""Timer wheel for deferred replies and cooldowns that never block the event loop"""
+
+import asyncio
+import logging
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel driving delayed callbacks from a single task.
+
+    Timers land in one of ``slots`` buckets ``tick`` seconds apart; the
+    driver only looks at the current bucket on each tick, so scheduling and
+    cancelling are O(1) however many timers are pending. At most
+    ``max_pending`` timers are kept: beyond that new timers are refused,
+    never run early, since an early cooldown expiry would lift a rate
+    limit. Scheduling a timer with a key that is already pending replaces
+    the old timer.
+    """
+
+    def __init__(self, tick=0.5, slots=512, max_pending=10000):
+        self.tick = tick
+        self.max_pending = max_pending
+        self._slots = [{} for _ in range(slots)]
+        self._index = {}
+        self._cursor = 0
+        self._counter = 0
+        self._driver = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._index)
+
+    def schedule(self, delay, callback, *args, key=None, **kwargs):
+        """
+        Run ``callback(*args, **kwargs)`` after ``delay`` seconds.
+
+        Parameters:
+        - delay (float): Seconds to wait.
+        - callback (Callable): Plain function or coroutine function.
+        - key (Hashable): Optional name to cancel or replace the timer later.
+
+        Returns:
+        Hashable: The key of the timer, or None when the wheel is full.
+        """
+        if key is None:
+            self._counter += 1
+            key = ("timer", self._counter)
+        self.cancel(key)
+
+        if len(self._index) >= self.max_pending:
+            logger.warning("Timer wheel full, dropping %s", key)
+            return None
+
+        ticks = max(1, round(delay / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        rounds = (ticks - 1) // len(self._slots)
+        self._slots[slot][key] = [rounds, callback, args, kwargs]
+        self._index[key] = slot
+
+        if self._driver is None or self._driver.done():
+            self._driver = asyncio.ensure_future(self._run())
+        return key
+
+    def cancel(self, key):
+        """Cancel the pending timer named ``key``; returns whether one was pending."""
+        slot = self._index.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def _fire(self, callback, args, kwargs):
+        try:
+            result = callback(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                # keep a reference until the coroutine is done, and log its errors
+                task = asyncio.ensure_future(result)
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+        except Exception as e:
+            logger.info("Error %s", e)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.info("Error %s", task.exception())
+
+    async def _run(self):
+        while self._index:
+            await asyncio.sleep(self.tick)
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            bucket = self._slots[self._cursor]
+            for key, entry in list(bucket.items()):
+                if entry[0] > 0:
+                    entry[0] -= 1
+                    continue
+                del bucket[key]
+                del self._index[key]
+                self._fire(entry[1], entry[2], entry[3])
+
+
+timers = TimerWheel()
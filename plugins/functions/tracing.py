@@ -0,0 +1,167 @@
+"""Per-job phase spans written as JSON lines, with percentile summaries"""
+
+import json
+import logging
+import logging.handlers
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import Config
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Order in which /stats lists the phases
+PHASES = ("probe", "queue", "download", "metadata", "thumbnail", "upload", "cleanup")
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """The spans recorded for one job, on the monotonic clock."""
+
+    def __init__(self, job_id, kind, user_id):
+        self.job_id = job_id
+        self.kind = kind
+        self.user_id = user_id
+        self.wall_start = time.time()
+        self.start = time.monotonic()
+        self.duration = None
+        self.spans = []
+
+    def add(self, phase, start, end):
+        self.spans.append((phase, start - self.start, end - start))
+
+    def phase_totals(self):
+        totals = {}
+        for phase, _, duration in self.spans:
+            totals[phase] = totals.get(phase, 0.0) + duration
+        return totals
+
+    def record(self, outcome):
+        if self.duration is None:
+            self.duration = time.monotonic() - self.start
+        return {
+            "job": self.job_id,
+            "kind": self.kind,
+            "user_id": self.user_id,
+            "outcome": outcome,
+            "started": round(self.wall_start, 3),
+            "total": round(self.duration, 6),
+            "spans": [
+                {
+                    "phase": phase,
+                    "offset": round(offset, 6),
+                    "duration": round(duration, 6),
+                }
+                for phase, offset, duration in self.spans
+            ],
+        }
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+class Tracer:
+    """
+    Collect the traces of jobs.
+
+    A finished trace is appended as one JSON line to ``path``, rotated at
+    ``max_bytes`` with ``backups`` old files kept, and the last ``history``
+    traces stay in memory for ``summary``. An empty ``path`` disables the
+    file but keeps the summary.
+    """
+
+    def __init__(self, path, max_bytes, backups, history):
+        self._recent = deque(maxlen=history)
+        self._file = None
+        if path:
+            self._file = logging.getLogger("aup.traces")
+            self._file.propagate = False
+            self._file.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding="utf8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file.addHandler(handler)
+
+    def begin(self, job_id, kind, user_id):
+        """
+        Start the trace of a job in the current context.
+
+        Returns:
+        contextvars.Token: Token for ``end``.
+        """
+        return _current_trace.set(Trace(job_id, kind, user_id))
+
+    def end(self, token, outcome):
+        trace = _current_trace.get()
+        _current_trace.reset(token)
+        if trace is None:
+            return
+        record = trace.record(outcome)
+        self._recent.append(trace)
+        if self._file is not None:
+            try:
+                self._file.info(json.dumps(record))
+            except Exception as e:
+                logger.info("Error %s", e)
+
+    def summary(self):
+        """
+        Summarize the durations of the recent jobs.
+
+        Returns:
+        Dict[str, Tuple[int, float, float, float]]: For each phase seen and
+        for ``total``, the number of jobs and the p50, p95 and p99 in seconds.
+        """
+        durations = {}
+        for trace in list(self._recent):
+            for phase, duration in trace.phase_totals().items():
+                durations.setdefault(phase, []).append(duration)
+            durations.setdefault("total", []).append(trace.duration)
+        order = [phase for phase in PHASES if phase in durations]
+        order += sorted(set(durations) - set(PHASES) - {"total"})
+        summary = {}
+        for phase in order + ["total"]:
+            values = sorted(durations.get(phase, []))
+            if values:
+                summary[phase] = (
+                    len(values),
+                    percentile(values, 0.50),
+                    percentile(values, 0.95),
+                    percentile(values, 0.99),
+                )
+        return summary
+
+
+def record_span(phase, start):
+    """Record a ``phase`` span of the current job from ``start`` until now."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(phase, start, time.monotonic())
+
+
+@contextmanager
+def span(phase):
+    """Record the body as a ``phase`` span of the current job, if any."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_span(phase, start)
+
+
+tracer = Tracer(
+    Config.TRACE_FILE, Config.TRACE_MAX_BYTES, Config.TRACE_BACKUPS, Config.TRACE_HISTORY
+)
@@ -0,0 +1,139 @@
+"""Helper bot accounts sharing the uploads of the main bot"""
+
+import itertools
+import logging
+from contextlib import asynccontextmanager
+
+from pyrogram import Client
+
+from config import Config
+from plugins.functions.metrics import collect
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class UploadFarm:
+    """
+    Upload workers running on helper bot tokens.
+
+    Every helper is a separate bot account, with its own rate limits and
+    connections. An upload goes to the helper with the fewest uploads in
+    flight, the one idle the longest on a tie. Helpers cannot message the
+    users, so they send the media to ``dump_chat``, a channel all the bots
+    are admins of, and the main bot copies that message to the user: the
+    user gets a message of the main bot, whose file_id the main bot can
+    send again.
+
+    Without helpers or without ``dump_chat`` every upload stays on the
+    main bot.
+    """
+
+    def __init__(self, tokens, dump_chat):
+        self.tokens = tokens
+        self.dump_chat = dump_chat
+        self.clients = []
+        self._load = {}
+        self._last_used = {}
+        self._ticks = itertools.count()
+
+    @property
+    def enabled(self):
+        return bool(self.clients and self.dump_chat)
+
+    async def start(self):
+        """Start the helper clients; a helper that fails to start is skipped."""
+        if self.tokens and not self.dump_chat:
+            logger.warning("UPLOAD_DUMP_CHAT is not set, helper bots are not used")
+            return
+        for index, token in enumerate(self.tokens, 1):
+            client = Client(
+                f"upload-helper-{index}",
+                api_id=Config.API_ID,
+                api_hash=Config.API_HASH,
+                bot_token=token,
+                in_memory=True,
+                no_updates=True,
+            )
+            try:
+                await client.start()
+            except Exception as e:
+                logger.error("Helper bot %s failed to start: %s", index, e)
+                continue
+            self.clients.append(client)
+            self._load[client] = 0
+            self._last_used[client] = next(self._ticks)
+        if self.clients:
+            logger.info("%s helper bots share the uploads", len(self.clients))
+
+    async def stop(self):
+        for client in self.clients:
+            try:
+                await client.stop()
+            except Exception as e:
+                logger.info("Error %s", e)
+        self.clients.clear()
+        self._load.clear()
+        self._last_used.clear()
+
+    def in_flight(self):
+        return sum(self._load.values())
+
+    @asynccontextmanager
+    async def uploader(self, bot, chat_id, reply_to_message_id=None):
+        """
+        Lease the client an upload should be sent with.
+
+        Parameters:
+        - bot (pyrogram.Client): The main bot, used when the farm is disabled.
+        - chat_id (int): Chat the user expects the media in.
+        - reply_to_message_id (int): Message the media should reply to.
+
+        Yields:
+        Tuple[pyrogram.Client, int, int]: The client, the chat to send to and
+        the message to reply to there; pass the sent message to ``deliver``.
+        """
+        if not self.enabled:
+            yield bot, chat_id, reply_to_message_id
+            return
+        client = min(self.clients, key=lambda c: (self._load[c], self._last_used[c]))
+        self._load[client] += 1
+        self._last_used[client] = next(self._ticks)
+        try:
+            yield client, self.dump_chat, None
+        finally:
+            self._load[client] -= 1
+
+    async def deliver(self, bot, message, chat_id, reply_to_message_id=None):
+        """
+        Bring a message sent through ``uploader`` to the user.
+
+        Parameters:
+        - bot (pyrogram.Client): The main bot.
+        - message (pyrogram.types.Message): Message returned by the send method.
+        - chat_id (int): Chat the user expects the media in.
+        - reply_to_message_id (int): Message the media should reply to.
+
+        Returns:
+        pyrogram.types.Message: The message of the main bot in ``chat_id``.
+        """
+        if message is None or message.chat.id != self.dump_chat:
+            return message
+        return await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=self.dump_chat,
+            message_id=message.id,
+            reply_to_message_id=reply_to_message_id,
+        )
+
+
+upload_farm = UploadFarm(Config.HELPER_BOT_TOKENS, Config.UPLOAD_DUMP_CHAT)
+
+collect(
+    "aup_upload_helpers",
+    "Helper bots sharing the uploads.",
+    lambda: len(upload_farm.clients),
+)
+collect("aup_helper_uploads", "Uploads running on helper bots.", upload_farm.in_flight)
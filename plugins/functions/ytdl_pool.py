@@ -0,0 +1,240 @@
+"""Pool of long-lived worker processes running yt-dlp in-process"""
+
+import asyncio
+import gc
+import logging
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import Config
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Fields of a yt-dlp progress hook forwarded to the bot
+PROGRESS_FIELDS = (
+    "status",
+    "downloaded_bytes",
+    "total_bytes",
+    "total_bytes_estimate",
+    "speed",
+    "eta",
+    "fragment_index",
+    "fragment_count",
+    "filename",
+)
+
+# Worker process state, only set inside pool processes
+_YoutubeDL = None
+_DownloadCancelled = None
+_progress_queue = None
+_cancelled = None
+_probe_instances = {}
+
+
+class YtdlError(Exception):
+    """Raised when yt-dlp fails inside a worker; carries yt-dlp's message."""
+
+
+def _init_worker(progress_queue, cancelled):
+    global _YoutubeDL, _DownloadCancelled, _progress_queue, _cancelled
+    # pay for the extractor import once per worker instead of once per request
+    # pylint: disable=import-outside-toplevel
+    from yt_dlp import YoutubeDL
+    from yt_dlp.utils import DownloadCancelled
+
+    _YoutubeDL = YoutubeDL
+    _DownloadCancelled = DownloadCancelled
+    _progress_queue = progress_queue
+    _cancelled = cancelled
+
+
+def _extract(url, options):
+    key = tuple(sorted(options.items()))
+    ydl = _probe_instances.get(key)
+    if ydl is None:
+        ydl = _probe_instances[key] = _YoutubeDL(dict(options))
+    try:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+    except Exception as e:
+        raise YtdlError(str(e)) from None
+
+
+def _download(job_id, url, options):
+    def hook(status):
+        # yt-dlp aborts the download when a progress hook raises this
+        if job_id in _cancelled:
+            raise _DownloadCancelled("cancelled by the bot")
+        _progress_queue.put(
+            (job_id, {k: status.get(k) for k in PROGRESS_FIELDS})
+        )
+
+    options = dict(options, progress_hooks=[hook])
+    try:
+        with _YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=True)
+            return ydl.sanitize_info(info)
+    except Exception as e:
+        message = str(e)
+    # the traceback keeps the aborted HTTP response alive in reference
+    # cycles: collect them so its connection is closed now, not at some
+    # later collection of an idle worker
+    gc.collect()
+    raise YtdlError(message)
+
+
+class YtdlPool:
+    """
+    Long-lived yt-dlp worker processes fed through a process pool.
+
+    Each worker imports yt-dlp once and keeps one ``YoutubeDL`` instance per
+    distinct set of probe options. Progress hooks of download jobs are sent
+    back over a multiprocessing queue and dispatched on the event loop.
+    A cancelled download is flagged in a dict shared with the workers,
+    which its progress hook checks, so the worker stops downloading. A pool
+    whose worker died is replaced on the next call.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._progress_queue = None
+        self._manager = None
+        self._cancelled = None
+        self._listeners = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            # spawn: forking a process that runs asyncio and Flask threads is unsafe
+            context = multiprocessing.get_context("spawn")
+            if self._manager is None:
+                self._manager = context.Manager()
+                self._cancelled = self._manager.dict()
+            self._progress_queue = context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue, self._cancelled),
+            )
+            threading.Thread(
+                target=self._pump_progress, args=(self._progress_queue,), daemon=True
+            ).start()
+            logger.info("Started %s yt-dlp workers", self.workers)
+
+    def _discard_broken(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            # ends the pump thread of the broken pool
+            self._progress_queue.put(None)
+
+    def _submit(self, function, *args):
+        self._ensure_started()
+        executor = self._executor
+        try:
+            return executor, executor.submit(function, *args)
+        except BrokenProcessPool as e:
+            self._discard_broken(executor)
+            raise YtdlError("yt-dlp worker process died") from e
+
+    async def _result(self, executor, future):
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            logger.warning("yt-dlp worker died, restarting the pool: %s", e)
+            self._discard_broken(executor)
+            raise YtdlError("yt-dlp worker process died") from e
+
+    def _pump_progress(self, progress_queue):
+        for job_id, event in iter(progress_queue.get, None):
+            listener = self._listeners.get(job_id)
+            if listener is None:
+                continue
+            loop, callback = listener
+            loop.call_soon_threadsafe(self._dispatch, callback, event)
+
+    def _dispatch(self, callback, event):
+        try:
+            result = callback(event)
+            if asyncio.iscoroutine(result):
+                # keep a reference until the coroutine is done, and log its errors
+                task = asyncio.ensure_future(result)
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+        except Exception as e:
+            logger.info("Error %s", e)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.info("Error %s", task.exception())
+
+    def close(self):
+        """Stop the worker processes; the pool starts again on the next call."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._progress_queue.put(None)
+                self._executor = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = self._cancelled = None
+
+    async def extract(self, url, options):
+        """
+        Probe ``url`` without downloading it.
+
+        Parameters:
+        - url (str): URL to probe.
+        - options (dict): ``YoutubeDL`` options.
+
+        Returns:
+        dict: The sanitized yt-dlp info dict.
+        """
+        return await self._result(*self._submit(_extract, url, options))
+
+    async def download(self, url, options, progress=None):
+        """
+        Download ``url`` in a worker process.
+
+        Parameters:
+        - url (str): URL to download.
+        - options (dict): ``YoutubeDL`` options.
+        - progress (Callable[[dict], Any]): Optional callback (plain or async) for progress events.
+
+        Returns:
+        dict: The sanitized yt-dlp info dict of the downloaded media.
+        """
+        job_id = uuid.uuid4().hex
+        if progress is not None:
+            self._listeners[job_id] = (asyncio.get_running_loop(), progress)
+        try:
+            executor, future = self._submit(_download, job_id, url, options)
+            return await self._result(executor, future)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                # already running in a worker: stop it at its next progress hook
+                self._cancelled[job_id] = True
+                future.add_done_callback(lambda _: self._cancelled.pop(job_id, None))
+            raise
+        finally:
+            self._listeners.pop(job_id, None)
+
+
+ytdl_pool = YtdlPool(Config.YTDL_WORKERS)
@@ -0,0 +1,192 @@
+"""Streaming consumption of yt-dlp output as structured progress events"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from plugins.functions.display_progress import progress_for_pyrogram
+from plugins.functions.jobs import current_job
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Same fields as a yt-dlp progress hook dict
+PROGRESS_FIELDS = (
+    "status",
+    "downloaded_bytes",
+    "total_bytes",
+    "total_bytes_estimate",
+    "speed",
+    "eta",
+    "fragment_index",
+    "fragment_count",
+)
+PROGRESS_PREFIX = "[aup]"
+PROGRESS_TEMPLATE = "download:" + PROGRESS_PREFIX + "|".join(
+    f"%(progress.{field})s" for field in PROGRESS_FIELDS
+)
+# Command line options making yt-dlp print one parseable line per update
+PROGRESS_ARGS = ["--newline", "--progress-template", PROGRESS_TEMPLATE]
+# yt-dlp lines kept for error reporting, older ones are dropped
+TAIL_LINES = 100
+# Longest line read from yt-dlp, longer ones are skipped
+LINE_LIMIT = 1024 * 1024
+
+
+def parse_progress_line(line):
+    """
+    Parse a line printed with ``PROGRESS_TEMPLATE``.
+
+    Parameters:
+    - line (str): One line of yt-dlp stdout.
+
+    Returns:
+    dict: The progress event with numbers converted, or None for other lines.
+    """
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    values = line[len(PROGRESS_PREFIX):].split("|")
+    if len(values) != len(PROGRESS_FIELDS):
+        return None
+    event = {}
+    for field, value in zip(PROGRESS_FIELDS, values):
+        if field == "status":
+            event[field] = value
+            continue
+        try:
+            event[field] = float(value)
+        except ValueError:
+            event[field] = None
+    return event
+
+
+class _LatestEvent:
+    """
+    Deliver progress events from a task of its own, latest first.
+
+    The stdout reader only stores the event; a slow callback (a rate
+    limited message edit) skips the events that arrived meanwhile instead
+    of stalling the reader and, through the pipe, yt-dlp itself.
+    """
+
+    def __init__(self, on_event):
+        self._on_event = on_event
+        self._event = None
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def put(self, event):
+        self._event = event
+        self._ready.set()
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            event, self._event = self._event, None
+            try:
+                await self._on_event(event)
+            except Exception as e:
+                logger.info("Error %s", e)
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def _read_lines(stream, tail, events):
+    while True:
+        try:
+            raw = await stream.readline()
+        except ValueError:
+            # line longer than LINE_LIMIT, asyncio already dropped it
+            continue
+        if not raw:
+            return
+        line = raw.decode(errors="replace").strip()
+        event = parse_progress_line(line) if events else None
+        if event is not None:
+            events.put(event)
+        elif line:
+            tail.append(line)
+
+
+async def stream_ytdl(command, on_event=None):
+    """
+    Run a yt-dlp command, reporting progress while it runs.
+
+    stdout and stderr are consumed line by line as they are produced, and
+    only the last ``TAIL_LINES`` lines of each are kept, so memory use does
+    not depend on how much yt-dlp prints. Progress lines are parsed into
+    events and never kept; ``on_event`` runs outside the reader and only
+    sees the latest event when it falls behind. Success is told by the
+    return code of the process, not by what it printed.
+
+    Parameters:
+    - command (List[str]): yt-dlp command line, ``PROGRESS_ARGS`` are appended.
+    - on_event (Callable[[dict], Awaitable]): Called for every progress event.
+
+    Returns:
+    Tuple[str, str, asyncio.subprocess.Process]: stderr tail, stdout tail and the finished process.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        *PROGRESS_ARGS,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=LINE_LIMIT,
+    )
+    job = current_job()
+    if job is not None:
+        job.add_process(process)
+    stdout_tail = deque(maxlen=TAIL_LINES)
+    stderr_tail = deque(maxlen=TAIL_LINES)
+    events = _LatestEvent(on_event) if on_event else None
+    try:
+        await asyncio.gather(
+            _read_lines(process.stdout, stdout_tail, events),
+            _read_lines(process.stderr, stderr_tail, None),
+        )
+        await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    finally:
+        if events is not None:
+            await events.close()
+    return "\n".join(stderr_tail), "\n".join(stdout_tail), process
+
+
+def status_updater(message, ud_type):
+    """
+    Build a progress event callback that updates a status message.
+
+    Parameters:
+    - message: The Pyrogram status message to edit.
+    - ud_type (str): Status line shown above the progress bar.
+
+    Returns:
+    Callable[[dict], Awaitable]: Callback for progress events.
+    """
+    start = time.time()
+
+    async def update(event):
+        total = event.get("total_bytes") or event.get("total_bytes_estimate")
+        if event.get("status") == "downloading" and total:
+            await progress_for_pyrogram(
+                min(int(event.get("downloaded_bytes") or 0), int(total)),
+                int(total),
+                ud_type,
+                message,
+                start,
+            )
+
+    return update
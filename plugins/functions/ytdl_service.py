@@ -0,0 +1,85 @@
+"""Executor-backed yt-dlp downloads that never block the event loop"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+
+from config import Config
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=Config.YTDL_THREADS, thread_name_prefix="ytdl"
+)
+
+
+class YtdlDownload:
+    """
+    A single yt-dlp download running on the shared executor.
+
+    yt-dlp progress hooks fire on the worker thread; only the most recent
+    event is handed to ``progress`` on the event loop, so a slow status
+    message edit never queues up stale updates. ``cancel()`` makes the next
+    hook raise ``DownloadCancelled`` inside yt-dlp.
+    """
+
+    def __init__(self, url, options, progress=None):
+        self.url = url
+        self.options = options
+        self.progress = progress
+        self._cancelled = threading.Event()
+        self._latest = None
+        self._scheduled = False
+        self._loop = None
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _hook(self, status):
+        if self._cancelled.is_set():
+            raise DownloadCancelled()
+        if self.progress is None:
+            return
+        self._latest = status
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self._dispatch)
+
+    def _dispatch(self):
+        self._scheduled = False
+        result = self.progress(self._latest)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def _work(self):
+        options = dict(self.options, progress_hooks=[self._hook])
+        with YoutubeDL(options) as ydl:
+            info_dict = ydl.extract_info(self.url, download=True)
+            return info_dict, ydl.prepare_filename(info_dict)
+
+    async def run(self):
+        """
+        Download the media, returning once the file is on disk.
+
+        Cancelling the awaiting task also stops the download on its thread.
+
+        Returns:
+        Tuple[dict, str]: The yt-dlp info dict and the downloaded file path.
+        """
+        self._loop = asyncio.get_running_loop()
+        try:
+            return await self._loop.run_in_executor(_executor, self._work)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
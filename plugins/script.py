@@ -101,10 +101,27 @@ I am Powerful Url Uploader Bot
     AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS = (
         "Dᴏᴡɴʟᴏᴀᴅᴇᴅ ɪɴ {} sᴇᴄᴏɴᴅs.\n\nTʜᴀɴᴋs Fᴏʀ Usɪɴɢ Mᴇ\n\nUᴘʟᴏᴀᴅᴇᴅ ɪɴ {} sᴇᴄᴏɴᴅs"
     )
+    JOINED_DOWNLOAD = "♻️ Someone is already downloading this, your file will be uploaded as soon as it is ready."
+    SHARED_DOWNLOAD_FAILED = "❌ The download you were waiting for failed, please try again."
+    JOB_CANCELLED = "⛔ Cancelled."
+    JOB_NOT_FOUND = "This job already finished."
+    JOB_NOT_YOURS = "You can only cancel your own jobs."
+    NO_RUNNING_JOBS = "You have no running jobs."
+    SENT_FROM_CACHE = "⚡ Already uploaded before, sent instantly.\n\nTʜᴀɴᴋs Fᴏʀ Usɪɴɢ Mᴇ"
     FF_MPEG_DEL_ETED_CUSTOM_MEDIA = "✅ Media cleared succesfully."
     CUSTOM_CAPTION_UL_FILE = ""
     NO_VOID_FORMAT_FOUND = "ERROR... <code>{}</code>"
     FREE_USER_LIMIT_Q_SZE = "Cannot Process, Time OUT..."
+    QUEUE_POSITION = "⏳ Server is busy, your job is queued at position {}. It will start automatically."
+    FORMAT_SESSION_EXPIRED = "This format list has expired, please send the link again."
+    INVALID_BUTTON = "This button is not valid, please send the link again."
+    WAITING_FOR_STORAGE = "⏳ Not enough free disk space right now, your job will start as soon as space is released."
+    STORAGE_FULL = "❌ This file is too large for the storage of the bot."
+    TRACE_STATS = "<b>Phase timings of the last {} jobs</b>\n<code>{}</code>"
+    NO_TRACES = "No finished jobs yet."
+    QUEUE_STATUS = "<b>Running ({}/{})</b>\n{}\n\n<b>Waiting ({})</b>\n{}"
+    JOB_ENQUEUED = "⏳ Your job is queued, a worker will pick it up shortly."
+    WORKER_QUEUE_STATUS = "\n\n<b>Worker queue</b>\nQueued: {}\nRunning: {}"
     SLOW_URL_DECED = """
     Gosh that seems to be a very slow URL. Since you were screwing my home,
     I am in no mood to download this file. Meanwhile, why don't you try this:==> https://shrtz.me/PtsVnf6
@@ -1,6 +1,5 @@
 import logging
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
+from plugins.functions.media_info import probe_media
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -19,19 +18,8 @@ async def Mdata01(download_directory):
     Returns:
     Tuple[int, int, int]: Tuple containing width, height, and duration.
     """
-    width = 0
-    height = 0
-    duration = 0
-    metadata = extractMetadata(createParser(download_directory))
-    if metadata is not None:
-        if metadata.has("duration"):
-            duration = metadata.get("duration").seconds
-        if metadata.has("width"):
-            width = metadata.get("width")
-        if metadata.has("height"):
-            height = metadata.get("height")
-
-    return width, height, duration
+    info = await probe_media(download_directory)
+    return info["width"], info["height"], info["duration"]
 
 
 async def Mdata02(download_directory):
@@ -44,16 +32,8 @@ async def Mdata02(download_directory):
     Returns:
     Tuple[int, int]: Tuple containing width and duration.
     """
-    width = 0
-    duration = 0
-    metadata = extractMetadata(createParser(download_directory))
-    if metadata is not None:
-        if metadata.has("duration"):
-            duration = metadata.get("duration").seconds
-        if metadata.has("width"):
-            width = metadata.get("width")
-
-    return width, duration
+    info = await probe_media(download_directory)
+    return info["width"], info["duration"]
 
 
 async def Mdata03(download_directory):
@@ -66,9 +46,5 @@ async def Mdata03(download_directory):
     Returns:
     int: Duration of the audio file.
     """
-    metadata = extractMetadata(createParser(download_directory))
-    return (
-        metadata.get("duration").seconds
-        if metadata is not None and metadata.has("duration")
-        else 0
-    )
+    info = await probe_media(download_directory)
+    return info["duration"]
@@ -1,40 +1,107 @@
 import os
+import time
+import shutil
 import asyncio
 
-from youtube_dl import YoutubeDL
 from pyrogram import enums
 from pyrogram.types import Message
 from pyrogram import Client, filters
 
 from config import Config
 from plugins.functions.help_ytdl import get_file_extension_from_url, get_resolution
+from plugins.functions.jobs import job_registry
+from plugins.functions.ran_text import random_char
+from plugins.functions.metrics import (
+    download_bytes,
+    download_seconds,
+    upload_bytes,
+    upload_seconds,
+)
+from plugins.functions.scheduler import scheduler, job_host, callback_notifier
+from plugins.functions.tracing import record_span
+from plugins.functions.ytdl_progress import status_updater
+from plugins.functions.ytdl_service import YtdlDownload
 YTDL_REGEX = r"^((?:https?:)?\/\/)"
 
 
+def job_directory(job):
+    """
+    Create the download directory of ``job``.
+
+    The directory lives under ``DOWNLOAD_LOCATION`` and is removed when the
+    job ends, so failed and cancelled downloads leave nothing behind.
+
+    Parameters:
+    - job (ActiveJob): The job downloading into the directory.
+
+    Returns:
+    str: Path of the directory.
+    """
+    path = f"{Config.DOWNLOAD_LOCATION}/{job.user_id}{random_char(5)}"
+    os.makedirs(path, exist_ok=True)
+    job.add_path(path)
+    job.add_finalizer(lambda: shutil.rmtree(path, ignore_errors=True))
+    return path
+
+
 @Client.on_callback_query(filters.regex("^ytdl_audio$"))
 async def callback_query_ytdl_audio(_, callback_query):
+    message = callback_query.message
     try:
         url = callback_query.message.reply_to_message.text
         ydl_opts = {
             "format": "bestaudio",
-            "outtmpl": "%(title)s - %(extractor)s-%(id)s.%(ext)s",
             "writethumbnail": True,
         }
-        with YoutubeDL(ydl_opts) as ydl:
-            message = callback_query.message
-            await message.reply_chat_action(enums.ChatAction.TYPING)
-            info_dict = ydl.extract_info(url, download=False)
-            # download
-            await callback_query.edit_message_text("**Downloading audio...**")
-            ydl.process_info(info_dict)
-            # upload
-            audio_file = ydl.prepare_filename(info_dict)
-            task = asyncio.create_task(send_audio(message, info_dict, audio_file))
-            while not task.done():
-                await asyncio.sleep(3)
-                await message.reply_chat_action(enums.ChatAction.UPLOAD_DOCUMENT)
-            await message.reply_chat_action(enums.ChatAction.CANCEL)
-            await message.delete()
+        async with job_registry.track(
+            callback_query.from_user.id, message, "youtube"
+        ) as job:
+            ydl_opts["outtmpl"] = (
+                f"{job_directory(job)}/%(title)s - %(extractor)s-%(id)s.%(ext)s"
+            )
+            async with scheduler.slot(
+                callback_query.from_user.id,
+                job_host(url),
+                "youtube",
+                notify=callback_notifier(callback_query),
+            ):
+                await message.reply_chat_action(enums.ChatAction.TYPING)
+                # download off the event loop
+                await callback_query.edit_message_text(
+                    "**Downloading audio...**",
+                    reply_markup=job_registry.markup_for(message),
+                )
+                download = YtdlDownload(
+                    url,
+                    ydl_opts,
+                    progress=status_updater(message, "**Downloading audio...**"),
+                )
+                download_started = time.monotonic()
+                info_dict, audio_file = await download.run()
+                download_seconds.observe(
+                    time.monotonic() - download_started, path="youtube"
+                )
+                record_span("download", download_started)
+                file_size = os.path.getsize(audio_file)
+                download_bytes.inc(file_size, path="youtube")
+                # upload
+                upload_started = time.monotonic()
+                task = asyncio.create_task(send_audio(message, info_dict, audio_file))
+                try:
+                    while not task.done():
+                        await asyncio.sleep(3)
+                        await message.reply_chat_action(enums.ChatAction.UPLOAD_DOCUMENT)
+                finally:
+                    # a cancelled job must not keep uploading in the background
+                    task.cancel()
+                if task.exception() is None:
+                    upload_seconds.observe(
+                        time.monotonic() - upload_started, path="youtube"
+                    )
+                    record_span("upload", upload_started)
+                    upload_bytes.inc(file_size, path="youtube")
+                await message.reply_chat_action(enums.ChatAction.CANCEL)
+                await message.delete()
     except Exception as e:
         await message.reply_text(e)
     await callback_query.message.reply_to_message.delete()
@@ -97,29 +164,62 @@ async def send_video(message: Message, info_dict, video_file):
 
 @Client.on_callback_query(filters.regex("^ytdl_video$"))
 async def callback_query_ytdl_video(_, callback_query):
+    message = callback_query.message
     try:
-        # url = callback_query.message.text
         url = callback_query.message.reply_to_message.text
         ydl_opts = {
             "format": "best[ext=mp4]",
-            "outtmpl": "%(title)s - %(extractor)s-%(id)s.%(ext)s",
             "writethumbnail": True,
         }
-        with YoutubeDL(ydl_opts) as ydl:
-            message = callback_query.message
-            await message.reply_chat_action(enums.ChatAction.TYPING)
-            info_dict = ydl.extract_info(url, download=False)
-            # download
-            await callback_query.edit_message_text("**Downloading video...**")
-            ydl.process_info(info_dict)
-            # upload
-            video_file = ydl.prepare_filename(info_dict)
-            task = asyncio.create_task(send_video(message, info_dict, video_file))
-            while not task.done():
-                await asyncio.sleep(3)
-                await message.reply_chat_action(enums.ChatAction.UPLOAD_DOCUMENT)
-            await message.reply_chat_action(enums.ChatAction.CANCEL)
-            await message.delete()
+        async with job_registry.track(
+            callback_query.from_user.id, message, "youtube"
+        ) as job:
+            ydl_opts["outtmpl"] = (
+                f"{job_directory(job)}/%(title)s - %(extractor)s-%(id)s.%(ext)s"
+            )
+            async with scheduler.slot(
+                callback_query.from_user.id,
+                job_host(url),
+                "youtube",
+                notify=callback_notifier(callback_query),
+            ):
+                await message.reply_chat_action(enums.ChatAction.TYPING)
+                # download off the event loop
+                await callback_query.edit_message_text(
+                    "**Downloading video...**",
+                    reply_markup=job_registry.markup_for(message),
+                )
+                download = YtdlDownload(
+                    url,
+                    ydl_opts,
+                    progress=status_updater(message, "**Downloading video...**"),
+                )
+                download_started = time.monotonic()
+                info_dict, video_file = await download.run()
+                download_seconds.observe(
+                    time.monotonic() - download_started, path="youtube"
+                )
+                record_span("download", download_started)
+                file_size = os.path.getsize(video_file)
+                download_bytes.inc(file_size, path="youtube")
+                # upload
+                upload_started = time.monotonic()
+                task = asyncio.create_task(send_video(message, info_dict, video_file))
+                try:
+                    while not task.done():
+                        await asyncio.sleep(3)
+                        await message.reply_chat_action(enums.ChatAction.UPLOAD_DOCUMENT)
+                finally:
+                    # a cancelled job must not keep uploading in the background
+                    task.cancel()
+                if task.exception() is None:
+                    upload_seconds.observe(
+                        time.monotonic() - upload_started, path="youtube"
+                    )
+                    record_span("upload", upload_started)
+                    upload_bytes.inc(file_size, path="youtube")
+                await message.reply_chat_action(enums.ChatAction.CANCEL)
+                await message.delete()
     except Exception as e:
         await message.reply_text(e)
     await callback_query.message.reply_to_message.delete()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# the modules write their log, SQLite files and downloads relative to the
+# working directory on import: keep them out of the checkout
+os.environ.setdefault("FILE_ID_DB", ":memory:")
+os.environ.setdefault("TRACE_FILE", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="aup-tests-"))
@@ -0,0 +1,84 @@
+import base64
+
+import pytest
+
+from plugins.functions.callback_codec import (
+    MAX_LENGTH,
+    OP_CANCEL,
+    OP_DIRECT,
+    OP_FORMAT,
+    VERSION,
+    CallbackDataError,
+    decode,
+    encode,
+)
+
+
+def pack(raw):
+    return base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode("ascii")
+
+
+@pytest.mark.parametrize(
+    "opcode, fields",
+    [
+        (OP_FORMAT, ["Ab3dE9", "0"]),
+        (OP_DIRECT, ["Ab3dE9", "17"]),
+        (OP_CANCEL, ["x7Hq20Lm"]),
+        (OP_FORMAT, ["", "255"]),
+        (OP_CANCEL, ["ünïcödé"]),
+    ],
+)
+def test_round_trip(opcode, fields):
+    data = encode(opcode, *fields)
+    assert len(data) <= MAX_LENGTH
+    assert "=" not in data
+    assert decode(data) == (opcode, fields)
+
+
+def test_fields_are_sent_as_text():
+    assert decode(encode(OP_FORMAT, "token", 3)) == (OP_FORMAT, ["token", "3"])
+
+
+def test_data_over_telegram_limit_is_refused():
+    # 2 header bytes and a length byte leave 45 bytes for 64 base64 characters
+    assert len(encode(OP_CANCEL, "x" * 45)) == MAX_LENGTH
+    with pytest.raises(CallbackDataError):
+        encode(OP_CANCEL, "x" * 46)
+
+
+def test_field_over_255_bytes_is_refused():
+    with pytest.raises(CallbackDataError):
+        encode(OP_CANCEL, "x" * 256)
+
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(CallbackDataError, match="version"):
+        decode(pack([VERSION + 1, OP_CANCEL, 1, ord("a")]))
+
+
+def test_unknown_opcode_is_rejected():
+    with pytest.raises(CallbackDataError, match="opcode"):
+        encode(99, "a")
+    with pytest.raises(CallbackDataError, match="opcode"):
+        decode(pack([VERSION, 99, 1, ord("a")]))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        pack([VERSION, OP_CANCEL, 5, ord("a"), ord("b")]),
+        pack([VERSION]),
+        "",
+        # legacy callback data of the menus
+        "close",
+    ],
+)
+def test_truncated_or_foreign_data_is_rejected(data):
+    with pytest.raises(CallbackDataError):
+        decode(data)
+
+
+def test_truncated_encoding_is_rejected():
+    data = encode(OP_FORMAT, "Ab3dE9", "12")
+    with pytest.raises(CallbackDataError):
+        decode(data[:-2])
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from plugins.functions import display_progress
+from plugins.functions.display_progress import ProgressReporter, progress_for_pyrogram
+from plugins.functions.jobs import job_registry
+
+
+def fake_message(edits):
+    async def edit(text, reply_markup=None):
+        edits.append(text)
+
+    return SimpleNamespace(chat=SimpleNamespace(id=1), id=2, edit=edit)
+
+
+def test_finish_does_not_wait_out_a_flood_wait():
+    edits = []
+
+    async def edit(text):
+        edits.append(text)
+
+    async def run():
+        reporter = ProgressReporter(edit, min_interval=0)
+        # as set by a FloodWait of five minutes
+        reporter._next_edit = time.monotonic() + 300
+        started = time.monotonic()
+        await reporter.finish("done")
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 1
+    assert edits == []
+
+
+def test_finish_delivers_the_last_text_when_allowed():
+    edits = []
+
+    async def edit(text):
+        edits.append(text)
+
+    async def run():
+        reporter = ProgressReporter(edit, min_interval=0)
+        await reporter.update("half")
+        await reporter.finish("done")
+
+    asyncio.run(run())
+    assert edits == ["half", "done"]
+
+
+def test_reporter_is_dropped_when_the_job_fails():
+    message = fake_message([])
+
+    async def run():
+        try:
+            async with job_registry.track(1, message, "ddl"):
+                await progress_for_pyrogram(10, 100, "Uploading", message, time.time())
+                assert (1, 2) in display_progress._reporters
+                raise ConnectionError("upload aborted")
+        except ConnectionError:
+            pass
+
+    asyncio.run(run())
+    assert (1, 2) not in display_progress._reporters
@@ -0,0 +1,30 @@
+from plugins.button import format_validator
+from plugins.functions.file_id_cache import FileIdCache
+from plugins.functions.format_sessions import compact_session
+
+
+def test_key_depends_on_file_name():
+    url = "https://example.com/video.mp4"
+    assert FileIdCache.key(url, "", "file", "", "a.mp4") != FileIdCache.key(
+        url, "", "file", "", "b.mp4"
+    )
+    assert FileIdCache.key(url, "", "file", "", "a.mp4") == FileIdCache.key(
+        url + "#frag", "", "file", "", "a.mp4"
+    )
+
+
+def test_audio_validator_uses_audio_formats():
+    session = compact_session(
+        1,
+        "https://example.com/watch",
+        {
+            "formats": [
+                {"format_id": "140", "vcodec": "none", "filesize": 3000},
+                {"format_id": "251", "vcodec": "none", "filesize_approx": 4000},
+                {"format_id": "22", "vcodec": "avc1", "filesize": 90000},
+            ]
+        },
+    )
+    assert format_validator(session, "audio", "320k") == "4000"
+    assert format_validator(session, "video", "22") == "90000"
+    assert format_validator(session, "video", "18") == ""
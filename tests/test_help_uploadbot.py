@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+from plugins.functions.help_uploadbot import DetectFileSize, needs_size_probe
+from plugins.functions.http_client import http_client
+
+
+def test_needs_size_probe():
+    plain = {"url": "https://cdn.example.com/v.mp4", "protocol": "https"}
+    assert needs_size_probe(plain)
+    assert not needs_size_probe(dict(plain, filesize_approx=1000))
+    assert not needs_size_probe(dict(plain, format_note="DASH video"))
+    assert not needs_size_probe(dict(plain, fragments=[{"path": "seg-1.m4s"}]))
+    assert not needs_size_probe(dict(plain, protocol="m3u8_native"))
+
+
+def test_head_and_range_probe_share_one_deadline():
+    async def head(_request):
+        await asyncio.sleep(0.6)
+        return web.Response(headers={"Content-Length": "0"})
+
+    async def get(_request):
+        await asyncio.sleep(2)
+        return web.Response(body=b"x")
+
+    async def run():
+        app = web.Application()
+        app.router.add_route("HEAD", "/file", head)
+        app.router.add_get("/file", get, allow_head=False)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            started = time.monotonic()
+            size = await DetectFileSize(f"http://127.0.0.1:{port}/file", timeout=1)
+            return size, time.monotonic() - started
+        finally:
+            await http_client.close()
+            await runner.cleanup()
+
+    size, elapsed = asyncio.run(run())
+    assert size == 0
+    assert elapsed < 1.5
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import plugins.commands as commands
+from plugins.functions.job_queue import (
+    CANCELLED,
+    CANCELLING,
+    DONE,
+    QUEUED,
+    RUNNING,
+    SqliteJobQueue,
+    open_job_queue,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEASE = 2
+
+# worker.py serving jobs whose handler just sleeps for the seconds in its payload
+WORKER = """
+import asyncio
+from types import SimpleNamespace
+
+import worker
+
+
+async def sleep_job(_client, _update, choice):
+    await asyncio.sleep(float(choice[0]))
+
+
+class FakeClient:
+    async def get_messages(self, chat_id, message_id):
+        return SimpleNamespace(
+            chat=SimpleNamespace(id=chat_id),
+            id=message_id,
+            reply_to_message=SimpleNamespace(text="https://example.com/file"),
+        )
+
+    async def get_users(self, user_id):
+        return SimpleNamespace(id=user_id)
+
+
+worker.ddl_call_back = sleep_job
+asyncio.run(worker.serve(FakeClient()))
+"""
+
+
+def start_worker(tmp_path, name):
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        JOB_QUEUE=str(tmp_path / "jobs.db"),
+        JOB_LEASE=str(LEASE),
+        WORKER_POLL_INTERVAL="0.2",
+        WORKER_NAME=name,
+        FILE_ID_DB=":memory:",
+        TRACE_FILE="",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-c", WORKER],
+        cwd=tmp_path,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_for(queue, job_id, predicate, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await queue.get(job_id)
+        if predicate(job):
+            return job
+        await asyncio.sleep(0.1)
+    raise AssertionError(f"job {job_id} stuck in {job}")
+
+
+def put(queue, seconds, user_id=1):
+    return queue.put("ddl", user_id, user_id, 1, {"choice": [str(seconds)]})
+
+
+def test_lease_rules(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / "jobs.db"), lease=1)
+    running = put(queue, 1)
+    cancelling = put(queue, 1)
+    assert queue.claim("a")["id"] == running
+    assert queue.claim("a")["id"] == cancelling
+    queue.cancel(cancelling)
+    time.sleep(1.1)
+
+    # the lease of "a" expired: "b" takes the running job over, the
+    # cancelled one is not run again
+    assert queue.claim("b")["id"] == running
+    assert queue.get(cancelling)["state"] == CANCELLED
+    assert queue.heartbeat(running, "a") is None
+    assert not queue.finish(running, "a", DONE)
+    assert queue.finish(running, "b", DONE)
+    assert queue.get(running)["state"] == DONE
+
+
+def test_workers_claim_cancel_and_take_over(tmp_path):
+    queue = open_job_queue(str(tmp_path / "jobs.db"), LEASE)
+    workers = {name: start_worker(tmp_path, name) for name in ("w1", "w2")}
+    replies = []
+
+    async def reply_text(text, **_kwargs):
+        replies.append(text)
+
+    async def scenario():
+        # every job runs once, on one of the workers
+        quick = [await put(queue, 0.3, user_id=10 + i) for i in range(4)]
+        for job_id in quick:
+            job = await wait_for(queue, job_id, lambda job: job["state"] == DONE)
+            assert job["worker"] in workers
+
+        # /cancel of the front-end reaches queued and running worker jobs
+        commands.job_queue = queue
+        running = await put(queue, 60, user_id=7)
+        await wait_for(queue, running, lambda job: job["state"] == RUNNING)
+        await commands.cancel_jobs(
+            None,
+            SimpleNamespace(
+                command=["cancel"],
+                from_user=SimpleNamespace(id=7),
+                reply_text=reply_text,
+            ),
+        )
+        job = await wait_for(queue, running, lambda job: job["state"] == CANCELLED)
+        assert job["worker"] in workers
+
+        # a killed worker loses its job to the other one once the lease expires
+        orphan = await put(queue, 60, user_id=8)
+        job = await wait_for(queue, orphan, lambda job: job["state"] == RUNNING)
+        dead = job["worker"]
+        workers[dead].send_signal(signal.SIGKILL)
+        workers[dead].wait()
+        job = await wait_for(
+            queue,
+            orphan,
+            lambda job: job["state"] == RUNNING and job["worker"] not in (None, dead),
+        )
+
+        # a job cancelled after its worker died is not queued again
+        survivor = job["worker"]
+        workers[survivor].send_signal(signal.SIGKILL)
+        workers[survivor].wait()
+        await queue.cancel(orphan)
+        assert (await queue.get(orphan))["state"] == CANCELLING
+        workers["w3"] = start_worker(tmp_path, "w3")
+        await wait_for(queue, orphan, lambda job: job["state"] == CANCELLED)
+        assert (await queue.counts()).get(QUEUED, 0) == 0
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        commands.job_queue = None
+        for process in workers.values():
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    assert replies and replies[0].endswith("(1)")
@@ -0,0 +1,12 @@
+from plugins.functions.metrics import MetricsRegistry
+
+
+def test_function_counter_is_typed_counter():
+    registry = MetricsRegistry()
+    hits = [0]
+    registry.counter("aup_test_hits_total", "Hits.", function=lambda: hits[0])
+    registry.gauge("aup_test_entries", "Entries.", function=lambda: 3)
+    hits[0] = 5
+    text = registry.render()
+    assert "# TYPE aup_test_hits_total counter\naup_test_hits_total 5\n" in text
+    assert "# TYPE aup_test_entries gauge\naup_test_entries 3\n" in text
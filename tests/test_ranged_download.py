@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from config import Config
+from plugins.functions import ranged_download
+from plugins.functions.download_journal import JOURNAL_SUFFIX, DownloadJournal
+from plugins.functions.ranged_download import download_segmented
+
+KiB = 1024
+PAYLOAD = os.urandom(256 * KiB)
+HALF = len(PAYLOAD) // 2
+LAST = len(PAYLOAD) - 1
+VALIDATORS = {"etag": '"v1"', "last_modified": ""}
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    monkeypatch.setattr(Config, "MIN_SEGMENT_SIZE", 64 * KiB)
+    monkeypatch.setattr(Config, "WRITE_BLOCK_SIZE", 16 * KiB)
+    monkeypatch.setattr(Config, "SEGMENT_RETRIES", 2)
+    monkeypatch.setattr(ranged_download, "MAX_RETRY_DELAY", 0)
+
+
+def make_app(requests, break_at):
+    """Serve PAYLOAD by range; the first response covering ``break_at`` breaks off there."""
+    broken = []
+
+    async def handler(request):
+        start, end = map(int, request.headers["Range"][len("bytes="):].split("-"))
+        requests.append((start, end))
+        response = web.StreamResponse(status=206)
+        response.headers["Content-Length"] = str(end - start + 1)
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{len(PAYLOAD)}"
+        response.headers["ETag"] = VALIDATORS["etag"]
+        await response.prepare(request)
+        if break_at is not None and not broken and start <= break_at <= end:
+            broken.append(start)
+            await response.write(PAYLOAD[start:break_at])
+            await asyncio.sleep(0.1)
+            request.transport.close()
+            return response
+        await response.write(PAYLOAD[start: end + 1])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    return app
+
+
+async def download(file_name, requests, segments, break_at=None, before=None):
+    runner = web.AppRunner(make_app(requests, break_at))
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    url = f"http://localhost:{site._server.sockets[0].getsockname()[1]}/file"
+
+    async def progress(_downloaded):
+        pass
+
+    try:
+        if before:
+            await before(url)
+        async with aiohttp.ClientSession() as session:
+            return await download_segmented(
+                session, url, file_name, len(PAYLOAD), VALIDATORS, progress, segments
+            )
+    finally:
+        await runner.cleanup()
+
+
+def test_broken_segment_is_retried_from_where_it_stopped(tmp_path):
+    file_name = str(tmp_path / "file.bin")
+    requests = []
+    break_at = 160 * KiB
+
+    assert asyncio.run(download(file_name, requests, 2, break_at)) == len(PAYLOAD)
+    with open(file_name, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert not os.path.exists(file_name + JOURNAL_SUFFIX)
+    # both segments, then only the rest of the one that broke off
+    assert sorted(requests[:2]) == [(0, HALF - 1), (HALF, LAST)]
+    assert len(requests) == 3
+    retry_start, retry_end = requests[2]
+    assert HALF < retry_start <= break_at and retry_end == LAST
+
+
+def test_resume_only_fetches_missing_ranges(tmp_path):
+    file_name = str(tmp_path / "file.bin")
+    requests = []
+
+    async def interrupted_run(url):
+        # an earlier run left the first 100 KiB on disk and in the journal
+        with open(file_name, "wb") as f:
+            f.write(PAYLOAD[: 100 * KiB])
+        journal = DownloadJournal(file_name, url, len(PAYLOAD), VALIDATORS)
+        await journal.mark(0, 100 * KiB - 1)
+
+    assert asyncio.run(
+        download(file_name, requests, 1, before=interrupted_run)
+    ) == len(PAYLOAD)
+    with open(file_name, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert requests == [(100 * KiB, LAST)]
+
+
+def test_journal_is_kept_when_retries_run_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SEGMENT_RETRIES", 0)
+    file_name = str(tmp_path / "file.bin")
+    requests = []
+
+    with pytest.raises((ConnectionError, aiohttp.ClientError)):
+        asyncio.run(download(file_name, requests, 2, break_at=160 * KiB))
+    # what arrived stays journaled for the next attempt
+    with open(file_name + JOURNAL_SUFFIX, encoding="utf8") as f:
+        done = json.load(f)["done"]
+    assert len(done) == 1
+    start, end = done[0]
+    assert start == 0 and HALF <= end < LAST
@@ -0,0 +1,131 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import plugins.button as button
+from plugins.functions.single_flight import downloads_in_flight
+from plugins.script import Translation
+
+CHOICE = ("file", "22", "mp4")
+SESSION = {"title": "clip", "formats": {"22": {"filesize": 1000}}}
+
+
+class FakeBot:
+    def __init__(self):
+        self.uploads = []
+        self.resent = []
+
+    async def send_document(self, chat_id, document, **_kwargs):
+        with open(document, "rb") as f:
+            self.uploads.append(f.read())
+        return SimpleNamespace(
+            chat=SimpleNamespace(id=chat_id),
+            document=SimpleNamespace(file_id=f"file-{len(self.uploads)}"),
+        )
+
+    async def send_cached_media(self, chat_id, file_id, **_kwargs):
+        self.resent.append(file_id)
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+
+
+class FakePool:
+    """yt-dlp pool whose downloads finish when ``gate`` is set."""
+
+    enabled = True
+
+    def __init__(self, fail=False):
+        self.gate = asyncio.Event()
+        self.downloads = 0
+        self.fail = fail
+        self.paths = []
+
+    async def download(self, _url, options, progress=None):
+        self.downloads += 1
+        self.paths.append(options["outtmpl"])
+        await self.gate.wait()
+        if self.fail:
+            raise RuntimeError("leader crashed")
+        with open(options["outtmpl"], "wb") as f:
+            f.write(b"media")
+        return {}
+
+
+def make_update(url, user_id):
+    captions = []
+
+    async def edit_caption(caption, **_kwargs):
+        captions.append(caption)
+
+    message = SimpleNamespace(
+        id=user_id,
+        chat=SimpleNamespace(id=user_id),
+        reply_to_message=SimpleNamespace(text=url, entities=[]),
+        edit_caption=edit_caption,
+    )
+    return SimpleNamespace(message=message, from_user=SimpleNamespace(id=user_id)), captions
+
+
+async def run_jobs(bot, url, user_ids, pool):
+    updates = [make_update(url, user_id) for user_id in user_ids]
+    jobs = [
+        asyncio.ensure_future(button.youtube_dl_call_back(bot, update, SESSION, CHOICE))
+        for update, _ in updates
+    ]
+    # every job joined the flight before the leader's download finishes
+    while sum(len(captions) for _, captions in updates) < 2 * len(user_ids) - 1:
+        await asyncio.sleep(0.01)
+    pool.gate.set()
+    results = await asyncio.gather(*jobs)
+    return results, [captions for _, captions in updates]
+
+
+def test_followers_share_the_download_and_later_jobs_hit_the_cache(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(button, "ytdl_pool", pool)
+    bot = FakeBot()
+    url = "https://example.com/watch?v=shared"
+
+    async def run():
+        results, captions = await run_jobs(bot, url, [1, 2, 3], pool)
+        assert not downloads_in_flight._flights
+        # a job asking for it afterwards is answered with the file_id
+        later, later_captions = make_update(url, 4)
+        assert await button.youtube_dl_call_back(bot, later, SESSION, CHOICE)
+        return results, captions, later_captions
+
+    results, captions, later_captions = asyncio.run(run())
+    assert pool.downloads == 1
+    assert sum(Translation.JOINED_DOWNLOAD in c for c in captions) == 2
+    assert bot.uploads == [b"media"] * 3
+    assert len(bot.resent) == 1 and bot.resent[0].startswith("file-")
+    assert later_captions[-1] == Translation.SENT_FROM_CACHE
+    assert all(result is not False for result in results)
+    # the shared temp directory went away with the last participant
+    assert not os.path.exists(os.path.dirname(pool.paths[0]))
+
+
+def test_followers_of_a_failed_leader_give_up(monkeypatch):
+    pool = FakePool(fail=True)
+    monkeypatch.setattr(button, "ytdl_pool", pool)
+    bot = FakeBot()
+    url = "https://example.com/watch?v=crashed"
+
+    async def run():
+        updates = [make_update(url, user_id) for user_id in (5, 6)]
+        jobs = [
+            asyncio.ensure_future(
+                button.youtube_dl_call_back(bot, update, SESSION, CHOICE)
+            )
+            for update, _ in updates
+        ]
+        while Translation.JOINED_DOWNLOAD not in updates[1][1]:
+            await asyncio.sleep(0.01)
+        pool.gate.set()
+        return await asyncio.gather(*jobs, return_exceptions=True), updates
+
+    (leader, follower), updates = asyncio.run(run())
+    assert isinstance(leader, RuntimeError)
+    assert follower is False
+    assert updates[1][1][-1] == Translation.SHARED_DOWNLOAD_FAILED
+    assert pool.downloads == 1
+    assert not bot.uploads and not bot.resent
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import shutil
+import threading
+
+from plugins.functions import storage
+from plugins.functions.storage import Reservation, StorageManager
+
+MiB = 1024 * 1024
+
+
+def test_preallocated_sparse_file_is_pending(tmp_path):
+    path = tmp_path / "video.mp4"
+    reservation = Reservation(8 * MiB)
+    reservation.track(str(path))
+    with open(path, "wb") as f:
+        # what a segmented download does before fetching any segment
+        os.ftruncate(f.fileno(), 8 * MiB)
+    assert reservation.pending() >= 7 * MiB
+
+    with open(path, "r+b") as f:
+        f.write(b"\1" * 4 * MiB)
+        f.flush()
+        os.fsync(f.fileno())
+    assert 3 * MiB <= reservation.pending() <= 4 * MiB
+
+
+def test_concurrent_reservations_share_the_free_space(tmp_path, monkeypatch):
+    walkers = set()
+    tree_size = storage._tree_size
+
+    def recording_tree_size(path):
+        walkers.add(threading.current_thread())
+        return tree_size(path)
+
+    monkeypatch.setattr(storage, "_tree_size", recording_tree_size)
+    # room for one 6 MiB job, not for two
+    min_free = shutil.disk_usage(tmp_path).free - 10 * MiB
+    manager = StorageManager(str(tmp_path), 0, min_free, 3600, 3600)
+    (tmp_path / "a").write_bytes(b"\1" * MiB)
+
+    async def run():
+        first, second = await asyncio.wait_for(
+            asyncio.gather(
+                manager.reserve(6 * MiB, str(tmp_path / "a")),
+                asyncio.wait_for(manager.reserve(6 * MiB, str(tmp_path / "b")), 0.5),
+                return_exceptions=True,
+            ),
+            5,
+        )
+        granted = [r for r in (first, second) if isinstance(r, Reservation)]
+        assert len(granted) == 1
+        assert isinstance(first, asyncio.TimeoutError) or isinstance(
+            second, asyncio.TimeoutError
+        )
+        # the waiting job gets the space once the first one is done
+        waiting = asyncio.ensure_future(manager.reserve(6 * MiB))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        manager.release(granted[0])
+        assert (await asyncio.wait_for(waiting, 5)).nbytes == 6 * MiB
+        manager._janitor.cancel()
+
+    asyncio.run(run())
+    # the written bytes were measured off the event loop
+    assert walkers and threading.main_thread() not in walkers
@@ -0,0 +1,125 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from pyrogram.errors import FloodWait
+
+from config import Config
+from plugins.functions.stream_upload import PART_SIZE, stream_upload
+
+
+def fake_response(payload, fail_after=None):
+    async def iter_chunked(size):
+        for index, offset in enumerate(range(0, len(payload), size)):
+            if index == fail_after:
+                raise aiohttp.ClientPayloadError("connection reset")
+            yield payload[offset:offset + size]
+
+    return SimpleNamespace(content=SimpleNamespace(iter_chunked=iter_chunked))
+
+
+class FakeClient:
+    def __init__(self, invoke):
+        self.invoke = invoke
+        self.parts = {}
+
+    def rnd_id(self):
+        return 1
+
+
+@pytest.fixture(autouse=True)
+def small_buffer(monkeypatch):
+    monkeypatch.setattr(Config, "STREAM_UPLOAD_BUFFER", 2)
+    monkeypatch.setattr(Config, "UPLOAD_PART_RETRIES", 0)
+
+
+def test_consumer_failure_with_full_queue_does_not_hang():
+    payload = os.urandom(20 * PART_SIZE)
+
+    async def invoke(rpc):
+        if rpc.file_part == 2:
+            raise ValueError("part rejected")
+        # let the producer fill the queue
+        await asyncio.sleep(0.01)
+        return True
+
+    async def run():
+        await asyncio.wait_for(
+            stream_upload(FakeClient(invoke), fake_response(payload), "f", len(payload)),
+            5,
+        )
+
+    with pytest.raises(ConnectionError) as error:
+        asyncio.run(run())
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+def test_producer_error_is_reraised(tmp_path):
+    payload = os.urandom(4 * PART_SIZE)
+
+    async def invoke(_rpc):
+        return True
+
+    async def run():
+        await asyncio.wait_for(
+            stream_upload(
+                FakeClient(invoke),
+                fake_response(payload, fail_after=2),
+                "f",
+                len(payload),
+                file_name=str(tmp_path / "f"),
+            ),
+            5,
+        )
+
+    with pytest.raises(aiohttp.ClientPayloadError):
+        asyncio.run(run())
+    assert os.path.getsize(tmp_path / "f") == 2 * PART_SIZE
+
+
+def test_cancelled_upload_stops_producer():
+    payload = os.urandom(20 * PART_SIZE)
+
+    async def invoke(_rpc):
+        await asyncio.sleep(60)
+
+    async def run():
+        task = asyncio.ensure_future(
+            stream_upload(FakeClient(invoke), fake_response(payload), "f", len(payload))
+        )
+        await asyncio.sleep(0.1)
+        task.cancel()
+        done, _ = await asyncio.wait({task}, timeout=5)
+        assert done and task.cancelled()
+
+    asyncio.run(run())
+
+
+def test_flood_wait_is_waited_out(tmp_path):
+    payload = os.urandom(3 * PART_SIZE + 10)
+    received = {}
+    flooded = []
+
+    async def invoke(rpc):
+        if rpc.file_part == 1 and not flooded:
+            flooded.append(rpc.file_part)
+            raise FloodWait(value=0)
+        received[rpc.file_part] = rpc.bytes
+        return True
+
+    async def run():
+        return await stream_upload(
+            FakeClient(invoke),
+            fake_response(payload),
+            "f",
+            len(payload),
+            file_name=str(tmp_path / "f"),
+        )
+
+    input_file = asyncio.run(run())
+    assert input_file.parts == 4
+    assert b"".join(received[i] for i in range(4)) == payload
+    with open(tmp_path / "f", "rb") as f:
+        assert f.read() == payload
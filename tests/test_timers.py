@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+
+import plugins.echo as echo
+from plugins.functions.timers import TimerWheel
+from plugins.functions.ytdl_pool import YtdlError
+
+
+def test_callback_runs_after_delay():
+    fired = []
+
+    async def run():
+        wheel = TimerWheel(tick=0.01)
+        wheel.schedule(0.05, fired.append, "done")
+        await asyncio.sleep(0.02)
+        assert fired == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert fired == ["done"]
+
+
+def test_full_wheel_refuses_instead_of_firing_early():
+    cooldowns = {"1": 0, "2": 0}
+
+    async def run():
+        wheel = TimerWheel(tick=0.01, max_pending=1)
+        assert wheel.schedule(10, cooldowns.pop, "1", None) is not None
+        assert wheel.schedule(10, cooldowns.pop, "2", None) is None
+        await asyncio.sleep(0.05)
+        assert len(wheel) == 1
+
+    asyncio.run(run())
+    # neither cooldown was lifted early
+    assert cooldowns == {"1": 0, "2": 0}
+
+
+def test_rescheduling_a_key_replaces_the_timer():
+    fired = []
+
+    async def run():
+        wheel = TimerWheel(tick=0.01)
+        wheel.schedule(0.02, fired.append, "old", key="k")
+        wheel.schedule(0.02, fired.append, "new", key="k")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert fired == ["new"]
+
+
+def test_coroutine_callbacks_are_kept_and_their_errors_logged(caplog):
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    async def broken():
+        raise RuntimeError("boom")
+
+    async def run():
+        wheel = TimerWheel(tick=0.01)
+        wheel.schedule(0.01, slow)
+        wheel.schedule(0.01, broken)
+        await asyncio.sleep(0.04)
+        # both coroutines are referenced by the wheel while they run
+        assert len(wheel._tasks) >= 1
+        await asyncio.sleep(0.1)
+        assert not wheel._tasks
+
+    with caplog.at_level("INFO", logger="plugins.functions.timers"):
+        asyncio.run(run())
+    assert finished == [True]
+    assert "boom" in caplog.text
+
+
+def test_probe_error_reply_does_not_block_the_loop(monkeypatch):
+    wheel = TimerWheel(tick=0.01)
+    sent = []
+
+    async def failing_extract(_url, _options):
+        raise YtdlError("ERROR: Unsupported URL")
+
+    async def noop(*_args, **_kwargs):
+        pass
+
+    class FakeBot:
+        async def send_message(self, **kwargs):
+            sent.append(kwargs)
+            return SimpleNamespace(id=2, delete=noop, edit_reply_markup=noop)
+
+    monkeypatch.setattr(echo, "timers", wheel)
+    monkeypatch.setattr(
+        echo, "ytdl_pool", SimpleNamespace(enabled=True, extract=failing_extract)
+    )
+    monkeypatch.setattr(echo.Config, "AUTH_USERS", [42])
+    update = SimpleNamespace(
+        text="https://example.com/unsupported",
+        entities=[],
+        id=1,
+        chat=SimpleNamespace(id=42),
+        from_user=SimpleNamespace(id=42),
+    )
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(asyncio.get_running_loop().time())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticking = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0.02)
+        before = len(ticks)
+        started = asyncio.get_running_loop().time()
+        assert await echo.echo(FakeBot(), update) is False
+        handler_time = asyncio.get_running_loop().time() - started
+        # let the ticker run while the error reply is still pending
+        await asyncio.sleep(0.1)
+        ticking.cancel()
+        return before, handler_time
+
+    before, handler_time = asyncio.run(run())
+    # the handler returned at once and the ticker kept going meanwhile
+    assert handler_time < 1
+    assert len(ticks) - before >= 5
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 1
+    # only the status message was sent, the error reply waits in the wheel
+    assert [message["text"] for message in sent] == ["Proccesing your ⌛"]
+    assert ("probe_error", 42, 1) in wheel._index
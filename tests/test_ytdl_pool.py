@@ -0,0 +1,117 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+from aiohttp import web
+
+from plugins.functions.ytdl_pool import YtdlError, YtdlPool
+
+CHUNK = 64 * 1024
+# about 30 seconds of download at the pace of the server
+SIZE = 600 * CHUNK
+
+
+async def serve(active):
+    """Serve a slow clip; ``active`` holds the requests still being answered."""
+
+    async def clip(request):
+        response = web.StreamResponse(headers={"Content-Type": "video/mp4"})
+        response.content_length = SIZE
+        active.add(id(request))
+        try:
+            await response.prepare(request)
+            for _ in range(SIZE // CHUNK):
+                await response.write(b"\0" * CHUNK)
+                await asyncio.sleep(0.05)
+        finally:
+            active.discard(id(request))
+        return response
+
+    app = web.Application()
+    app.router.add_get("/clip.mp4", clip)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/clip.mp4"
+
+
+async def wait_idle(active, timeout):
+    deadline = time.monotonic() + timeout
+    while active:
+        assert time.monotonic() < deadline, "the worker kept downloading"
+        await asyncio.sleep(0.1)
+
+
+@pytest.fixture
+def pool():
+    pool = YtdlPool(1)
+    yield pool
+    pool.close()
+
+
+def test_cancelled_download_stops_the_worker(pool, tmp_path):
+    options = {
+        "quiet": True,
+        "no_warnings": True,
+        "outtmpl": str(tmp_path / "clip.%(ext)s"),
+    }
+
+    async def run():
+        active = set()
+        runner, url = await serve(active)
+        started = asyncio.Event()
+        try:
+            download = asyncio.ensure_future(
+                pool.download(url, options, progress=lambda _event: started.set())
+            )
+            await asyncio.wait_for(started.wait(), 60)
+            download.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await download
+            # the worker hung up instead of finishing the download
+            await wait_idle(active, 10)
+            # and its only worker is free for the next job
+            began = time.monotonic()
+            info = await pool.extract(url, {"quiet": True, "no_warnings": True})
+            assert info["ext"] == "mp4"
+            assert time.monotonic() - began < 10
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_dead_worker_raises_ytdl_error_and_the_pool_restarts(pool):
+    async def run():
+        runner, url = await serve(set())
+        options = {"quiet": True, "no_warnings": True}
+        try:
+            await pool.extract(url, options)
+            for process in pool._executor._processes.values():
+                os.kill(process.pid, signal.SIGKILL)
+            with pytest.raises(YtdlError):
+                await pool.extract(url, options)
+            assert (await pool.extract(url, options))["ext"] == "mp4"
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_progress_callback_errors_are_logged(pool, caplog):
+    async def broken(_event):
+        raise RuntimeError("boom")
+
+    async def run():
+        pool._dispatch(broken, {})
+        assert len(pool._tasks) == 1
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert not pool._tasks
+
+    with caplog.at_level("INFO", logger="plugins.functions.ytdl_pool"):
+        asyncio.run(run())
+    assert "boom" in caplog.text
@@ -0,0 +1,34 @@
+import asyncio
+import sys
+import time
+
+from plugins.functions.ytdl_progress import PROGRESS_PREFIX, stream_ytdl
+
+SCRIPT = f"""
+import sys
+for i in range(1, 51):
+    print("{PROGRESS_PREFIX}downloading|%d|50|NA|1|NA|NA|NA" % i, flush=True)
+print("ERROR: unable to download", file=sys.stderr)
+sys.exit(1)
+"""
+
+
+def test_slow_callback_does_not_block_reader():
+    seen = []
+
+    async def on_event(event):
+        seen.append(event["downloaded_bytes"])
+        await asyncio.sleep(0.2)
+
+    async def run():
+        started = time.monotonic()
+        result = await stream_ytdl([sys.executable, "-c", SCRIPT], on_event=on_event)
+        return result, time.monotonic() - started
+
+    (stderr, stdout, process), elapsed = asyncio.run(run())
+    assert process.returncode == 1
+    assert "unable to download" in stderr
+    assert stdout == ""
+    # 50 inline edits would take 10 seconds
+    assert elapsed < 5
+    assert seen and seen == sorted(seen)
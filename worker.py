@@ -0,0 +1,180 @@
+"""Worker process running the download/upload jobs the bot queues in JOB_QUEUE"""
+
+import asyncio
+import logging
+import os
+import socket
+
+from pyrogram import Client, types
+
+from config import Config
+from plugins.button import youtube_dl_call_back
+from plugins.dl_button import ddl_call_back
+from plugins.functions.http_client import http_client
+from plugins.functions.job_queue import CANCELLED, CANCELLING, DONE, ERROR, job_queue
+from plugins.functions.jobs import job_registry
+from plugins.functions.scheduler import job_host, scheduler
+from plugins.functions.storage import storage
+from plugins.functions.stream_upload import close_media_sessions
+from plugins.functions.upload_farm import upload_farm
+
+logging.basicConfig(
+    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+logging.getLogger("pyrogram").setLevel(logging.WARNING)
+
+WORKER_NAME = os.environ.get("WORKER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def keep_alive(job_id, active):
+    """
+    Renew the lease of a job, and stop it once the user cancelled it.
+
+    A job whose lease was lost, queued again for another worker or
+    cancelled meanwhile, is stopped as well: it must not run twice.
+    """
+    while True:
+        await asyncio.sleep(Config.WORKER_POLL_INTERVAL)
+        try:
+            state = await job_queue.heartbeat(job_id, WORKER_NAME)
+        except Exception as e:
+            logger.info("Error %s", e)
+            continue
+        if state is None:
+            logger.warning("Lease of job %s lost, stopping it", job_id)
+            active.cancel()
+        elif state == CANCELLING:
+            active.cancel()
+
+
+async def run_job(client, job):
+    """
+    Run a queued job like the callback handlers of the bot would.
+
+    Parameters:
+    - client (pyrogram.Client): The worker's client, logged in with the bot token.
+    - job (dict): The claimed job.
+
+    Returns:
+    str: Final state of the job.
+    """
+    message = await client.get_messages(job["chat_id"], job["message_id"])
+    user = await client.get_users(job["user_id"])
+    # the handlers only read the status message and the user of the button
+    update = types.CallbackQuery(
+        client=client,
+        id="",
+        from_user=user,
+        chat_instance="",
+        message=message,
+        data="",
+    )
+    payload = job["payload"]
+    async with job_registry.track(
+        user.id, message, job["kind"], job_id=job["id"]
+    ) as active:
+        heartbeat = asyncio.ensure_future(keep_alive(job["id"], active))
+        try:
+            async with scheduler.slot(
+                user.id, job_host(message.reply_to_message.text), job["kind"]
+            ):
+                if job["kind"] == "ytdl":
+                    await youtube_dl_call_back(
+                        client, update, payload["session"], payload["choice"]
+                    )
+                else:
+                    await ddl_call_back(client, update, payload["choice"])
+        finally:
+            heartbeat.cancel()
+    return CANCELLED if active.cancelled else DONE
+
+
+async def process(client, job):
+    try:
+        state = await run_job(client, job)
+    except asyncio.CancelledError:
+        # the worker stops: the lease expires and another worker runs the job
+        raise
+    except Exception as e:
+        logger.exception("Job %s failed: %s", job["id"], e)
+        state = ERROR
+    if await job_queue.finish(job["id"], WORKER_NAME, state):
+        logger.info("Job %s %s", job["id"], state)
+    else:
+        logger.info("Job %s ended after its lease was lost", job["id"])
+
+
+async def serve(client):
+    """Claim and run jobs until cancelled, as many at once as the scheduler allows."""
+    running = set()
+    try:
+        while True:
+            running = {task for task in running if not task.done()}
+            while len(running) < scheduler.global_limit:
+                job = await job_queue.claim(WORKER_NAME)
+                if job is None:
+                    break
+                logger.info(
+                    "Job %s (%s) of %s claimed", job["id"], job["kind"], job["user_id"]
+                )
+                running.add(asyncio.ensure_future(process(client, job)))
+            await asyncio.sleep(Config.WORKER_POLL_INTERVAL)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def work():
+    client = Client(
+        f"All-Url-Uploader-worker-{WORKER_NAME}",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN,
+        in_memory=True,
+        no_updates=True,
+    )
+    http_client.start()
+    await client.start()
+    await upload_farm.start()
+    storage.start_janitor()
+    logger.info("Worker %s started", WORKER_NAME)
+
+    try:
+        await serve(client)
+    finally:
+        await close_media_sessions()
+        await upload_farm.stop()
+        await client.stop()
+        await http_client.close()
+
+
+def main():
+    if job_queue is None:
+        logger.error("Please set JOB_QUEUE to the queue shared with the bot")
+        quit(1)
+
+    if not Config.BOT_TOKEN:
+        logger.error("Please set BOT_TOKEN in config.py or as env var")
+        quit(1)
+
+    if not Config.API_ID:
+        logger.error("Please set API_ID in config.py or as env var")
+        quit(1)
+
+    if not Config.API_HASH:
+        logger.error("Please set API_HASH in config.py or as env var")
+        quit(1)
+
+    if not os.path.isdir(Config.DOWNLOAD_LOCATION):
+        os.makedirs(Config.DOWNLOAD_LOCATION)
+
+    try:
+        asyncio.run(work())
+    except KeyboardInterrupt:
+        logger.info("Worker %s stopped", WORKER_NAME)
+
+
+if __name__ == "__main__":
+    main()